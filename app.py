@@ -1,28 +1,67 @@
-from flask import Flask, render_template, request, redirect, session, url_for, jsonify, flash, send_file
+from flask import Flask, render_template, request, redirect, session, url_for, jsonify, flash, send_file, \
+    Response, stream_with_context, make_response, g
 import sqlite3
+import click
 import os
 import time
 import shutil
-import base64
 from werkzeug.utils import secure_filename
-import openpyxl
-from io import BytesIO
+
+import db
+import migrations
+import fiches
+import svg_store
+import images
+import blobstore
+import xlsx_export
+import fiche_import
+import datatables
+import search
+import page_cache
+import fiche_pdf
+import catalogue_export
+import jobs
+import chunked_upload
+import cpid_listing
+import row_edits
+import compression
+import instrumentation
+from fiches import load_fiche, load_fiches
+from db import DB_NAME, get_db, transaction
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
+db.init_app(app)
+# Registered first, so its after_request runs last and times the compression too
+instrumentation.init_app(app)
+compression.init_app(app)
 
-DB_NAME = "FicheTechnique.db"
 UPLOAD_FOLDER = "static/uploads"
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'pdf'}
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# "sidecar": exploded-view images stored next to the SVG; "embedded": base64 inside it
+app.config['VUE_ECLATEE_STORAGE'] = os.environ.get('VUE_ECLATEE_STORAGE', svg_store.STORAGE_SIDECAR)
+# Optional on-disk copy of the annotation cache, shared by all workers
+svg_store.annotation_cache.disk_dir = os.environ.get('ANNOTATION_CACHE_DIR') or None
+page_cache.fiche_pages.maxsize = int(os.environ.get('PAGE_CACHE_SIZE', 1024))
+app.config['PDF_CACHE_DIR'] = os.environ.get('PDF_CACHE_DIR') or os.path.join(app.instance_path, 'pdf')
+fiche_pdf.renderer.workers = int(os.environ.get('PDF_WORKERS', 0)) or fiche_pdf.renderer.workers
+# Background job threads per process; 0 leaves the queue to `flask run-jobs`
+jobs.runner.threads = int(os.environ.get('JOB_THREADS', 2))
+# Upload limits: a whole form post (Werkzeug spools its files to disk), and
+# one exploded-view drawing sent in chunks (see chunked_upload.py)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_REQUEST_MB', 64)) * 1024 * 1024
+app.config['MAX_UPLOAD_SIZE'] = int(os.environ.get('MAX_UPLOAD_MB', 512)) * 1024 * 1024
 
 # Base path configuration
 BASE_PATH = '/tools/fiches'  # Change this to '' if not using subpath
 
 
-# Fields that should NOT be copied (text fields that need translation)
+# Fields that should NOT be copied (text fields that need translation).
+# Exploded-view component labels and drawing names are translated too; they
+# live in fiche_component / fiche_drawing (see fiches.localize_children).
 TRANSLATABLE_FIELDS = {
     'variant', 'description', 'variant_name',
     'hauteur', 'largeur', 'epaisseur', 'epaisseur_battent', 'tolerance_hauteur',
@@ -30,10 +69,11 @@ TRANSLATABLE_FIELDS = {
     'nbn_s_01_400', 'nbn_en_iso_717_1'
 }
 
-for i in range(1, 23):
-    TRANSLATABLE_FIELDS.add(f'vue_eclatee_{i}')
-for i in range(1, 7):
-    TRANSLATABLE_FIELDS.add(f'dessin_technique_nom_{i}')
+# Technical drawing slots on the form (5 horizontal + 1 vertical)
+DRAWING_SLOTS = 6
+
+# Product type as stored on the Dutch rows
+TYPE_NAMES_NL = fiches.TYPE_NAMES_NL
 
 
 # -------------------- HELPER: Get Base Path --------------------
@@ -43,73 +83,13 @@ def get_base_url():
 
 # -------------------- DATABASE INIT --------------------
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS fiche_technique (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        cpid TEXT NOT NULL,
-        reference TEXT NOT NULL,
-        reference_menu TEXT NOT NULL,
-        variant TEXT,
-        langue TEXT DEFAULT 'fr',
-	    type TEXT,
-        description TEXT,
-        variant_image TEXT,
-        variant_name TEXT,
-        photo_produit TEXT,
-        hauteur TEXT,
-        largeur TEXT,
-        epaisseur TEXT,
-	    epaisseur_battent TEXT,
-        tolerance_hauteur TEXT,
-        verre TEXT,
-	    battant TEXT,
-	    panneau TEXT,
-        poids_porte_cloison  TEXT,
-        resistance_feu TEXT,
-        nbn_s_01_400 TEXT,
-        nbn_en_iso_717_1 TEXT,
-        vue_eclatee_image TEXT,
-        vue_eclatee_1 TEXT,
-        vue_eclatee_2 TEXT,
-        vue_eclatee_3 TEXT,
-        vue_eclatee_4 TEXT,
-        vue_eclatee_5 TEXT,
-        vue_eclatee_6 TEXT,
-        vue_eclatee_7 TEXT,
-        vue_eclatee_8 TEXT,
-        vue_eclatee_9 TEXT,
-        vue_eclatee_10 TEXT,
-        vue_eclatee_11 TEXT,
-        vue_eclatee_12 TEXT,
-        vue_eclatee_13 TEXT,
-        vue_eclatee_14 TEXT,
-        vue_eclatee_15 TEXT,
-        vue_eclatee_16 TEXT,
-        vue_eclatee_17 TEXT,
-        vue_eclatee_18 TEXT,
-        vue_eclatee_19 TEXT,
-        vue_eclatee_20 TEXT,
-        vue_eclatee_21 TEXT,
-        vue_eclatee_22 TEXT,
-        vue_eclatee_count INTEGER DEFAULT 0,
-        dessin_technique_1 TEXT,
-        dessin_technique_2 TEXT,
-        dessin_technique_3 TEXT,
-        dessin_technique_4 TEXT,
-        dessin_technique_5 TEXT,
-        dessin_technique_6 TEXT,
-        dessin_technique_nom_1 TEXT,
-        dessin_technique_nom_2 TEXT,
-        dessin_technique_nom_3 TEXT,
-        dessin_technique_nom_4 TEXT,
-        dessin_technique_nom_5 TEXT,
-        dessin_technique_nom_6 TEXT
-    )
-    """)
-    conn.commit()
-    conn.close()
+    # Creates the schema on a fresh database and applies any pending
+    # migrations (tracked in PRAGMA user_version) — see migrations.py
+    conn = db.connect(DB_NAME)
+    try:
+        migrations.migrate(conn)
+    finally:
+        conn.close()
 
 
 init_db()
@@ -117,50 +97,63 @@ init_db()
 
 # -------------------- HELPER --------------------
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pooled, WAL-mode connection bound to the current request (see db.py).
+    # It is returned to the pool at teardown — routes must not close it.
+    return get_db()
+
+
+def queue_job(kind, payload, key=None):
+    """
+    Queue a background job (see jobs.py). Its id is kept in g.jobs so the
+    response can hand it to the browser for polling (/api/jobs).
+    """
+    job_id = jobs.enqueue(get_db_connection(), kind, payload, key=key)
+    g.setdefault('jobs', []).append(job_id)
+    return job_id
 
 
-def calculate_vue_eclatee_count(data):
-    count = 0
-    for i in range(1, 23):
-        field_name = f"vue_eclatee_{i}"
-        value = data.get(field_name)
-        if value and value.strip():
-            count += 1
-    return count
+def remember_jobs():
+    # Jobs queued by a form post, polled by home.js on the page redirected to
+    if g.get('jobs'):
+        session['pending_jobs'] = session.get('pending_jobs', []) + g.jobs
 
 
-def save_file(file, cpid="image", field_name="file"):
+def save_file(file, cpid="image", field_name="file", current=None):
+    """
+    Store an upload in the content-addressed blob store (see blobstore.py):
+    identical files uploaded for several CPIDs/fields share one copy.
+    cpid and field_name are kept for callers; the stored name is the hash.
+    Its WebP derivatives are built by a background job, unless the upload
+    is the `current` file of the field again.
+    Returns "uploads/blobs/<sha256>.<ext>".
+    """
     if file and file.filename:
         filename = secure_filename(file.filename)
         _, ext = os.path.splitext(filename)
 
-        # Includes both cpid and field name: TEST123_photo_produit_1710672000.jpg
-        unique_filename = f"{cpid}_{field_name}{ext}"
-
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        blob = blobstore.put(app.config['UPLOAD_FOLDER'], file.stream, ext, get_db_connection())
+        if images.supports(blob) and f"uploads/{blob}" != current:
+            queue_job("derivatives", {"filename": blob})
 
-        return f"uploads/{unique_filename}"
+        return f"uploads/{blob}"
     return None
 
 
-def save_vue_eclatee_as_svg(file, cpid=None):
+def save_vue_eclatee_as_svg(file, cpid=None, annotations=()):
     """
-    Save the uploaded image and create an SVG wrapper around it.
-    The SVG embeds the image as base64, with no annotation layer yet.
+    Save the uploaded image and queue the creation of the SVG wrapper around
+    it, with the given annotations (none by default) — see the "vue_eclatee"
+    job. The image is stored in uploads/blobs/<sha256>.<ext>; by default
+    (VUE_ECLATEE_STORAGE="sidecar") the SVG only references it, with
+    "embedded" the job base64-encodes it into the SVG (see svg_store.py).
     If cpid is provided, the SVG is saved as <cpid>.svg.
     Otherwise falls back to the original filename.
-    Returns the path to the .svg file: uploads/<cpid>.svg
-    Only ONE file is created — no _original copy needed.
+    Returns the path the .svg file will have: uploads/<cpid>.svg
     """
     if not file or not file.filename:
         return None
 
     filename = secure_filename(file.filename)
-    _, ext = os.path.splitext(filename)
 
     # Use CPID as the SVG filename if provided, otherwise use original name
     if cpid:
@@ -168,37 +161,26 @@ def save_vue_eclatee_as_svg(file, cpid=None):
     else:
         name, _ = os.path.splitext(filename)
 
-    # Save the raw image temporarily using original filename
-    raw_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(raw_path)
-
-    # Read and base64-encode the image
-    with open(raw_path, 'rb') as f:
-        img_data = base64.b64encode(f.read()).decode('utf-8')
-
-    mime = 'image/png' if ext.lower() == '.png' else 'image/jpeg'
-
-    # Build SVG with embedded image and empty annotations group
-    svg_content = f'''<?xml version="1.0" encoding="UTF-8"?>
-<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"
-     width="700" height="900" viewBox="0 0 700 900">
-  <!-- Embedded source image — never modified -->
-  <image id="source-image" x="0" y="0" width="700" height="900"
-         xlink:href="data:{mime};base64,{img_data}"
-         preserveAspectRatio="none"/>
-  <!-- Annotations layer — updated by editor -->
-  <g id="annotations"></g>
-</svg>'''
-
-    svg_filename = name + '.svg'
-    svg_path = os.path.join(app.config['UPLOAD_FOLDER'], svg_filename)
-    with open(svg_path, 'w', encoding='utf-8') as f:
-        f.write(svg_content)
+    # Bad annotations must fail here, before anything is stored
+    svg_store.annotations_markup(annotations)
+    _, ext = os.path.splitext(filename)
+    blob = blobstore.put(app.config['UPLOAD_FOLDER'], file.stream, ext or '.png', get_db_connection())
+    return queue_vue_eclatee(name, blob, annotations)
+
 
-    # Remove the temporary raw image
-    os.remove(raw_path)
+def save_vue_eclatee_from_upload(upload_id, cpid=None, annotations=()):
+    """save_vue_eclatee_as_svg() for an image sent beforehand in chunks (/api/uploads)."""
+    svg_store.annotations_markup(annotations)
+    blob, filename = chunked_upload.take(app.config['UPLOAD_FOLDER'], upload_id, get_db_connection())
+    name = secure_filename(cpid) if cpid else os.path.splitext(secure_filename(filename))[0]
+    return queue_vue_eclatee(name, blob, annotations)
 
-    return f"uploads/{svg_filename}"
+
+def queue_vue_eclatee(name, blob, annotations=()):
+    """Queue the writing of uploads/<name>.svg around `blob`; returns that path."""
+    queue_job("vue_eclatee", {"name": name, "blob": blob, "mode": app.config['VUE_ECLATEE_STORAGE'],
+                              "annotations": list(annotations)}, key=f"{name}.svg")
+    return f"uploads/{name}.svg"
 
 
 def allowed_file(filename):
@@ -231,7 +213,9 @@ def copy_svg_for_new_cpid(existing_svg_path, new_cpid):
     """
     When creating a new CPID by copying from an existing one, if the existing
     record has an SVG vue éclatée, copy that SVG file and rename it after the
-    new CPID so each record has its own independent SVG file.
+    new CPID so each record has its own independent SVG file (annotations).
+    The source image is not copied: both SVGs reference the same blob (see
+    svg_store.copy_svg), and the source SVG is left untouched.
 
     existing_svg_path: relative path stored in DB, e.g. "uploads/A123456789.svg"
     new_cpid: the CPID of the new record, e.g. "A987654321"
@@ -254,6 +238,9 @@ def copy_svg_for_new_cpid(existing_svg_path, new_cpid):
     dst_path = os.path.join(app.config['UPLOAD_FOLDER'], new_svg_filename)
 
     try:
+        if app.config['VUE_ECLATEE_STORAGE'] == svg_store.STORAGE_SIDECAR and svg_store.copy_svg(
+                app.config['UPLOAD_FOLDER'], src_path, secure_filename(new_cpid)):
+            return f"uploads/{new_svg_filename}"
         shutil.copy2(src_path, dst_path)
         return f"uploads/{new_svg_filename}"
     except Exception:
@@ -270,30 +257,64 @@ def home():
     base = get_base_url()
 
     conn = get_db_connection()
-    rows = conn.execute(
-        "SELECT DISTINCT cpid FROM fiche_technique WHERE type=? AND langue='fr'",
-        (type_selected,)
-    ).fetchall()
-    cpids = [row['cpid'].strip() for row in rows]
+    # Sorted listing kept by triggers — see cpid_listing.py. Past
+    # INLINE_LIMIT CPIDs the selector fetches them as you type (/api/cpids)
+    cpid_total = cpid_listing.count(conn, type_selected)
+    cpids_remote = cpid_total > cpid_listing.INLINE_LIMIT
+    cpids = [] if cpids_remote else list(cpid_listing.listing(conn, type_selected)[1])
 
     if cpid_selected and cpid_selected not in cpids:
         cpids.append(cpid_selected)
-
-    conn.close()
-    cpids = sorted(cpids, key=str.lower)
+        cpids = sorted(cpids, key=str.lower)
+    # Image jobs queued by the last add/update, polled by home.js
+    pending_jobs = session.pop('pending_jobs', [])
 
     if type_selected == "Cloison":
         return render_template("homeCloison.html",
                                cpids=cpids,
                                type_selected=type_selected,
                                base=base,
-                               cpid_selected=cpid_selected)
+                               cpid_selected=cpid_selected,
+                               cpid_total=cpid_total,
+                               cpids_remote=cpids_remote,
+                               pending_jobs=pending_jobs)
     else:
         return render_template("homePorte.html",
                                cpids=cpids,
                                type_selected=type_selected,
                                base=base,
-                               cpid_selected=cpid_selected)
+                               cpid_selected=cpid_selected,
+                               cpid_total=cpid_total,
+                               cpids_remote=cpids_remote,
+                               pending_jobs=pending_jobs)
+
+
+@app.route("/api/cpids")
+@app.route(f"{BASE_PATH}/api/cpids")
+def cpid_list():
+    """
+    CPIDs of a type, sorted: /api/cpids?type=Cloison -> all of them,
+    &q=<text>&limit=50 -> typeahead lookup. ETag'd on the type's listing version.
+    """
+    product_type = request.args.get("type", "Cloison")
+    text = request.args.get("q")
+    conn = get_db_connection()
+    current = cpid_listing.version(conn, product_type)
+    etag = cpid_listing.etag(product_type, current, text, request.args.get("limit"))
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        if text is None:
+            cpids = cpid_listing.listing(conn, product_type)[1]
+        else:
+            try:
+                cpids = cpid_listing.lookup(conn, product_type, text, request.args.get("limit", 50))
+            except ValueError:
+                return jsonify({"error": "Paramètre invalide : limit"}), 400
+        response = jsonify({"type": product_type, "version": current, "cpids": cpids})
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 
 # -------------------- ADD FICHE --------------------
@@ -310,21 +331,17 @@ def add_fiche():
         return redirect(f"{base}/?type={ref_type}")
 
     conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
 
     existing = conn.execute("SELECT * FROM fiche_technique WHERE cpid=?", (cpid,)).fetchall()
     if existing:
         flash("Cette CPID existe déjà. Utilisez 'Mettre à jour' pour la modifier.", "danger")
-        conn.close()
         return redirect(f"{base}/?type={ref_type}")
 
     previous_images = {}
     if previous_ref:
-        prev = conn.execute(
-            "SELECT * FROM fiche_technique WHERE cpid=? AND langue='fr'", (previous_ref,)
-        ).fetchone()
+        prev = fiches.load_fiche_language(conn, previous_ref, "fr")
         if prev:
-            previous_images = dict(prev)
+            previous_images = fiches.flatten_children(prev)
 
     data_fr = {}
     for key, value in request.form.items():
@@ -339,10 +356,8 @@ def add_fiche():
     en_translations = extract_translations(request.form, "en")
     nl_translations = extract_translations(request.form, "nl")
 
-    file_fields = [
-        "variant_image", "photo_produit",
-        "dessin_technique_1", "dessin_technique_2", "dessin_technique_3",
-        "dessin_technique_4", "dessin_technique_5", "dessin_technique_6"
+    file_fields = ["variant_image", "photo_produit"] + [
+        f"dessin_technique_{i}" for i in range(1, DRAWING_SLOTS + 1)
     ]
 
     for f in file_fields:
@@ -373,45 +388,50 @@ def add_fiche():
         old = previous_images.get("vue_eclatee_image")
         data_fr["vue_eclatee_image"] = copy_svg_for_new_cpid(old, cpid) if old else None
 
-    data_fr["vue_eclatee_count"] = calculate_vue_eclatee_count(data_fr)
+    # Components and drawings go to their child tables, per language row
+    components_fr, drawings_fr = fiches.split_children(data_fr)
+    components_en, drawings_en = fiches.localize_children(drawings_fr, en_translations)
+    components_nl, drawings_nl = fiches.localize_children(drawings_fr, nl_translations)
 
     try:
-        cols_fr = ", ".join(data_fr.keys())
-        placeholders_fr = ", ".join(["?"] * len(data_fr))
-        conn.execute(f"INSERT INTO fiche_technique ({cols_fr}) VALUES ({placeholders_fr})", list(data_fr.values()))
-
-        data_en = data_fr.copy()
-        data_en["langue"] = "en"
-        for field in TRANSLATABLE_FIELDS:
-            if field in data_en:
-                data_en[field] = None
-        for key, value in en_translations.items():
-            if key in data_en and value and value.strip():
-                data_en[key] = value
-        cols_en = ", ".join(data_en.keys())
-        placeholders_en = ", ".join(["?"] * len(data_en))
-        conn.execute(f"INSERT INTO fiche_technique ({cols_en}) VALUES ({placeholders_en})", list(data_en.values()))
-
-        data_nl = data_fr.copy()
-        data_nl["langue"] = "nl"
-        for field in TRANSLATABLE_FIELDS:
-            if field in data_nl:
-                data_nl[field] = None
-        for key, value in nl_translations.items():
-            if key in data_nl and value and value.strip():
-                data_nl[key] = value
-        cols_nl = ", ".join(data_nl.keys())
-        placeholders_nl = ", ".join(["?"] * len(data_nl))
-        conn.execute(f"INSERT INTO fiche_technique ({cols_nl}) VALUES ({placeholders_nl})", list(data_nl.values()))
-
-        conn.commit()
+        with transaction(conn):
+            cols_fr = ", ".join(data_fr.keys())
+            placeholders_fr = ", ".join(["?"] * len(data_fr))
+            cur = conn.execute(f"INSERT INTO fiche_technique ({cols_fr}) VALUES ({placeholders_fr})", list(data_fr.values()))
+            fiches.write_children(conn, cur.lastrowid, components_fr, drawings_fr)
+
+            data_en = data_fr.copy()
+            data_en["langue"] = "en"
+            for field in TRANSLATABLE_FIELDS:
+                if field in data_en:
+                    data_en[field] = None
+            for key, value in en_translations.items():
+                if key in data_en and value and value.strip():
+                    data_en[key] = value
+            cols_en = ", ".join(data_en.keys())
+            placeholders_en = ", ".join(["?"] * len(data_en))
+            cur = conn.execute(f"INSERT INTO fiche_technique ({cols_en}) VALUES ({placeholders_en})", list(data_en.values()))
+            fiches.write_children(conn, cur.lastrowid, components_en, drawings_en)
+
+            data_nl = data_fr.copy()
+            data_nl["langue"] = "nl"
+            data_nl["type"] = TYPE_NAMES_NL.get(ref_type, ref_type)
+            for field in TRANSLATABLE_FIELDS:
+                if field in data_nl:
+                    data_nl[field] = None
+            for key, value in nl_translations.items():
+                if key in data_nl and value and value.strip():
+                    data_nl[key] = value
+            cols_nl = ", ".join(data_nl.keys())
+            placeholders_nl = ", ".join(["?"] * len(data_nl))
+            cur = conn.execute(f"INSERT INTO fiche_technique ({cols_nl}) VALUES ({placeholders_nl})", list(data_nl.values()))
+            fiches.write_children(conn, cur.lastrowid, components_nl, drawings_nl)
+
         flash(f"CPID '{cpid}' ajoutée avec succès en FR, EN et NL !", "success")
     except Exception as e:
-        conn.rollback()
         flash(f"Erreur lors de l'ajout : {e}", "danger")
-    finally:
-        conn.close()
 
+    remember_jobs()
     return redirect(f"{base}/?type={ref_type}&cpid={cpid}")
 
 
@@ -419,30 +439,108 @@ def add_fiche():
 @app.route("/get_fiche/<cpid>")
 @app.route(f"{BASE_PATH}/get_fiche/<cpid>")
 def get_fiche(cpid):
+    """
+    The fr/en/nl rows of a CPID. ?format=compact gives the lighter shape
+    of fiches.compact_record (shared values once, nulls left out), which
+    the edit form loads; ?fields=a,b reads and returns only those fields.
+    """
     conn = get_db_connection()
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()] or None
+    columns, children = None, True
+    if fields:
+        try:
+            columns, children = fiches.projection(conn, fields)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    fiche = load_fiche(conn, cpid, columns=columns, children=children)
+
+    if not fiche["fr"]:
+        return jsonify({"error": "CPID introuvable"}), 404
 
-    fr = conn.execute(
-        "SELECT * FROM fiche_technique WHERE cpid=? AND langue='fr'", (cpid,)
-    ).fetchone()
-    en = conn.execute(
-        "SELECT * FROM fiche_technique WHERE cpid=? AND langue='en'", (cpid,)
-    ).fetchone()
-    nl = conn.execute(
-        "SELECT * FROM fiche_technique WHERE cpid=? AND langue='nl'", (cpid,)
-    ).fetchone()
+    if request.args.get("format") == "compact":
+        return jsonify(fiches.compact_record(fiche, TRANSLATABLE_FIELDS, fields))
+    return jsonify(fiche)
 
-    conn.close()
 
-    if not fr:
-        return jsonify({"error": "CPID introuvable"}), 404
+@app.route("/get_fiches")
+@app.route(f"{BASE_PATH}/get_fiches")
+def get_fiches():
+    """
+    Batch variant of get_fiche for tooling: /get_fiches?cpid=A&cpid=B
+    (or ?cpids=A,B). Unknown CPIDs are simply absent from the result.
+    """
+    cpids = request.args.getlist("cpid")
+    for value in request.args.getlist("cpids"):
+        cpids.extend(c.strip() for c in value.split(","))
 
-    fr_dict = dict(fr)
+    if not cpids:
+        return jsonify({"error": "Aucune CPID fournie"}), 400
+
+    return jsonify(load_fiches(get_db_connection(), cpids))
 
-    return jsonify({
-        "fr": fr_dict,
-        "en": dict(en) if en else None,
-        "nl": dict(nl) if nl else None
-    })
+
+# -------------------- SEARCH --------------------
+@app.route("/api/search")
+@app.route(f"{BASE_PATH}/api/search")
+def search_fiches():
+    """
+    Ranked full-text search over every language: /api/search?q=EI60 44 dB
+    Optional lang (language of the returned rows, default fr) and limit.
+    """
+    q = request.args.get("q", "")
+    langue = request.args.get("lang", "fr")
+    if langue not in fiches.LANGUES:
+        return jsonify({"error": "Langue invalide"}), 400
+    try:
+        results = search.search(get_db_connection(), q, langue, request.args.get("limit", 20))
+    except ValueError:
+        return jsonify({"error": "Paramètre invalide : limit"}), 400
+    return jsonify({"query": q, "results": results})
+
+
+# -------------------- IMAGE DERIVATIVES (srcset) --------------------
+@app.template_global()
+def image_srcset(path):
+    """
+    srcset value listing the WebP derivatives of an uploaded image, e.g.
+    {{ image_srcset(fiche.photo_produit) }}. Empty when there are none
+    (SVG/PDF, missing file, Pillow not installed) — the src then applies.
+    """
+    if not path or not path.startswith('uploads/') or not images.supports(path):
+        return ""
+    filename = path[len('uploads/'):]
+    try:
+        version = f"{os.stat(os.path.join(app.config['UPLOAD_FOLDER'], filename)).st_mtime_ns:x}"
+    except OSError:
+        return ""
+    return ", ".join(
+        f"{url_for('image_derivative', width=w, filename=filename, v=version)} {w}w"
+        for w in images.WIDTHS
+    )
+
+
+@app.route('/derivative/<int:width>/<path:filename>')
+@app.route(f"{BASE_PATH}/derivative/<int:width>/<path:filename>")
+def image_derivative(width, filename):
+    """Serve (building it on first request) a resized WebP copy of uploads/<filename>."""
+    folder = os.path.realpath(app.config['UPLOAD_FOLDER'])
+    source = os.path.realpath(os.path.join(folder, filename))
+    if (width not in images.WIDTHS or not images.supports(filename)
+            or not source.startswith(folder + os.sep)
+            or filename.startswith(images.DERIVATIVE_DIR + '/')):
+        return "Not found", 404
+
+    try:
+        path = images.derivative_path(app.config['UPLOAD_FOLDER'], filename, width)
+    except Exception:
+        # Unreadable image: let the browser have the original
+        return redirect(url_for('static', filename=f"uploads/{filename}"))
+    if path is None:
+        return "Not found", 404
+
+    # Versioned URLs (?v=<mtime>) never change content: cache them for a year
+    max_age = 31536000 if request.args.get('v') else 0
+    return send_file(os.path.abspath(path), mimetype='image/webp', conditional=True, max_age=max_age)
 
 
 # -------------------- GET SOURCE IMAGE FROM SVG --------------------
@@ -450,7 +548,11 @@ def get_fiche(cpid):
 @app.route(f"{BASE_PATH}/get_source_image/<filename>")
 def get_source_image(filename):
     """
-    Extract the raw embedded image bytes from an SVG file and serve them directly.
+    Serve the source image of an SVG from a file on disk: the sidecar blob it
+    references or, for embedded SVGs, a copy decoded once and reused until
+    the SVG changes (see svg_store.source_image_file).
+    The ETag is the image's sha256, so conditional GETs (304) and Range
+    requests are answered without reading the image again.
     If the file is not an SVG (e.g. old PNG record), return 404 so JS shows the alert.
     """
     safe_filename = secure_filename(filename)
@@ -463,32 +565,18 @@ def get_source_image(filename):
     if not os.path.exists(svg_path):
         return "SVG not found", 404
 
-    import xml.etree.ElementTree as ET
     try:
-        tree = ET.parse(svg_path)
-        root = tree.getroot()
-
-        img_el = root.find('.//{http://www.w3.org/2000/svg}image[@id="source-image"]')
-        if img_el is None:
-            img_el = root.find('.//image[@id="source-image"]')
-
-        if img_el is None:
-            return "Source image element not found in SVG", 404
-
-        href = img_el.get('href') or img_el.get('{http://www.w3.org/1999/xlink}href')
-        if not href or not href.startswith('data:'):
-            return "No embedded data URI found", 404
-
-        header, b64data = href.split(',', 1)
-        mime = header.split(':')[1].split(';')[0]
-        raw_bytes = base64.b64decode(b64data)
-
-        from flask import Response
-        return Response(raw_bytes, mimetype=mime,
-                        headers={"Cache-Control": "no-cache"})
-
+        source = svg_store.source_image_file(app.config['UPLOAD_FOLDER'], svg_path)
     except Exception as e:
         return f"Error extracting image: {e}", 500
+    if source is None:
+        return "No source image found in SVG", 404
+
+    path, mime, etag = source
+    response = send_file(os.path.abspath(path), mimetype=mime, etag=etag, conditional=True)
+    # Revalidate on every open — the same URL serves a new image after a re-upload
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route("/get_svg_annotations/<path:filename>")
@@ -506,29 +594,10 @@ def get_svg_annotations(filename):
     if not os.path.exists(svg_path):
         return jsonify({"error": "SVG not found", "annotations": []}), 200
 
-    import xml.etree.ElementTree as ET
     try:
-        tree = ET.parse(svg_path)
-        root = tree.getroot()
-        ns = {'svg': 'http://www.w3.org/2000/svg'}
-
-        annotations = []
-        ann_group = root.find('.//svg:g[@id="annotations"]', ns)
-        if ann_group is not None:
-            for ann_g in ann_group.findall('svg:g', ns):
-                ann_id = ann_g.get('data-id')
-                ann_x = ann_g.get('data-x')
-                ann_y = ann_g.get('data-y')
-                ann_side = ann_g.get('data-side')
-                if ann_id and ann_x and ann_y and ann_side:
-                    annotations.append({
-                        'id': int(ann_id),
-                        'x': float(ann_x),
-                        'y': float(ann_y),
-                        'side': ann_side
-                    })
-
-        return jsonify({"annotations": annotations})
+        # Served from svg_store.annotation_cache while the file is unchanged;
+        # a miss reads only the annotation layer, never the source image
+        return jsonify({"annotations": svg_store.annotation_cache.get(svg_path)})
     except Exception as e:
         return jsonify({"error": str(e), "annotations": []}), 200
 
@@ -538,88 +607,23 @@ def get_svg_annotations(filename):
 @app.route(f"{BASE_PATH}/save_annotations", methods=['POST'])
 def save_annotations():
     """
-    Receive annotations JSON, open the existing SVG, replace its <g id="annotations">
-    layer with fresh SVG annotation elements. The embedded <image> (base64) is untouched.
-    Only ONE file exists — no _original copy needed.
+    Receive annotations JSON and replace the <g id="annotations"> layer of the
+    existing SVG. Only the layer is rewritten: the rest of the file (including
+    an embedded base64 image) is copied through untouched, and the new file
+    is renamed over the old one so concurrent saves cannot corrupt it.
     """
     data = request.json
-    svg_filename = data['filename']  # e.g. "CPID-001.svg"
+    svg_filename = secure_filename(data['filename'])  # e.g. "CPID-001.svg"
     annotations = data['annotations']
 
     svg_path = os.path.join(app.config['UPLOAD_FOLDER'], svg_filename)
     if not os.path.exists(svg_path):
         return jsonify({'success': False, 'error': 'SVG file not found'}), 404
 
-    import xml.etree.ElementTree as ET
-    ET.register_namespace('', 'http://www.w3.org/2000/svg')
-    ET.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
-
     try:
-        tree = ET.parse(svg_path)
-        root = tree.getroot()
-        ns = {'svg': 'http://www.w3.org/2000/svg'}
-
-        # Remove old annotations group
-        ann_group = root.find('.//svg:g[@id="annotations"]', ns)
-        if ann_group is not None:
-            root.remove(ann_group)
-
-        # Build new annotations group
-        new_group = ET.SubElement(root, '{http://www.w3.org/2000/svg}g')
-        new_group.set('id', 'annotations')
-
-        for ann in annotations:
-            x = float(ann['x'])
-            y = float(ann['y'])
-            side = ann['side']
-            ann_id = int(ann['id'])
-            line_x = 50 if side == 'left' else 650
-
-            # Wrap each annotation in a <g> with data attributes for later parsing
-            g = ET.SubElement(new_group, '{http://www.w3.org/2000/svg}g')
-            g.set('data-id', str(ann_id))
-            g.set('data-x', str(x))
-            g.set('data-y', str(y))
-            g.set('data-side', side)
-
-            # Line from circle to target point
-            line = ET.SubElement(g, '{http://www.w3.org/2000/svg}line')
-            line.set('x1', str(line_x))
-            line.set('y1', str(y))
-            line.set('x2', str(x))
-            line.set('y2', str(y))
-            line.set('stroke', 'black')
-            line.set('stroke-width', '2')
-
-            # Small dot at target
-            dot = ET.SubElement(g, '{http://www.w3.org/2000/svg}circle')
-            dot.set('cx', str(x))
-            dot.set('cy', str(y))
-            dot.set('r', '3')
-            dot.set('fill', 'black')
-
-            # Big circle at line start
-            big = ET.SubElement(g, '{http://www.w3.org/2000/svg}circle')
-            big.set('cx', str(line_x))
-            big.set('cy', str(y))
-            big.set('r', '20')
-            big.set('fill', 'black')
-
-            # Number text
-            text = ET.SubElement(g, '{http://www.w3.org/2000/svg}text')
-            text.set('x', str(line_x))
-            text.set('y', str(y))
-            text.set('text-anchor', 'middle')
-            text.set('dominant-baseline', 'central')
-            text.set('fill', 'white')
-            text.set('font-size', '14')
-            text.set('font-weight', 'bold')
-            text.set('font-family', 'Arial, sans-serif')
-            text.text = str(ann_id)
-
-        # Write back — preserve XML declaration
-        tree.write(svg_path, encoding='unicode', xml_declaration=True)
-
+        # Splices the new layer in place of the old one — see svg_store.write_annotations
+        svg_store.write_annotations(svg_path, annotations)
+        svg_store.annotation_cache.put(svg_path, annotations)
         return jsonify({'success': True, 'image_path': f"uploads/{svg_filename}"})
 
     except Exception as e:
@@ -632,7 +636,8 @@ def save_annotations():
 def create_exploded_view():
     """
     Receive an uploaded image, wrap it in an SVG named after the CPID,
-    and return the SVG filename so the editor can open it.
+    and return the SVG filename so the editor can open it, with the id of
+    the job writing it (202).
     No _original copy is created — the SVG itself is the single source of truth.
     """
     file = request.files.get("vue_eclatee_image")
@@ -648,11 +653,13 @@ def create_exploded_view():
 
     svg_filename = svg_path.split('/')[-1]  # e.g. "CPID-001.svg"
 
+    # The SVG is written by a background job: poll it before opening the editor
     return jsonify({
         "success": "Image uploaded and converted to SVG! Opening editor...",
         "redirect": f"{base}/editor/{svg_filename}",
-        "filename": svg_filename
-    })
+        "filename": svg_filename,
+        "job": g.jobs[-1],
+    }), 202
 
 
 # -------------------- CREATE EXPLODED VIEW WITH ANNOTATIONS (single-shot) --------------------
@@ -661,19 +668,21 @@ def create_exploded_view():
 def create_exploded_view_with_annotations():
     """
     Receive an uploaded image AND annotations JSON in one request.
-    Creates the SVG with the annotations already embedded.
+    Creates the SVG with the annotations already embedded, in a background
+    job whose id is returned (202).
     Called by the JS flush when a brand-new image was edited before form submit.
     This is the lazy path: the image was never sent to the server during editing —
     only now at form-submit time is the file uploaded and SVG created.
+    Instead of the file, upload_id may name an image sent in chunks (/api/uploads).
     """
     import json as _json
-    import xml.etree.ElementTree as ET
 
     file = request.files.get("vue_eclatee_image")
+    upload_id = request.form.get("upload_id", "").strip()
     cpid_name = request.form.get("cpid", "").strip()
     annotations_raw = request.form.get("annotations", "[]")
 
-    if not file or file.filename == '':
+    if not upload_id and (not file or file.filename == ''):
         return jsonify({"error": "No image file provided"}), 400
 
     try:
@@ -681,74 +690,78 @@ def create_exploded_view_with_annotations():
     except Exception:
         annotations = []
 
-    # Step 1: create the base SVG (image embedded, empty annotations group)
-    svg_path = save_vue_eclatee_as_svg(file, cpid=cpid_name if cpid_name else None)
+    # The SVG is written once, with its annotation layer already filled in
+    try:
+        if upload_id:
+            svg_path = save_vue_eclatee_from_upload(upload_id, cpid=cpid_name if cpid_name else None,
+                                                    annotations=annotations)
+        else:
+            svg_path = save_vue_eclatee_as_svg(file, cpid=cpid_name if cpid_name else None,
+                                               annotations=annotations)
+    except chunked_upload.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Failed to write annotations: {e}"}), 500
     if not svg_path:
         return jsonify({"error": "Failed to create SVG"}), 500
 
     svg_filename = svg_path.split('/')[-1]
-    full_svg_path = os.path.join(app.config['UPLOAD_FOLDER'], svg_filename)
-
-    # Step 2: inject annotations into the SVG (same logic as save_annotations)
-    if annotations:
-        try:
-            ET.register_namespace('', 'http://www.w3.org/2000/svg')
-            ET.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
-            tree = ET.parse(full_svg_path)
-            root = tree.getroot()
-            ns = {'svg': 'http://www.w3.org/2000/svg'}
-
-            ann_group = root.find('.//svg:g[@id="annotations"]', ns)
-            if ann_group is not None:
-                root.remove(ann_group)
-
-            new_group = ET.SubElement(root, '{http://www.w3.org/2000/svg}g')
-            new_group.set('id', 'annotations')
-
-            for ann in annotations:
-                x      = float(ann['x'])
-                y      = float(ann['y'])
-                side   = ann['side']
-                ann_id = int(ann['id'])
-                line_x = 50 if side == 'left' else 650
-
-                g = ET.SubElement(new_group, '{http://www.w3.org/2000/svg}g')
-                g.set('data-id', str(ann_id))
-                g.set('data-x', str(x))
-                g.set('data-y', str(y))
-                g.set('data-side', side)
-
-                line = ET.SubElement(g, '{http://www.w3.org/2000/svg}line')
-                line.set('x1', str(line_x)); line.set('y1', str(y))
-                line.set('x2', str(x));      line.set('y2', str(y))
-                line.set('stroke', 'black'); line.set('stroke-width', '2')
-
-                dot = ET.SubElement(g, '{http://www.w3.org/2000/svg}circle')
-                dot.set('cx', str(x)); dot.set('cy', str(y))
-                dot.set('r', '3'); dot.set('fill', 'black')
-
-                big = ET.SubElement(g, '{http://www.w3.org/2000/svg}circle')
-                big.set('cx', str(line_x)); big.set('cy', str(y))
-                big.set('r', '20'); big.set('fill', 'black')
-
-                text = ET.SubElement(g, '{http://www.w3.org/2000/svg}text')
-                text.set('x', str(line_x)); text.set('y', str(y))
-                text.set('text-anchor', 'middle')
-                text.set('dominant-baseline', 'central')
-                text.set('fill', 'white'); text.set('font-size', '14')
-                text.set('font-weight', 'bold')
-                text.set('font-family', 'Arial, sans-serif')
-                text.text = str(ann_id)
-
-            tree.write(full_svg_path, encoding='unicode', xml_declaration=True)
-        except Exception as e:
-            return jsonify({"error": f"Failed to write annotations: {e}"}), 500
 
+    # The SVG is written by a background job: the caller polls it (/api/jobs)
     return jsonify({
         "success": True,
         "filename": svg_filename,
-        "image_path": f"uploads/{svg_filename}"
-    })
+        "image_path": f"uploads/{svg_filename}",
+        "job": g.jobs[-1],
+    }), 202
+
+
+# -------------------- CHUNKED UPLOADS (large drawings) --------------------
+@app.route('/api/uploads', methods=['POST'])
+@app.route(f"{BASE_PATH}/api/uploads", methods=['POST'])
+def upload_create():
+    """Start a resumable upload: {"filename", "size"} -> its status (201) — see chunked_upload.py."""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get("filename", "")))
+    if os.path.splitext(filename)[1].lower() not in svg_store.MIME_BY_EXT:
+        return jsonify({"error": "Type de fichier non pris en charge"}), 400
+    try:
+        size = int(data.get("size", 0))
+        upload = chunked_upload.create(app.config['UPLOAD_FOLDER'], filename, size,
+                                       app.config['MAX_UPLOAD_SIZE'])
+    except (TypeError, ValueError) as e:
+        return _upload_error(e)
+    return jsonify(upload), 201
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PUT'])
+@app.route(f"{BASE_PATH}/api/uploads/<upload_id>", methods=['GET', 'PUT'])
+def upload_chunk(upload_id):
+    """GET: how much of the upload arrived. PUT: the next chunk, raw, with Content-Range."""
+    folder = app.config['UPLOAD_FOLDER']
+    try:
+        if request.method == 'GET':
+            return jsonify(chunked_upload.status(folder, upload_id))
+        return jsonify(chunked_upload.write_chunk(folder, upload_id, request.headers.get('Content-Range'),
+                                                  request.stream))
+    except chunked_upload.UploadError as e:
+        return _upload_error(e)
+
+
+def _upload_error(e):
+    body = {"error": str(e) if isinstance(e, chunked_upload.UploadError) else "Taille invalide"}
+    if getattr(e, 'received', None) is not None:
+        body["received"] = e.received
+    return jsonify(body), getattr(e, 'status', 400)
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    message = f"Fichier trop volumineux (max {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} Mo)"
+    if request.endpoint in ('add_fiche', 'update_fiche'):
+        flash(message, "danger")
+        return redirect(f"{get_base_url()}/?type={request.args.get('type', 'Cloison')}")
+    return jsonify({"error": message}), 413
 
 
 # -------------------- UPDATE --------------------
@@ -764,38 +777,30 @@ def update_fiche():
         return redirect(f"{base}/?type={ref_type}")
 
     conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
-
-    existing_fr = conn.execute(
-        "SELECT * FROM fiche_technique WHERE cpid=? AND langue='fr'", (cpid,)
-    ).fetchone()
-    existing_en = conn.execute(
-        "SELECT * FROM fiche_technique WHERE cpid=? AND langue='en'", (cpid,)
-    ).fetchone()
-    existing_nl = conn.execute(
-        "SELECT * FROM fiche_technique WHERE cpid=? AND langue='nl'", (cpid,)
-    ).fetchone()
+
+    existing = load_fiche(conn, cpid)
+    existing_fr, existing_en, existing_nl = existing["fr"], existing["en"], existing["nl"]
 
     if not existing_fr:
         flash("Référence introuvable", "danger")
-        conn.close()
         return redirect(f"{base}/?type={ref_type}")
 
+    existing_fr_flat = fiches.flatten_children(existing_fr)
+
     data_fr = {}
     for k, v in request.form.items():
         if k not in ["updateRef", "deleteRef", "previous_ref", "vue_eclatee_already_saved"] and not k.startswith(
                 "delete_") and not k.endswith("_nl") and not k.endswith("_en"):
-            data_fr[k] = v
+            # Stored as add_fiche stores them, so unchanged fields compare equal
+            data_fr[k] = v.strip() if v else None
 
     data_fr["type"] = ref_type
 
     en_translations = extract_translations(request.form, "en")
     nl_translations = extract_translations(request.form, "nl")
 
-    files = [
-        "variant_image", "photo_produit",
-        "dessin_technique_1", "dessin_technique_2", "dessin_technique_3",
-        "dessin_technique_4", "dessin_technique_5", "dessin_technique_6"
+    files = ["variant_image", "photo_produit"] + [
+        f"dessin_technique_{i}" for i in range(1, DRAWING_SLOTS + 1)
     ]
 
     # ── FIX: pass cpid=cpid so filenames are CPID_fieldname_timestamp.ext ──
@@ -804,19 +809,20 @@ def update_fiche():
         if delete_flag == "true":
             data_fr[f] = None
         else:
-            uploaded = save_file(request.files.get(f), cpid=cpid, field_name=f)
-            data_fr[f] = uploaded if uploaded else existing_fr[f]
+            uploaded = save_file(request.files.get(f), cpid=cpid, field_name=f, current=existing_fr_flat.get(f))
+            data_fr[f] = uploaded if uploaded else existing_fr_flat.get(f)
 
     # ── Vue éclatée (SVG-based) ──
     # SECURITY FIX: validate vue_eclatee_already_saved belongs to THIS CPID
     # to prevent stale editor sessions from overwriting the wrong record's image.
     delete_vue = request.form.get("delete_vue_eclatee_image")
     vue_already_saved = request.form.get("vue_eclatee_already_saved", "").strip()
+    vue_saved_here = bool(vue_already_saved) and is_valid_svg_for_cpid(vue_already_saved, cpid)
     vue_file = request.files.get("vue_eclatee_image")
 
     if delete_vue == "true":
         data_fr["vue_eclatee_image"] = None
-    elif vue_already_saved and is_valid_svg_for_cpid(vue_already_saved, cpid):
+    elif vue_saved_here:
         # SVG already annotated by editor AND belongs to this CPID — safe to use
         data_fr["vue_eclatee_image"] = f"uploads/{vue_already_saved}"
     elif vue_file and vue_file.filename.strip():
@@ -828,59 +834,59 @@ def update_fiche():
         old = existing_fr["vue_eclatee_image"]
         data_fr["vue_eclatee_image"] = old if old else None
 
-    data_fr["vue_eclatee_count"] = calculate_vue_eclatee_count(data_fr)
+    # Components and drawings go to their child tables, per language row
+    components_fr, drawings_fr = fiches.split_children(data_fr)
+    components_en, drawings_en = fiches.localize_children(drawings_fr, en_translations)
+    components_nl, drawings_nl = fiches.localize_children(drawings_fr, nl_translations)
+
+    data_en = data_fr.copy()
+    for field in TRANSLATABLE_FIELDS:
+        if field in data_en:
+            data_en[field] = None
+    for key, value in en_translations.items():
+        if key in data_en and value and value.strip():
+            data_en[key] = value
+
+    data_nl = data_fr.copy()
+    data_nl["type"] = TYPE_NAMES_NL.get(ref_type, ref_type)
+    for field in TRANSLATABLE_FIELDS:
+        if field in data_nl:
+            data_nl[field] = None
+    for key, value in nl_translations.items():
+        if key in data_nl and value and value.strip():
+            data_nl[key] = value
+
+    # Only the changed columns of the changed rows are written (see
+    # fiches.write_changes); a save that changes nothing takes no write lock.
+    # Annotations the editor saved to this CPID's SVG and queued jobs (same
+    # path, new content) are changes the columns do not show.
+    rows = [("fr", existing_fr, data_fr, components_fr, drawings_fr),
+            ("en", existing_en, data_en, components_en, drawings_en),
+            ("nl", existing_nl, data_nl, components_nl, drawings_nl)]
+    if not vue_saved_here and not g.get('jobs') and all(
+            existing and not fiches.changed_columns(existing, data)
+            and not fiches.children_changed(existing, components, drawings)
+            for _, existing, data, components, drawings in rows):
+        flash(f"CPID '{cpid}' : aucune modification", "info")
+        return redirect(f"{base}/?type={ref_type}&cpid={cpid}")
 
     try:
-        set_clause_fr = ", ".join([f"{k}=?" for k in data_fr.keys()])
-        conn.execute(f"UPDATE fiche_technique SET {set_clause_fr} WHERE cpid=? AND langue=?",
-                     list(data_fr.values()) + [cpid, "fr"])
-
-        data_en = data_fr.copy()
-        for field in TRANSLATABLE_FIELDS:
-            if field in data_en:
-                data_en[field] = None
-        for key, value in en_translations.items():
-            if key in data_en and value and value.strip():
-                data_en[key] = value
-
-        if not existing_en:
-            data_en["cpid"] = cpid
-            data_en["langue"] = "en"
-            cols_en = ", ".join(data_en.keys())
-            placeholders_en = ", ".join(["?"] * len(data_en))
-            conn.execute(f"INSERT INTO fiche_technique ({cols_en}) VALUES ({placeholders_en})", list(data_en.values()))
-        else:
-            set_clause_en = ", ".join([f"{k}=?" for k in data_en.keys()])
-            conn.execute(f"UPDATE fiche_technique SET {set_clause_en} WHERE cpid=? AND langue=?",
-                         list(data_en.values()) + [cpid, "en"])
-
-        data_nl = data_fr.copy()
-        for field in TRANSLATABLE_FIELDS:
-            if field in data_nl:
-                data_nl[field] = None
-        for key, value in nl_translations.items():
-            if key in data_nl and value and value.strip():
-                data_nl[key] = value
-
-        if not existing_nl:
-            data_nl["cpid"] = cpid
-            data_nl["langue"] = "nl"
-            cols_nl = ", ".join(data_nl.keys())
-            placeholders_nl = ", ".join(["?"] * len(data_nl))
-            conn.execute(f"INSERT INTO fiche_technique ({cols_nl}) VALUES ({placeholders_nl})", list(data_nl.values()))
-        else:
-            set_clause_nl = ", ".join([f"{k}=?" for k in data_nl.keys()])
-            conn.execute(f"UPDATE fiche_technique SET {set_clause_nl} WHERE cpid=? AND langue=?",
-                         list(data_nl.values()) + [cpid, "nl"])
+        with transaction(conn):
+            for langue, existing, data, components, drawings in rows:
+                if existing:
+                    fiches.write_changes(conn, existing, data, components, drawings)
+                    continue
+                data = dict(data, cpid=cpid, langue=langue)
+                cols = ", ".join(data.keys())
+                placeholders = ", ".join(["?"] * len(data))
+                cur = conn.execute(f"INSERT INTO fiche_technique ({cols}) VALUES ({placeholders})", list(data.values()))
+                fiches.write_children(conn, cur.lastrowid, components, drawings)
 
-        conn.commit()
         flash(f"CPID '{cpid}' mise à jour avec succès en FR, EN et NL !", "success")
     except Exception as e:
-        conn.rollback()
         flash(f"Erreur lors de la mise à jour : {e}", "danger")
-    finally:
-        conn.close()
 
+    remember_jobs()
     return redirect(f"{base}/?type={ref_type}&cpid={cpid}")
 
 
@@ -898,9 +904,8 @@ def delete_fiche():
 
     try:
         conn = get_db_connection()
-        conn.execute("DELETE FROM fiche_technique WHERE cpid=?", (cpid,))
-        conn.commit()
-        conn.close()
+        with transaction(conn):
+            conn.execute("DELETE FROM fiche_technique WHERE cpid=?", (cpid,))
         flash(f"CPID '{cpid}' supprimée avec succès (versions FR, EN et NL) !", "success")
     except Exception as e:
         flash(f"Erreur lors de la suppression: {e}", "danger")
@@ -921,29 +926,164 @@ def remove_last_part(value):
 def index():
     cpid = request.args.get("cpid")
     lang = request.args.get("lang", "fr")
-    base = get_base_url()
+    if not cpid:
+        return "Référence introuvable", 404
 
-    fiche = None
-    if cpid:
-        conn = get_db_connection()
-        row = conn.execute(
-            "SELECT * FROM fiche_technique WHERE cpid=? AND langue=?", (cpid, lang)
-        ).fetchone()
-        conn.close()
-        if row:
-            fiche = dict(row)
+    # Rendered pages are cached per CPID revision — see page_cache.py
+    conn = get_db_connection()
+    stamp = page_cache.revision(conn, cpid)
+    key = _fiche_page_key(cpid, lang)
+    if stamp:
+        etag = page_cache.etag(key, stamp[0])
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            _page_cache_headers(response, stamp)
+            return response
+
+    html = _fiche_page_html(conn, cpid, lang, key, stamp)
+    if html is None:
+        return "Référence introuvable", 404
+    if not stamp:
+        return html
+    response = make_response(html)
+    response.set_etag(etag)
+    _page_cache_headers(response, stamp)
+    return response.make_conditional(request)
+
+
+def _fiche_page_key(cpid, lang):
+    template = INDEX_TEMPLATES.get(lang, INDEX_TEMPLATES["fr"])[0]
+    return (cpid, lang, request.script_root,
+            page_cache.template_digest(os.path.join(app.root_path, app.template_folder, template)))
+
+
+def _fiche_page_html(conn, cpid, lang, key, stamp):
+    """The public page of a fiche, from the page cache when current; None if it does not exist."""
+    if stamp:
+        html = page_cache.fiche_pages.get(key, stamp[0])
+        if html is not None:
+            return html
 
+    fiche = fiches.load_fiche_language(conn, cpid, lang)
     if not fiche:
-        return "Référence introuvable", 404
+        return None
 
+    template, template_lang = INDEX_TEMPLATES.get(lang, INDEX_TEMPLATES["fr"])
     product_type = fiche.get('type') or fiche.get('Type')
+    # Technical drawings by slot: drawings[1] .. drawings[6], empty slots included
+    drawings = {i: {"image": None, "nom": None} for i in range(1, DRAWING_SLOTS + 1)}
+    drawings.update({d["position"]: d for d in fiche["drawings"]})
+    html = render_template(template, fiche=fiche, drawings=drawings, lang=template_lang,
+                           base=get_base_url(), type=product_type, cpid=cpid)
+    if stamp:
+        page_cache.fiche_pages.put(key, stamp[0], html)
+    return html
+
+
+INDEX_TEMPLATES = {
+    "fr": ("indexHaas.html", "fr"),
+    "en": ("indexHaasEN.html", "en"),
+    "nl": ("indexHaasNL.html", "nl"),
+}
+
+
+def _page_cache_headers(response, stamp):
+    response.last_modified = stamp[1]
+    # Stored by browsers and proxies, revalidated on every use
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
 
-    if lang == "en":
-        return render_template("indexHaasEN.html", fiche=fiche, lang="en", base=base, type=product_type, cpid=cpid)
-    elif lang == "nl":
-        return render_template("indexHaasNL.html", fiche=fiche, lang="nl", base=base, type=product_type, cpid=cpid)
-    else:
-        return render_template("indexHaas.html", fiche=fiche, lang="fr", base=base, type=product_type, cpid=cpid)
+
+# -------------------- PDF (server-side rendering) --------------------
+@app.route('/pdf')
+@app.route(f"{BASE_PATH}/pdf")
+def fiche_pdf_view():
+    """
+    PDF of the public page (/pdf?cpid=…&lang=…). Served from the PDF cache
+    when rendered for the current version; otherwise the render is started
+    in the worker pool and the answer is 202 + Retry-After — see fiche_pdf.py.
+    """
+    cpid = request.args.get("cpid")
+    lang = request.args.get("lang", "fr")
+    if not fiche_pdf.available():
+        return jsonify({"error": "Rendu PDF non disponible sur ce serveur"}), 501
+    if not cpid or lang not in fiches.LANGUES:
+        return jsonify({"error": "Référence introuvable"}), 404
+
+    conn = get_db_connection()
+    target = _fiche_pdf_target(conn, cpid, lang)
+    if target is None:
+        return jsonify({"error": "Référence introuvable"}), 404
+    path, version, key, stamp = target
+
+    try:
+        state = fiche_pdf.renderer.state(path)
+    except Exception as e:
+        return jsonify({"error": f"Erreur lors du rendu PDF : {e}"}), 500
+    if state == "ready":
+        response = send_file(path, mimetype="application/pdf", download_name=f"{cpid}_{lang}.pdf",
+                             etag=version, last_modified=stamp[1], conditional=True)
+        response.cache_control.no_cache = True
+        return response
+
+    if state is None:
+        html = _fiche_page_html(conn, cpid, lang, key, stamp)
+        if html is None:
+            return jsonify({"error": "Référence introuvable"}), 404
+        fiche_pdf.renderer.submit(path, html, app.static_folder, _static_prefixes())
+    response = jsonify({"status": "pending"})
+    response.status_code = 202
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+def _fiche_pdf_target(conn, cpid, lang):
+    """(cache path, version, page key, revision stamp) of a fiche's PDF; None if it does not exist."""
+    stamp = page_cache.revision(conn, cpid)
+    row = conn.execute("SELECT vue_eclatee_image FROM fiche_technique WHERE cpid=? AND langue=?",
+                       (cpid, lang)).fetchone()
+    if not stamp or not row:
+        return None
+
+    # Annotations are saved into the SVG without touching the database
+    svg_stamp = None
+    if row[0]:
+        try:
+            svg_stamp = os.stat(os.path.join(app.static_folder, row[0])).st_mtime_ns
+        except OSError:
+            pass
+    key = _fiche_page_key(cpid, lang)
+    version = page_cache.etag((key, svg_stamp), stamp[0])
+    return fiche_pdf.cache_path(app.config['PDF_CACHE_DIR'], cpid, lang, version), version, key, stamp
+
+
+def _static_prefixes():
+    # URL prefixes of /static the pages may use, read from disk by the renderer
+    return {app.static_url_path, f"{BASE_PATH}{app.static_url_path}",
+            f"{request.script_root}{app.static_url_path}"}
+
+
+# -------------------- CATALOGUE EXPORT (PDF/ZIP) --------------------
+def export_catalogue(target, types=None, langues=fiches.LANGUES, workers=None, progress=None):
+    """PDFs of all fiches of `types` in `langues`, into the ZIP `target` — see catalogue_export.py."""
+    conn = db.connect(DB_NAME)
+    try:
+        with app.test_request_context():
+            def prepare(cpid, lang):
+                pdf = _fiche_pdf_target(conn, cpid, lang)
+                if pdf is None:
+                    return None, None
+                path, _, key, stamp = pdf
+                if os.path.exists(path):
+                    return path, None
+                return path, _fiche_page_html(conn, cpid, lang, key, stamp)
+
+            items = catalogue_export.select_fiches(conn, types, langues)
+            return catalogue_export.export(items, target, prepare, app.static_folder, _static_prefixes(),
+                                           workers=workers, progress=progress)
+    finally:
+        conn.close()
 
 
 # -------------------- DB EDITOR --------------------
@@ -972,11 +1112,19 @@ def db_editor():
     conn = get_db_connection()
     cursor = conn.execute("PRAGMA table_info(fiche_technique)")
     columns = [row[1] for row in cursor.fetchall()]
-    conn.close()
     friendly = {col: FRIENDLY_NAMES.get(col, col.replace('_', ' ').title()) for col in columns}
     return render_template("db_editor.html", columns=columns, friendly=friendly, base=base)
 
 
+@app.route('/metrics')
+@app.route(f'{BASE_PATH}/metrics')
+def metrics():
+    # Prometheus scrape target, with FICHES_METRICS=1 (see instrumentation.py)
+    if not instrumentation.ENABLED:
+        return "Métriques désactivées (FICHES_METRICS=1)", 404
+    return Response(instrumentation.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/api/me')
 @app.route(f'{BASE_PATH}/api/me')
 def api_me():
@@ -985,126 +1133,354 @@ def api_me():
     return jsonify({"authenticated": False})
 
 
-@app.route('/api/db/rows')
-@app.route(f'{BASE_PATH}/api/db/rows')
+@app.route('/api/db/rows', methods=['GET', 'POST'])
+@app.route(f'{BASE_PATH}/api/db/rows', methods=['GET', 'POST'])
 def db_get_rows():
     conn = get_db_connection()
-    rows = conn.execute("SELECT * FROM fiche_technique ORDER BY id DESC").fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in rows])
+    if 'draw' not in request.values:
+        rows = conn.execute("SELECT * FROM fiche_technique ORDER BY id DESC").fetchall()
+        return jsonify([dict(r) for r in rows])
+
+    # DataTables server-side processing: one page, visible columns only
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(fiche_technique)")]
+    try:
+        return jsonify(datatables.query(conn, "fiche_technique", columns, request.values))
+    except datatables.RequestError as e:
+        return jsonify({"draw": request.values.get('draw'), "error": str(e)}), 400
+
+
+@app.route('/api/db/stats')
+@app.route(f'{BASE_PATH}/api/db/stats')
+def db_stats():
+    conn = get_db_connection()
+    stats = {"total": conn.execute("SELECT count(*) FROM fiche_technique").fetchone()[0]}
+    for column in ("langue", "type"):
+        stats[column] = [list(r) for r in conn.execute(
+            f"SELECT coalesce(nullif({column}, ''), 'N/A') AS v, count(*) AS n "
+            f"FROM fiche_technique GROUP BY v ORDER BY n DESC")]
+    return jsonify(stats)
 
 
 @app.route('/api/db/row', methods=['POST'])
 @app.route(f'{BASE_PATH}/api/db/row', methods=['POST'])
 def db_add_row():
-    data = request.get_json()
     conn = get_db_connection()
-    cols = [k for k in data.keys() if k != 'id']
+    try:
+        data = row_edits.changes_of(conn, request.get_json(silent=True))
+    except row_edits.RowError as e:
+        return _row_error(e)
+    cols = list(data)
     vals = [data[k] for k in cols]
     placeholders = ','.join(['?'] * len(cols))
-    col_names = ','.join(cols)
-    conn.execute(f"INSERT INTO fiche_technique ({col_names}) VALUES ({placeholders})", vals)
-    conn.commit()
-    conn.close()
+    col_names = ','.join(f'[{c}]' for c in cols)
+    try:
+        with transaction(conn):
+            conn.execute(f"INSERT INTO fiche_technique ({col_names}) VALUES ({placeholders})", vals)
+    except sqlite3.IntegrityError as e:
+        # e.g. a second row for the same (cpid, langue)
+        return jsonify({"status": "error", "error": str(e)}), 409
     return jsonify({"status": "ok"})
 
 
-@app.route('/api/db/row/<int:row_id>', methods=['POST'])
-@app.route(f'{BASE_PATH}/api/db/row/<int:row_id>', methods=['POST'])
+def _row_error_body(e):
+    body = {"status": "error", "error": str(e)}
+    if isinstance(e, row_edits.ConflictError):
+        # The rows as they are now, for the editor to show
+        body["current"] = list(e.current.values())
+    if isinstance(e, row_edits.BatchError):
+        body["errors"] = [{"index": i, **_row_error_body(err)} for i, err in sorted(e.errors.items())]
+    return body
+
+
+def _row_error(e):
+    return jsonify(_row_error_body(e)), e.status
+
+
+def _row_edit(data, row_id=None):
+    """(row_id, changes, expected version) of one edit of a request body."""
+    if not isinstance(data, dict):
+        raise row_edits.RowError("Corps JSON attendu")
+    row_id = row_id if row_id is not None else data.get('id')
+    # bool is an int subclass: {"id": true} must not address row 1
+    if not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise row_edits.RowError("Identifiant de ligne manquant")
+    expected = data.get('version')
+    if expected is not None and (not isinstance(expected, int) or isinstance(expected, bool)):
+        raise row_edits.RowError("Version invalide")
+    return row_id, row_edits.changes_of(get_db_connection(), data), expected
+
+
+@app.route('/api/db/row/<int:row_id>', methods=['PATCH', 'POST'])
+@app.route(f'{BASE_PATH}/api/db/row/<int:row_id>', methods=['PATCH', 'POST'])
 def db_update_row(row_id):
-    data = request.get_json()
+    """
+    Partial update: {column: value, ...} in one UPDATE. With "version" (the
+    row's version the edit was made against), a row changed since answers
+    409 with its current values instead of being overwritten.
+    """
     conn = get_db_connection()
-    for key, value in data.items():
-        if key != 'id':
-            conn.execute(f"UPDATE fiche_technique SET [{key}]=? WHERE id=?", (value, row_id))
-    conn.commit()
-    conn.close()
-    return jsonify({"status": "ok"})
+    try:
+        version = row_edits.update_row(conn, *_row_edit(request.get_json(silent=True), row_id))
+    except row_edits.RowError as e:
+        return _row_error(e)
+    return jsonify({"status": "ok", "version": version})
+
+
+@app.route('/api/db/rows', methods=['PATCH'])
+@app.route(f'{BASE_PATH}/api/db/rows', methods=['PATCH'])
+def db_update_rows():
+    """
+    Bulk edit: a list of partial updates, each with its "id" (and optionally
+    "version"), applied in one transaction — all of them or none.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return _row_error(row_edits.RowError("Liste de modifications attendue"))
+    conn = get_db_connection()
+    try:
+        versions = row_edits.update_rows(conn, [_row_edit(item) for item in data])
+    except row_edits.RowError as e:
+        return _row_error(e)
+    return jsonify({"status": "ok", "versions": {str(k): v for k, v in versions.items()}})
+
+
+@app.route('/api/db/batch', methods=['POST'])
+@app.route(f'{BASE_PATH}/api/db/batch', methods=['POST'])
+def db_batch():
+    """
+    Inserts, updates and deletes of many rows in one request and one
+    transaction (row_edits.batch): all applied, or none with the failed
+    operations listed by index.
+    """
+    ops = request.get_json(silent=True)
+    if not isinstance(ops, list):
+        return _row_error(row_edits.RowError("Liste d'opérations attendue"))
+    conn = get_db_connection()
+    try:
+        results = row_edits.batch(conn, ops)
+    except row_edits.RowError as e:
+        return _row_error(e)
+    return jsonify({"status": "ok", "results": results})
 
 
 @app.route('/api/db/row/<int:row_id>', methods=['DELETE'])
 @app.route(f'{BASE_PATH}/api/db/row/<int:row_id>', methods=['DELETE'])
 def db_delete_row(row_id):
     conn = get_db_connection()
-    conn.execute("DELETE FROM fiche_technique WHERE id=?", (row_id,))
-    conn.commit()
-    conn.close()
+    with transaction(conn):
+        conn.execute("DELETE FROM fiche_technique WHERE id=?", (row_id,))
     return jsonify({"status": "ok"})
 
 
 @app.route('/api/db/export')
 @app.route(f'{BASE_PATH}/api/db/export')
 def db_export():
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
-
     conn = get_db_connection()
-    columns = [row[1] for row in conn.execute("PRAGMA table_info(fiche_technique)").fetchall()]
-    rows = conn.execute("SELECT * FROM fiche_technique ORDER BY id DESC").fetchall()
-    conn.close()
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Fiches Techniques"
-
-    # -- Styles --
-    header_fill = PatternFill(start_color="1A2332", end_color="1A2332", fill_type="solid")
-    header_font = Font(name="Calibri", bold=True, color="FFFFFF", size=11)
-    header_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    row_even_fill = PatternFill(start_color="EEF2FF", end_color="EEF2FF", fill_type="solid")
-    row_odd_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-    data_font = Font(name="Calibri", size=10)
-    data_align = Alignment(vertical="center", wrap_text=False)
-    thin_border = Border(
-        left=Side(style="thin", color="D1D5DB"),
-        right=Side(style="thin", color="D1D5DB"),
-        top=Side(style="thin", color="D1D5DB"),
-        bottom=Side(style="thin", color="D1D5DB"),
-    )
+    # Flat layout: components and drawings are pivoted back into
+    # vue_eclatee_N / dessin_technique_N columns
+    columns = fiches.wide_columns(conn)
+    headers = [FRIENDLY_NAMES.get(c, c.replace('_', ' ').title()) for c in columns]
+    cursor = conn.execute(fiches.wide_select_sql(columns) + " ORDER BY f.id DESC")
+
+    # Write-only workbook fed from the cursor, then sent in chunks — see xlsx_export.py
+    path = xlsx_export.export_to_tempfile(headers, xlsx_export.iter_cursor(cursor),
+                                          title="Fiches Techniques")
+    response = Response(stream_with_context(xlsx_export.stream_and_remove(path)),
+                        mimetype=xlsx_export.MIMETYPE)
+    response.headers["Content-Disposition"] = "attachment; filename=fiches_techniques.xlsx"
+    response.headers["Content-Length"] = str(os.path.getsize(path))
+    # Client gone before the first chunk: the generator never runs
+    response.call_on_close(lambda: xlsx_export.discard(path))
+    return response
+
+
+@app.route('/api/db/import', methods=['POST'])
+@app.route(f'{BASE_PATH}/api/db/import', methods=['POST'])
+def db_import():
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({"error": "Aucun fichier"}), 400
+    dry_run = request.form.get('dry_run', '').lower() in ('1', 'true', 'on')
+    conn = get_db_connection()
+    try:
+        report = fiche_import.import_rows(conn, fiche_import.read_rows(file.stream, file.filename),
+                                          FRIENDLY_NAMES, dry_run=dry_run)
+    except fiche_import.ImportFileError as e:
+        return jsonify({"error": str(e)}), 400
+    report["dry_run"] = dry_run
+    return jsonify(report)
+
+
+# -------------------- BACKGROUND JOBS --------------------
+@jobs.handler("vue_eclatee")
+def vue_eclatee_job(payload):
+    """Write <name>.svg around an uploaded image already in the blob store."""
+    folder = app.config['UPLOAD_FOLDER']
+    svg_filename = svg_store.create_svg_from_blob(folder, payload["name"], payload["blob"],
+                                                  mode=payload["mode"], annotations=payload["annotations"])
+    svg_store.annotation_cache.put(os.path.join(folder, svg_filename), payload["annotations"])
+    return {"filename": svg_filename, "image_path": f"uploads/{svg_filename}"}
+
+
+@jobs.handler("derivatives")
+def derivatives_job(payload):
+    """Build the WebP derivatives of an upload before the first page view asks for them."""
+    built = [images.derivative_path(app.config['UPLOAD_FOLDER'], payload["filename"], width)
+             for width in images.WIDTHS]
+    return {"derivatives": sum(1 for path in built if path)}
+
+
+@app.route('/api/jobs')
+@app.route(f'{BASE_PATH}/api/jobs')
+def jobs_status():
+    """Status of background jobs: /api/jobs?ids=1,2,3 -> {"jobs": [...]}, in the order asked."""
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify({"error": "Paramètre invalide : ids"}), 400
+    found = jobs.get(get_db_connection(), ids[:100])
+    jobs.runner.start()
+    return jsonify({"jobs": [found[i] for i in ids if i in found]})
+
+
+@app.route('/api/jobs/<int:job_id>')
+@app.route(f'{BASE_PATH}/api/jobs/<int:job_id>')
+def job_status(job_id):
+    job = jobs.get(get_db_connection(), [job_id]).get(job_id)
+    if job is None:
+        return jsonify({"error": "Tâche introuvable"}), 404
+    jobs.runner.start()
+    return jsonify(job)
+
+
+# -------------------- CLI: EXTRACT EMBEDDED SVG IMAGES --------------------
+@app.cli.command("extract-svg-images")
+def extract_svg_images_command():
+    """Move base64 images out of uploads/*.svg into uploads/blobs/ (sidecar files)."""
+    import glob
+    folder = app.config['UPLOAD_FOLDER']
+    converted = skipped = failed = 0
+    before = after = 0
+    for svg_path in sorted(glob.glob(os.path.join(folder, '*.svg'))):
+        size = os.path.getsize(svg_path)
+        try:
+            blob = svg_store.extract_embedded_image(folder, svg_path)
+        except Exception as e:
+            print(f"ERREUR {os.path.basename(svg_path)}: {e}")
+            failed += 1
+            continue
+        if blob is None:
+            skipped += 1
+            continue
+        converted += 1
+        before += size
+        after += os.path.getsize(svg_path)
+        print(f"{os.path.basename(svg_path)} -> {blob}")
+    print(f"{converted} converted, {skipped} already sidecar/skipped, {failed} failed; "
+          f"SVG bytes {before} -> {after}")
+
+
+# -------------------- CLI: BLOB STORE --------------------
+BLOB_COLUMNS = [("fiche_technique", "photo_produit"), ("fiche_technique", "variant_image"),
+                ("fiche_drawing", "image")]
+
+
+@app.cli.command("blobs-adopt")
+def blobs_adopt_command():
+    """Move uploads stored under their old CPID_field names into uploads/blobs/."""
+    conn = db.connect(DB_NAME)
+    try:
+        adopted, saved = blobstore.adopt(conn, app.config['UPLOAD_FOLDER'], BLOB_COLUMNS)
+    finally:
+        conn.close()
+    print(f"{adopted} files moved to the blob store, {saved} bytes of duplicates removed")
+
+
+@app.cli.command("blobs-gc")
+@click.option("--dry-run", is_flag=True, help="List what would be deleted.")
+@click.option("--grace", default=60, show_default=True,
+              help="Keep unreferenced blobs younger than this many minutes.")
+def blobs_gc_command(dry_run, grace):
+    """Delete blobs no fiche (or exploded-view SVG) references any more."""
+    conn = db.connect(DB_NAME)
+    try:
+        deleted, freed = blobstore.gc(conn, app.config['UPLOAD_FOLDER'],
+                                      grace_seconds=grace * 60, dry_run=dry_run)
+    finally:
+        conn.close()
+    for name in deleted:
+        print(name)
+    verb = "would be deleted" if dry_run else "deleted"
+    print(f"{len(deleted)} blobs {verb}, {freed} bytes")
+
+
+# -------------------- CLI: IMPORT --------------------
+@app.cli.command("import-fiches")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--dry-run", is_flag=True, help="Validate and count, write nothing.")
+def import_fiches_command(path, dry_run):
+    """Import an .xlsx/.csv in the export format into fiche_technique (upsert on CPID + langue)."""
+    conn = db.connect(DB_NAME)
+    try:
+        with open(path, 'rb') as f:
+            report = fiche_import.import_rows(conn, fiche_import.read_rows(f, path),
+                                              FRIENDLY_NAMES, dry_run=dry_run)
+    except fiche_import.ImportFileError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    for error in report["errors"]:
+        print(f"ligne {error['row']} ({error['cpid']}/{error['langue']}): {error['error']}")
+    if report["ignored_headers"]:
+        print(f"colonnes ignorées : {', '.join(report['ignored_headers'])}")
+    print(f"{report['inserted']} inserted, {report['updated']} updated, "
+          f"{report['skipped']} skipped" + (" (dry run, nothing written)" if dry_run else ""))
+
+
+# -------------------- CLI: BACKGROUND JOBS --------------------
+@app.cli.command("run-jobs")
+@click.option("--once", is_flag=True, help="Run what is queued, then exit.")
+def run_jobs_command(once):
+    """Run queued background jobs in the foreground (with JOB_THREADS=0 on the web workers)."""
+    conn = db.connect(DB_NAME)
+    try:
+        while True:
+            count = jobs.run_pending(conn)
+            if count:
+                print(f"{count} jobs run")
+            if once:
+                break
+            time.sleep(jobs.POLL_INTERVAL)
+    finally:
+        conn.close()
+
 
-    # -- Header row --
-    friendly_headers = [FRIENDLY_NAMES.get(c, c.replace('_', ' ').title()) for c in columns]
-    ws.append(friendly_headers)
-    for col_idx, _ in enumerate(columns, 1):
-        cell = ws.cell(row=1, column=col_idx)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = header_align
-        cell.border = thin_border
-    ws.row_dimensions[1].height = 30
-
-    # -- Data rows --
-    for row_idx, row in enumerate(rows, 2):
-        ws.append(list(row))
-        fill = row_even_fill if row_idx % 2 == 0 else row_odd_fill
-        for col_idx in range(1, len(columns) + 1):
-            cell = ws.cell(row=row_idx, column=col_idx)
-            cell.fill = fill
-            cell.font = data_font
-            cell.alignment = data_align
-            cell.border = thin_border
-
-    # -- Auto-width columns (cap at 40) --
-    for col_idx, col_name in enumerate(columns, 1):
-        max_len = len(friendly_headers[col_idx - 1])
-        for row in ws.iter_rows(min_row=2, max_row=min(ws.max_row, 102), min_col=col_idx, max_col=col_idx):
-            val = row[0].value
-            if val:
-                max_len = max(max_len, len(str(val)))
-        ws.column_dimensions[get_column_letter(col_idx)].width = min(max_len + 3, 40)
-
-    # -- Freeze header row --
-    ws.freeze_panes = "A2"
-
-    # -- Auto-filter on all columns --
-    ws.auto_filter.ref = ws.dimensions
-
-    bio = BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-
-    return send_file(bio, as_attachment=True, download_name="fiches_techniques.xlsx",
-                     mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+# -------------------- CLI: CATALOGUE EXPORT --------------------
+@app.cli.command("export-catalogue")
+@click.argument("target", type=click.Path(dir_okay=False))
+@click.option("--type", "types", multiple=True, help="Cloison, Porte… (repeatable; default: all).")
+@click.option("--lang", "langues", multiple=True, type=click.Choice(fiches.LANGUES),
+              help="Language (repeatable; default: fr, en, nl).")
+@click.option("--workers", default=0, help="Render processes (default: one per core).")
+def export_catalogue_command(target, types, langues, workers):
+    """Export the fiches as PDFs into a ZIP; re-running resumes from the PDF cache."""
+    if not fiche_pdf.available():
+        raise click.ClickException("Rendu PDF non disponible : WeasyPrint n'est pas installé")
+
+    def progress(stats):
+        if stats["done"] % 25 == 0 or stats["done"] == stats["total"]:
+            print(f"{stats['done']}/{stats['total']} ({stats['rendered']} rendered, "
+                  f"{stats['cached']} cached, {len(stats['failed'])} failed)")
+
+    stats = export_catalogue(target, types or None, langues or fiches.LANGUES,
+                             workers=workers or None, progress=progress)
+    for cpid, lang, error in stats["failed"]:
+        print(f"ERREUR {cpid}/{lang}: {error}")
+    rate = stats["rendered"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"{stats['done']} fiches in {stats['seconds']:.1f} s with {stats['workers']} workers, "
+          f"{rate:.2f} rendered/s -> {target}")
+    if stats["failed"]:
+        raise click.ClickException(f"{len(stats['failed'])} fiches en erreur, relancer pour réessayer")
 
 
 # -------------------- RUN --------------------
@@ -0,0 +1,124 @@
+"""
+Saving and reading annotations on an exploded view with a large source image.
+
+Compares the legacy save (ElementTree parse of the whole SVG, rebuild of the
+annotations group, full rewrite) with svg_store.write_annotations (splice of
+the layer, streamed copy, atomic rename), on an SVG embedding a 5 MB image
+and on the sidecar layout. Then times an editor open (get_svg_annotations):
+full ElementTree parse, svg_store.read_annotations (cache miss) and a hit of
+svg_store.annotation_cache.
+
+    python benchmarks/bench_annotations.py [--image-mb 5] [--annotations 22] [--repeat 20]
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blobstore  # noqa: E402
+import svg_store  # noqa: E402
+
+SVG = '{http://www.w3.org/2000/svg}'
+
+
+def legacy_save(svg_path, annotations):
+    """save_annotations() as it was: parse, rebuild the group, tree.write."""
+    ET.register_namespace('', 'http://www.w3.org/2000/svg')
+    ET.register_namespace('xlink', 'http://www.w3.org/1999/xlink')
+    tree = ET.parse(svg_path)
+    root = tree.getroot()
+    ann_group = root.find('.//svg:g[@id="annotations"]', {'svg': SVG[1:-1]})
+    if ann_group is not None:
+        root.remove(ann_group)
+    new_group = ET.SubElement(root, SVG + 'g')
+    new_group.set('id', 'annotations')
+    for ann in annotations:
+        x, y, side, ann_id = float(ann['x']), float(ann['y']), ann['side'], int(ann['id'])
+        line_x = 50 if side == 'left' else 650
+        g = ET.SubElement(new_group, SVG + 'g')
+        for k, v in (('data-id', ann_id), ('data-x', x), ('data-y', y), ('data-side', side)):
+            g.set(k, str(v))
+        line = ET.SubElement(g, SVG + 'line')
+        for k, v in (('x1', line_x), ('y1', y), ('x2', x), ('y2', y), ('stroke', 'black'), ('stroke-width', 2)):
+            line.set(k, str(v))
+        for cx, r in ((x, 3), (line_x, 20)):
+            c = ET.SubElement(g, SVG + 'circle')
+            for k, v in (('cx', cx), ('cy', y), ('r', r), ('fill', 'black')):
+                c.set(k, str(v))
+        text = ET.SubElement(g, SVG + 'text')
+        for k, v in (('x', line_x), ('y', y), ('text-anchor', 'middle'), ('fill', 'white')):
+            text.set(k, str(v))
+        text.text = str(ann_id)
+    tree.write(svg_path, encoding='unicode', xml_declaration=True)
+
+
+def legacy_read(svg_path):
+    """get_svg_annotations() as it was: parse the whole file."""
+    root = ET.parse(svg_path).getroot()
+    group = root.find('.//svg:g[@id="annotations"]', {'svg': SVG[1:-1]})
+    return [g.get('data-id') for g in group.findall(SVG + 'g')]
+
+
+def make_annotations(n, shift):
+    return [{'id': i, 'x': 100 + i * 7 + shift, 'y': 30 + i * 35, 'side': ('left', 'right')[i % 2]}
+            for i in range(1, n + 1)]
+
+
+def measure(fn, svg_path, n, repeat):
+    fn(svg_path, make_annotations(n, 0))  # warm up / normalise the file
+    tracemalloc.start()
+    start = time.perf_counter()
+    for k in range(repeat):
+        fn(svg_path, make_annotations(n, k))
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image-mb", type=float, default=5)
+    parser.add_argument("--annotations", type=int, default=22)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    image = os.urandom(int(args.image_mb * 1024 * 1024))
+    embedded_href = "data:image/png;base64," + base64.b64encode(image).decode('ascii')
+
+    print(f"{args.image_mb:g} MB source image, {args.annotations} annotations, {args.repeat} saves")
+    print(f"{'layout / save':<34}{'ms/save':>10}{'peak MB':>10}{'SVG MB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        sidecar_href = blobstore.put(tmp, io.BytesIO(image), '.png')
+        for layout, href in (("embedded", embedded_href), ("sidecar", sidecar_href)):
+            for label, fn in (("ElementTree rewrite", legacy_save), ("splice", svg_store.write_annotations)):
+                path = os.path.join(tmp, f"{layout}.svg")
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(svg_store.build_svg(href))
+                ms, peak = measure(fn, path, args.annotations, args.repeat)
+                size = os.path.getsize(path) / 1e6
+                print(f"{layout + ', ' + label:<34}{ms:>10.2f}{peak:>10.1f}{size:>9.2f}")
+
+        print()
+        print(f"{'editor open, embedded':<34}{'ms/open':>10}")
+        path = os.path.join(tmp, "embedded.svg")
+        cache = svg_store.AnnotationCache()
+        cache.get(path)
+        for label, fn in (("ElementTree parse", legacy_read),
+                          ("read_annotations (miss)", svg_store.read_annotations),
+                          ("annotation_cache (hit)", cache.get)):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                fn(path)
+            print(f"{label:<34}{(time.perf_counter() - start) / args.repeat * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
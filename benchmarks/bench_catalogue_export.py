@@ -0,0 +1,87 @@
+"""
+Throughput of the catalogue export (flask export-catalogue) against the
+number of render processes.
+
+Builds a catalogue of N CPIDs x 3 languages with components and drawings,
+then exports it to a ZIP with 1, 2, 4… workers up to the core count, from
+an empty PDF cache each time, and once more with everything cached (what
+resuming an interrupted export costs). Needs WeasyPrint.
+
+    python benchmarks/bench_catalogue_export.py [--cpids 40]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import fiche_pdf  # noqa: E402
+import fiches  # noqa: E402
+import migrations  # noqa: E402
+
+
+def populate(path, cpids):
+    conn = db.connect(path)
+    migrations.migrate(conn)
+    with db.transaction(conn):
+        for i in range(cpids):
+            product_type = ("Cloison", "Porte")[i % 2]
+            for lang in fiches.LANGUES:
+                cur = conn.execute(
+                    "INSERT INTO fiche_technique (cpid, reference, reference_menu, langue, type, description, "
+                    "hauteur, largeur, verre, resistance_feu, nbn_en_iso_717_1) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                    (f"CP{i:06d}", f"REF-{i}", f"MENU {i}", lang,
+                     fiches.TYPE_NAMES_NL[product_type] if lang == "nl" else product_type,
+                     "Cloison vitrée acoustique, profils aluminium " * 6,
+                     "2700 mm", "1200 mm", "Feuilleté 44.2", "EI 30", "44 dB"))
+                fiches.write_children(
+                    conn, cur.lastrowid,
+                    {p: f"Composant {p} ({lang})" for p in range(1, 13)},
+                    {p: {"image": None, "nom": f"Coupe {p}"} for p in range(1, 7)})
+    conn.close()
+
+
+def worker_counts():
+    cores = os.cpu_count() or 1
+    counts, n = [], 1
+    while n < cores:
+        counts.append(n)
+        n *= 2
+    return counts + [cores]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cpids", type=int, default=40)
+    args = parser.parse_args()
+    if not fiche_pdf.available():
+        sys.exit("WeasyPrint (and Pango) are needed to render PDFs")
+
+    tmp = tempfile.mkdtemp()
+    try:
+        os.environ["FICHES_DB"] = os.path.join(tmp, "bench.db")
+        os.environ["PDF_CACHE_DIR"] = os.path.join(tmp, "pdf")
+        populate(os.environ["FICHES_DB"], args.cpids)
+        import app  # noqa: E402 - reads FICHES_DB / PDF_CACHE_DIR on import
+
+        target = os.path.join(tmp, "catalogue.zip")
+        print(f"{args.cpids * 3} fiches, {os.cpu_count()} cores")
+        print(f"{'workers':>8}{'seconds':>10}{'fiches/s':>10}{'speedup':>9}")
+        base = None
+        for workers in worker_counts():
+            shutil.rmtree(os.environ["PDF_CACHE_DIR"], ignore_errors=True)
+            stats = app.export_catalogue(target, workers=workers)
+            rate = stats["rendered"] / stats["seconds"]
+            base = base or rate
+            print(f"{workers:>8}{stats['seconds']:>10.1f}{rate:>10.2f}{rate / base:>8.1f}x")
+        stats = app.export_catalogue(target)
+        print(f"resume, all cached: {stats['seconds']:.2f} s, ZIP {os.path.getsize(target) / 1e6:.1f} MB")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Read throughput while an editor keeps saving.
+
+Compares the legacy access pattern (new connection per request, default
+rollback journal) against the pooled WAL connections from db.py.
+
+    python benchmarks/bench_db_concurrency.py [--rows 3000] [--seconds 5] [--readers 4]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+def build_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE fiche_technique (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cpid TEXT NOT NULL, langue TEXT, type TEXT, description TEXT
+        )""")
+    conn.executemany(
+        "INSERT INTO fiche_technique (cpid, langue, type, description) VALUES (?, ?, ?, ?)",
+        ((f"CP{i // 3:06d}", ("fr", "en", "nl")[i % 3], "Cloison", "x" * 200) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(path, rows, seconds, readers, pooled):
+    stop = threading.Event()
+    reads = [0] * readers
+    read_errors = [0] * readers
+    writes = [0]
+    write_errors = [0]
+
+    if pooled:
+        pool = db.ConnectionPool(path, size=readers + 1)
+        open_conn, close_conn = pool.acquire, pool.release
+    else:
+        def open_conn():
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        def close_conn(conn):
+            conn.close()
+
+    def reader(n):
+        i = 0
+        while not stop.is_set():
+            conn = open_conn()
+            try:
+                cpid = f"CP{(i * 7919) % (rows // 3):06d}"
+                conn.execute(
+                    "SELECT * FROM fiche_technique WHERE cpid=? AND langue='fr'", (cpid,)
+                ).fetchone()
+                reads[n] += 1
+            except sqlite3.OperationalError:
+                read_errors[n] += 1
+            finally:
+                close_conn(conn)
+            i += 1
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            conn = open_conn()
+            try:
+                if pooled:
+                    with db.transaction(conn):
+                        for lang in ("fr", "en", "nl"):
+                            conn.execute(
+                                "UPDATE fiche_technique SET description=? WHERE cpid=? AND langue=?",
+                                (f"rev {i}", f"CP{i % (rows // 3):06d}", lang))
+                else:
+                    for lang in ("fr", "en", "nl"):
+                        conn.execute(
+                            "UPDATE fiche_technique SET description=? WHERE cpid=? AND langue=?",
+                            (f"rev {i}", f"CP{i % (rows // 3):06d}", lang))
+                    conn.commit()
+                writes[0] += 1
+            except sqlite3.OperationalError:
+                write_errors[0] += 1
+            finally:
+                close_conn(conn)
+            i += 1
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    if pooled:
+        pool.close_all()
+
+    return sum(reads) / seconds, sum(read_errors), writes[0] / seconds, write_errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=3000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{args.rows} rows, {args.readers} readers + 1 writer, {args.seconds}s per run")
+    print(f"{'mode':<28}{'reads/s':>10}{'read err':>10}{'saves/s':>10}{'save err':>10}")
+    for label, pooled in (("per-request, rollback jrnl", False), ("pooled, WAL", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            build_db(path, args.rows)
+            r, re_, w, we = run(path, args.rows, args.seconds, args.readers, pooled)
+        print(f"{label:<28}{r:>10.0f}{re_:>10}{w:>10.0f}{we:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Scan vs. seek on the hot fiche_technique lookups.
+
+Builds a catalogue at schema version 2 (no indexes), times the queries used
+by get_fiche / add_fiche / home, applies the pending migrations and times
+them again.
+
+    python benchmarks/bench_indexes.py [--cpids 50000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+QUERIES = {
+    "get_fiche (cpid, langue)":
+        ("SELECT * FROM fiche_technique WHERE cpid=? AND langue='fr'", lambda i: (f"CP{i:06d}",)),
+    "add_fiche duplicate check":
+        ("SELECT * FROM fiche_technique WHERE cpid=?", lambda i: (f"CP{i:06d}",)),
+    "home DISTINCT cpid per type":
+        ("SELECT DISTINCT cpid FROM fiche_technique WHERE type=? AND langue='fr'",
+         lambda i: (("Cloison", "Porte")[i % 2],)),
+}
+
+
+def populate(conn, cpids):
+    rows = []
+    for i in range(cpids):
+        kind = "Cloison" if i % 3 else "Porte"
+        for lang in ("fr", "en", "nl"):
+            rows.append((f"CP{i:06d}", f"REF {i}", f"MENU {i}", lang, kind, "x" * 120))
+    with db.transaction(conn):
+        conn.executemany(
+            "INSERT INTO fiche_technique (cpid, reference, reference_menu, langue, type, description) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def time_queries(conn, cpids, repeat):
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        n = repeat if "DISTINCT" not in name else max(repeat // 100, 5)
+        start = time.perf_counter()
+        for k in range(n):
+            conn.execute(sql, params((k * 7919) % cpids)).fetchall()
+        results[name] = (time.perf_counter() - start) / n * 1e6
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params(0)).fetchall()
+        results[name + " plan"] = "; ".join(r[3] for r in plan)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cpids", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = db.connect(os.path.join(tmp, "bench.db"))
+        migrations.migrate(conn, target=2)
+        populate(conn, args.cpids)
+        before = time_queries(conn, args.cpids, args.repeat)
+        migrations.migrate(conn)
+        after = time_queries(conn, args.cpids, args.repeat)
+        conn.close()
+
+    print(f"{args.cpids} CPIDs x 3 languages = {args.cpids * 3} rows")
+    print(f"{'query':<30}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for name in QUERIES:
+        b, a = before[name], after[name]
+        print(f"{name:<30}{b:>14.1f}{a:>14.1f}{b / a:>9.0f}x")
+    print()
+    for name in QUERIES:
+        print(f"{name}\n  before: {before[name + ' plan']}\n  after:  {after[name + ' plan']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Full-text search latency on a large catalogue.
+
+Builds a catalogue at schema version 5 (before the FTS index) with
+realistic partition/door values in three languages, applies the search
+migration (timing the backfill), then times search.search() for a few
+typical queries against the LIKE scan it replaces.
+
+    python benchmarks/bench_search.py [--rows 100000] [--repeat 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import search  # noqa: E402
+
+PRODUCTS = ["Diva", "Era", "Luna", "Beatle Glass", "Alu 100", "Nova", "Orion", "Stratos"]
+TYPES = {"fr": ("Cloison", "Porte"), "en": ("Partition", "Door"), "nl": ("Systeemwand", "Deur")}
+WORDS = {
+    "fr": "vitrage simple double feuilleté acoustique profil aluminium joint plinthe montant traverse",
+    "en": "glazing single double laminated acoustic profile aluminium seal skirting upright transom",
+    "nl": "beglazing enkel dubbel gelaagd akoestisch profiel aluminium dichting plint stijl regel",
+}
+QUERIES = ["EI60 44 dB", "diva", "clois", "beglazing dubbel", "P_ERA VAR3", "feuilleté 2500"]
+
+
+def populate(conn, rows):
+    rng = random.Random(42)
+    fiches, components = [], []
+    fiche_id = 0
+    for i in range(rows // 3):
+        product = rng.choice(PRODUCTS)
+        db_value = rng.randrange(28, 56)
+        fire = rng.choice(["EI00", "EI00", "EI00", "EI30", "EI60", "EI120"])
+        kind = rng.randrange(2)
+        cpid = f"P_{product.upper().replace(' ', '')}_VAR{rng.randrange(1, 6)}_{db_value}dB_{fire}_{i}"
+        for lang in ("fr", "en", "nl"):
+            fiche_id += 1
+            words = WORDS[lang].split()
+            fiches.append((fiche_id, cpid, product, product.upper(), lang, TYPES[lang][kind],
+                           " ".join(rng.sample(words, 6)), f"{db_value}dB", fire,
+                           rng.choice(["± 2500 Kg/m³", None])))
+            components.extend((fiche_id, pos, " ".join(rng.sample(words, 2)))
+                              for pos in range(1, rng.randrange(6, 14)))
+    with db.transaction(conn):
+        conn.executemany(
+            "INSERT INTO fiche_technique (id, cpid, reference, reference_menu, langue, type, "
+            "description, nbn_en_iso_717_1, resistance_feu, verre) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            fiches)
+        conn.executemany("INSERT INTO fiche_component (fiche_id, position, label) VALUES (?, ?, ?)",
+                         components)
+
+
+def like_scan(conn, text):
+    """What a search costs without the index: every word LIKE'd over the columns."""
+    columns = ["cpid", "reference", "description", "resistance_feu", "nbn_en_iso_717_1", "verre"]
+    where, args = [], []
+    for word in text.split():
+        where.append("(" + " OR ".join(f"{c} LIKE ?" for c in columns) + ")")
+        args.extend([f"%{word}%"] * len(columns))
+    return conn.execute(f"SELECT DISTINCT cpid FROM fiche_technique WHERE {' AND '.join(where)} LIMIT 20",
+                        args).fetchall()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = db.connect(path)
+        migrations.migrate(conn, target=5)
+        populate(conn, args.rows)
+        start = time.perf_counter()
+        migrations.migrate(conn)
+        print(f"{args.rows} rows, index backfill {time.perf_counter() - start:.1f} s, "
+              f"db {os.path.getsize(path) / 1e6:.0f} MB")
+
+        print(f"{'query':<22}{'hits':>6}{'FTS p50':>10}{'p95 (ms)':>10}{'LIKE p50 (ms)':>15}")
+        for q in QUERIES:
+            hits = len(search.search(conn, q))
+            p50, p95 = timed(lambda: search.search(conn, q), args.repeat)
+            like, _ = timed(lambda: like_scan(conn, q), max(args.repeat // 20, 3))
+            print(f"{q:<22}{hits:>6}{p50:>10.2f}{p95:>10.2f}{like:>15.1f}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Peak memory and wall time of the XLSX export (/api/db/export).
+
+Builds a catalogue of N CPIDs x 3 languages with components and drawings,
+then exports it once with the legacy path (fetchall, regular workbook,
+per-cell styles, BytesIO) and once with xlsx_export (cursor, write-only
+workbook, named styles, temp file). Each run happens in a fresh process so
+its peak RSS is its own.
+
+    python benchmarks/bench_xlsx_export.py [--cpids 5000]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import fiches  # noqa: E402
+import migrations  # noqa: E402
+import xlsx_export  # noqa: E402
+
+
+def populate(path, cpids):
+    conn = db.connect(path)
+    migrations.migrate(conn)
+    with db.transaction(conn):
+        for i in range(cpids):
+            for lang in fiches.LANGUES:
+                cur = conn.execute(
+                    "INSERT INTO fiche_technique (cpid, reference, reference_menu, langue, type, description, "
+                    "hauteur, largeur, verre, resistance_feu, photo_produit) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                    (f"CP{i:06d}", f"REF-{i}", f"MENU {i}", lang, "Cloison", "Cloison vitrée " * 8,
+                     "2700 mm", "1200 mm", "Feuilleté 44.2", "EI 30", f"uploads/blobs/{i:064x}.png"))
+                fiches.write_children(
+                    conn, cur.lastrowid,
+                    {p: f"Composant {p} ({lang})" for p in range(1, 16)},
+                    {p: {"image": f"uploads/blobs/{p:064x}.png", "nom": f"Coupe {p}"} for p in range(1, 7)})
+    conn.close()
+
+
+def legacy_export(conn):
+    """db_export() as it was before the streaming export."""
+    import openpyxl
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    from openpyxl.utils import get_column_letter
+
+    columns = fiches.wide_columns(conn)
+    rows = conn.execute(fiches.wide_select_sql(columns) + " ORDER BY f.id DESC").fetchall()
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    header_fill = PatternFill(start_color="1A2332", end_color="1A2332", fill_type="solid")
+    header_font = Font(name="Calibri", bold=True, color="FFFFFF", size=11)
+    header_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    even = PatternFill(start_color="EEF2FF", end_color="EEF2FF", fill_type="solid")
+    odd = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
+    data_font = Font(name="Calibri", size=10)
+    data_align = Alignment(vertical="center", wrap_text=False)
+    side = Side(style="thin", color="D1D5DB")
+    border = Border(left=side, right=side, top=side, bottom=side)
+    ws.append(columns)
+    for col_idx in range(1, len(columns) + 1):
+        cell = ws.cell(row=1, column=col_idx)
+        cell.fill, cell.font, cell.alignment, cell.border = header_fill, header_font, header_align, border
+    for row_idx, row in enumerate(rows, 2):
+        ws.append(list(row))
+        fill = even if row_idx % 2 == 0 else odd
+        for col_idx in range(1, len(columns) + 1):
+            cell = ws.cell(row=row_idx, column=col_idx)
+            cell.fill, cell.font, cell.alignment, cell.border = fill, data_font, data_align, border
+    for col_idx in range(1, len(columns) + 1):
+        max_len = len(columns[col_idx - 1])
+        for row in ws.iter_rows(min_row=2, max_row=min(ws.max_row, 102), min_col=col_idx, max_col=col_idx):
+            if row[0].value:
+                max_len = max(max_len, len(str(row[0].value)))
+        ws.column_dimensions[get_column_letter(col_idx)].width = min(max_len + 3, 40)
+    ws.freeze_panes = "A2"
+    ws.auto_filter.ref = ws.dimensions
+    bio = BytesIO()
+    wb.save(bio)
+    return len(bio.getvalue())
+
+
+def streaming_export(conn):
+    columns = fiches.wide_columns(conn)
+    cursor = conn.execute(fiches.wide_select_sql(columns) + " ORDER BY f.id DESC")
+    path = xlsx_export.export_to_tempfile(columns, xlsx_export.iter_cursor(cursor))
+    return sum(len(chunk) for chunk in xlsx_export.stream_and_remove(path))
+
+
+def run_one(mode, path):
+    conn = db.connect(path)
+    start = time.perf_counter()
+    size = (legacy_export if mode == "legacy" else streaming_export)(conn)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{elapsed:.2f} {peak_mb:.1f} {size}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cpids", type=int, default=5000)
+    parser.add_argument("--run", choices=("legacy", "streaming"), help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_one(args.run, args.db)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        populate(path, args.cpids)
+        conn = db.connect(path)
+        n_cols = len(fiches.wide_columns(conn))
+        conn.close()
+        print(f"{args.cpids} CPIDs x 3 languages = {args.cpids * 3} rows, {n_cols} columns")
+        print(f"{'export':<12}{'wall (s)':>10}{'peak RSS (MB)':>16}{'xlsx (MB)':>11}")
+        for mode in ("legacy", "streaming"):
+            out = subprocess.run([sys.executable, __file__, "--run", mode, "--db", path],
+                                 capture_output=True, text=True, check=True).stdout.split()
+            print(f"{mode:<12}{float(out[0]):>10.2f}{float(out[1]):>16.1f}{int(out[2]) / 1e6:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Content-addressed store for uploaded files.
+
+Every upload is stored once under static/uploads/blobs/<sha256><ext>, named
+after its content; identical drawings uploaded for several CPIDs share one
+file. The database references blobs by their static path
+("uploads/blobs/<sha256>.png").
+
+Reference counts live in the `blob` table and are maintained by triggers on
+fiche_technique (photo_produit, variant_image) and fiche_drawing (image) —
+see migrations._0005_blob_refcounts — so every writer, including the DB
+editor, keeps them right. Exploded-view SVGs reference their source image
+from the file itself; gc() reads those hrefs before deleting anything.
+"""
+import glob
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+import instrumentation
+from db import transaction
+
+# Relative to the upload folder (and therefore to the SVGs in it)
+BLOB_DIR = "blobs"
+# Prefix of blob references stored in the database
+DB_PREFIX = "uploads/"
+
+_CHUNK = 1024 * 1024
+
+_BLOB_NAME = re.compile(r'^[0-9a-f]{64}(\.[A-Za-z0-9]+)?$')
+
+
+@instrumentation.timed("file.blob")
+def put(upload_folder, stream, ext, conn=None):
+    """
+    Copy a binary stream into blobs/<sha256><ext> in constant memory.
+    Identical content is stored only once: a seekable stream (a form
+    upload) is hashed first, and not written at all if the blob exists.
+    With `conn`, storing existing content restarts gc()'s grace period.
+    Returns the path relative to the upload folder, e.g. "blobs/3fa9….png".
+    """
+    blob_dir = os.path.join(upload_folder, BLOB_DIR)
+    os.makedirs(blob_dir, exist_ok=True)
+    if _seekable(stream):
+        start = stream.tell()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(_CHUNK), b''):
+            digest.update(chunk)
+        name = digest.hexdigest() + ext.lower()
+        final_path = os.path.join(blob_dir, name)
+        if os.path.exists(final_path):
+            _restored(conn, name)
+            return f"{BLOB_DIR}/{name}"
+        stream.seek(start)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=blob_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(_CHUNK)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        name = digest.hexdigest() + ext.lower()
+        _store(blob_dir, tmp_path, name, conn)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return f"{BLOB_DIR}/{name}"
+
+
+def _seekable(stream):
+    try:
+        return stream.seekable()
+    except (AttributeError, ValueError):
+        return False
+
+
+@instrumentation.timed("file.blob")
+def put_file(upload_folder, path, ext, conn=None):
+    """
+    put() for a file already on disk in the upload folder's filesystem (a
+    finished chunked upload): hashed in constant memory, then moved — not
+    copied — into the store. `path` is gone afterwards.
+    """
+    blob_dir = os.path.join(upload_folder, BLOB_DIR)
+    os.makedirs(blob_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b''):
+            digest.update(chunk)
+    name = digest.hexdigest() + ext.lower()
+    _store(blob_dir, path, name, conn)
+    return f"{BLOB_DIR}/{name}"
+
+
+def _store(blob_dir, tmp_path, name, conn):
+    final_path = os.path.join(blob_dir, name)
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+        _restored(conn, name)
+    else:
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, final_path)
+
+
+def _restored(conn, name):
+    # A re-upload makes an unreferenced blob "new" again for gc()'s grace
+    # period. Recorded in the database: the file's mtime must stay that of
+    # its content (derivative freshness, srcset ?v= in images.py / app.py)
+    if conn is not None:
+        with transaction(conn):
+            conn.execute("""
+                INSERT INTO blob (name, refcount, stored) VALUES (?, 0, ?)
+                ON CONFLICT (name) DO UPDATE SET stored = excluded.stored
+            """, (f"{BLOB_DIR}/{name}", int(time.time())))
+
+
+def refcount(conn, name):
+    """Database references to blobs/<name> (a "blobs/…" path)."""
+    row = conn.execute("SELECT refcount FROM blob WHERE name=?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+# -------------------- GARBAGE COLLECTION --------------------
+_SVG_HREF = re.compile(rb'(?:xlink:)?href="(' + BLOB_DIR.encode() + rb'/[^"]+)"')
+
+
+def svg_references(upload_folder):
+    """Blob paths referenced by the exploded-view SVGs and the derived/ pointers."""
+    refs = set()
+    for path in glob.glob(os.path.join(glob.escape(upload_folder), '*.svg')):
+        with open(path, 'rb') as f:
+            head = f.read(64 * 1024)
+        refs.update(m.decode('utf-8') for m in _SVG_HREF.findall(head))
+    for path in glob.glob(os.path.join(glob.escape(upload_folder), 'derived', '*@*')):
+        with open(path, encoding='utf-8') as f:
+            refs.add(f.read().strip())
+    return refs
+
+
+def gc(conn, upload_folder, grace_seconds=3600, dry_run=False):
+    """
+    Delete blobs nobody references: refcount 0 (or no row) in `blob`, and not
+    the source image of any SVG. Blobs stored (file mtime) or stored again
+    (blob.stored) less than `grace_seconds` ago are kept — an upload is
+    stored before the transaction that references it commits.
+    Also drops WebP derivatives (images.py) whose original is gone.
+    Returns (deleted blob paths, bytes freed).
+    """
+    blob_dir = os.path.join(upload_folder, BLOB_DIR)
+    if not os.path.isdir(blob_dir):
+        return [], 0
+
+    cutoff = time.time() - grace_seconds
+    referenced = {name for (name,) in conn.execute(
+        "SELECT name FROM blob WHERE refcount > 0 OR stored > ?", (cutoff,))}
+    referenced |= svg_references(upload_folder)
+
+    deleted, freed = [], 0
+    for entry in os.scandir(blob_dir):
+        if not entry.is_file() or not _BLOB_NAME.match(entry.name):
+            continue
+        name = f"{BLOB_DIR}/{entry.name}"
+        st = entry.stat()
+        if name in referenced or st.st_mtime > cutoff:
+            continue
+        deleted.append(name)
+        freed += st.st_size
+        if not dry_run:
+            os.remove(entry.path)
+
+    if not dry_run and deleted:
+        with transaction(conn):
+            conn.executemany("DELETE FROM blob WHERE name=? AND refcount <= 0", [(n,) for n in deleted])
+        _drop_orphan_derivatives(upload_folder)
+    return deleted, freed
+
+
+def _drop_orphan_derivatives(upload_folder):
+    # Imported here: images.py needs Pillow, the blob store does not
+    import images
+    folder = os.path.join(upload_folder, images.DERIVATIVE_DIR)
+    if not os.path.isdir(folder):
+        return
+    for root, _, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(root, name)
+            source = images.source_name(os.path.relpath(path, folder))
+            if source and not os.path.exists(os.path.join(upload_folder, source)):
+                os.remove(path)
+
+
+# -------------------- ADOPTION OF LEGACY UPLOADS --------------------
+def adopt(conn, upload_folder, columns):
+    """
+    Move files referenced by the database under their old names
+    (uploads/<cpid>_<field>.<ext>) into the blob store and point the rows at
+    the blob. `columns` is a list of (table, column). The old file is removed
+    once nothing references it any more. Returns (files adopted, bytes saved).
+    """
+    adopted, saved = 0, 0
+    paths = set()
+    for table, column in columns:
+        paths.update(p for (p,) in conn.execute(
+            f"SELECT DISTINCT {column} FROM {table} "
+            f"WHERE {column} LIKE ? AND {column} NOT LIKE ?",
+            (DB_PREFIX + '%', DB_PREFIX + BLOB_DIR + '/%')))
+
+    for path in sorted(paths):
+        source = os.path.join(upload_folder, path[len(DB_PREFIX):])
+        if path.lower().endswith('.svg') or not os.path.isfile(source):
+            continue
+        size = os.path.getsize(source)
+        with open(source, 'rb') as f:
+            blob = put(upload_folder, f, os.path.splitext(source)[1], conn)
+        shared = refcount(conn, blob) > 0
+        with transaction(conn):
+            for table, column in columns:
+                conn.execute(f"UPDATE {table} SET {column}=? WHERE {column}=?", (DB_PREFIX + blob, path))
+        os.remove(source)
+        adopted += 1
+        if shared:
+            saved += size
+    return adopted, saved
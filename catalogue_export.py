@@ -0,0 +1,113 @@
+"""
+Batch export of the catalogue: the PDF of every fiche of some types
+(Cloison, Porte) in some languages, in one ZIP laid out as
+<langue>/<type>/<cpid>.pdf.
+
+The PDFs are the ones /pdf serves (fiche_pdf.py): same cache files, same
+versions. The missing ones are rendered in a process pool, a couple of
+jobs per worker queued ahead, and every PDF goes into the ZIP as soon as
+it is ready. That makes an export resumable: what was rendered before an
+interruption is in the cache, so a re-run only renders the rest, and a
+PDF already produced by /pdf or by an earlier export costs a file copy.
+
+The ZIP is written to <target>.part and renamed once complete. PDFs are
+stored, not deflated: they are compressed already.
+"""
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import fiche_pdf
+import fiches
+
+# Jobs queued per worker, so a worker never waits for the next page's HTML
+AHEAD = 2
+
+
+def select_fiches(conn, types=None, langues=fiches.LANGUES):
+    """
+    (type, cpid, langue) of the fiches to export, by type, CPID and language.
+    A CPID's type is the one of its French row, as on the home page.
+    """
+    langues = [lang for lang in fiches.LANGUES if lang in langues]
+    sql = f"""
+        SELECT fr.type, f.cpid, f.langue FROM fiche_technique f
+        JOIN fiche_technique fr ON fr.cpid = f.cpid AND fr.langue = 'fr'
+        WHERE f.langue IN ({", ".join("?" * len(langues))})
+    """
+    args = list(langues)
+    if types:
+        sql += f" AND fr.type IN ({', '.join('?' * len(types))})"
+        args.extend(types)
+    rows = [tuple(row) for row in conn.execute(sql, args)]
+    rows.sort(key=lambda r: (r[0] or "", r[1].lower(), fiches.LANGUES.index(r[2])))
+    return rows
+
+
+def archive_name(product_type, cpid, langue):
+    safe = cpid.strip().replace("/", "_").replace("\\", "_")
+    return f"{langue}/{product_type or 'Autre'}/{safe}.pdf"
+
+
+def export(items, target, prepare, static_folder, static_prefixes, workers=None, progress=None):
+    """
+    Write the PDFs of `items` (from select_fiches) into the ZIP `target`.
+
+    prepare(cpid, langue) returns (PDF cache path, page HTML), the HTML
+    being None when the PDF is cached already, or (None, None) if the
+    fiche is gone. progress(stats) is called after every fiche.
+    Returns the stats: total, done, cached, rendered, failed (a list of
+    (cpid, langue, error)), seconds, workers.
+    """
+    workers = workers or os.cpu_count() or 1
+    stats = {"total": len(items), "done": 0, "cached": 0, "rendered": 0, "failed": [],
+             "seconds": 0.0, "workers": workers}
+    start = time.perf_counter()
+    partial = target + ".part"
+    pending = {}
+
+    def add(item, path, outcome):
+        product_type, cpid, langue = item
+        if outcome is None:
+            try:
+                archive.write(path, archive_name(product_type, cpid, langue))
+            except OSError as e:
+                outcome = e
+        if outcome is not None:
+            stats["failed"].append((cpid, langue, str(outcome)))
+        stats["done"] += 1
+        stats["seconds"] = time.perf_counter() - start
+        if progress:
+            progress(stats)
+
+    def collect(block_until):
+        while len(pending) > block_until:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                item, path = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    stats["rendered"] += 1
+                add(item, path, error)
+
+    pool = fiche_pdf.process_pool(workers)
+    try:
+        with zipfile.ZipFile(partial, "w", zipfile.ZIP_STORED) as archive:
+            for item in items:
+                path, html = prepare(item[1], item[2])
+                if path is None:
+                    add(item, None, "Référence introuvable")
+                elif html is None:
+                    stats["cached"] += 1
+                    add(item, path, None)
+                else:
+                    future = pool.submit(fiche_pdf.render_pdf, html, static_folder, list(static_prefixes), path)
+                    pending[future] = (item, path)
+                    collect(workers * AHEAD)
+            collect(0)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    os.replace(partial, target)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
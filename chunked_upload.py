@@ -0,0 +1,161 @@
+"""
+Resumable chunked uploads, for large exploded-view drawings.
+
+The editor creates an upload (POST /api/uploads with the file's name and
+size), then sends the file in chunks (PUT /api/uploads/<id> with a
+Content-Range header). Each chunk is streamed to
+static/uploads/partial/<id>.part, so memory use does not depend on the
+size of the file or of the chunk. After a dropped connection, GET
+/api/uploads/<id> tells how much arrived and the upload resumes there.
+
+A complete upload is handed over by id (upload_id form field) to the
+endpoint that uses it, which moves it into the blob store without copying
+it (blobstore.put_file). Uploads idle for EXPIRY are deleted.
+"""
+import json
+import os
+import re
+import time
+import uuid
+
+import blobstore
+import instrumentation
+
+PARTIAL_DIR = "partial"
+CHUNK_SIZE = 4 * 1024 * 1024
+EXPIRY = 24 * 3600
+
+_COPY = 256 * 1024
+_ID = re.compile(r'^[0-9a-f]{32}$')
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(ValueError):
+    """Invalid upload request; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, received=None):
+        super().__init__(message)
+        self.status = status
+        self.received = received
+
+
+def _paths(upload_folder, upload_id):
+    if not _ID.match(upload_id or ""):
+        raise UploadError("Envoi introuvable", 404)
+    base = os.path.join(upload_folder, PARTIAL_DIR, upload_id)
+    return base + ".part", base + ".json"
+
+
+def _meta(upload_folder, upload_id):
+    part, meta = _paths(upload_folder, upload_id)
+    try:
+        with open(meta, encoding="utf-8") as f:
+            return part, json.load(f)
+    except FileNotFoundError:
+        raise UploadError("Envoi introuvable", 404)
+
+
+def create(upload_folder, filename, size, max_size):
+    """Start an upload of `size` bytes. Returns its status (see status())."""
+    if size <= 0:
+        raise UploadError("Fichier vide")
+    if size > max_size:
+        raise UploadError(f"Fichier trop volumineux (max {max_size // (1024 * 1024)} Mo)", 413)
+    expire(upload_folder)
+    upload_id = uuid.uuid4().hex
+    part, meta = _paths(upload_folder, upload_id)
+    os.makedirs(os.path.dirname(part), exist_ok=True)
+    open(part, "wb").close()
+    with open(meta, "w", encoding="utf-8") as f:
+        json.dump({"filename": filename, "size": size, "created": time.time()}, f)
+    return status(upload_folder, upload_id)
+
+
+def status(upload_folder, upload_id):
+    """{id, size, received, chunk_size, complete}"""
+    part, meta = _meta(upload_folder, upload_id)
+    received = os.path.getsize(part)
+    return {"id": upload_id, "size": meta["size"], "received": received,
+            "chunk_size": CHUNK_SIZE, "complete": received == meta["size"]}
+
+
+@instrumentation.timed("file.upload")
+def write_chunk(upload_folder, upload_id, content_range, stream):
+    """
+    Append one chunk, read from `stream`, at the offset given by
+    `content_range` ("bytes <first>-<last>/<size>"). A chunk that does not
+    start where the file ends is refused (409) with the offset to resume
+    from. Returns the new status.
+    """
+    part, meta = _meta(upload_folder, upload_id)
+    m = _CONTENT_RANGE.match(content_range or "")
+    if not m:
+        raise UploadError("En-tête Content-Range invalide")
+    first, last, size = (int(v) for v in m.groups())
+    if size != meta["size"] or last < first or last >= size or last - first + 1 > CHUNK_SIZE:
+        raise UploadError("En-tête Content-Range invalide")
+    received = os.path.getsize(part)
+    if first != received:
+        raise UploadError("Morceau inattendu", 409, received)
+
+    expected = last - first + 1
+    with open(part, "r+b") as out:
+        out.seek(first)
+        remaining = expected
+        while remaining:
+            data = stream.read(min(_COPY, remaining))
+            if not data:
+                break
+            out.write(data)
+            remaining -= len(data)
+        if remaining:
+            # Connection dropped mid-chunk: keep only whole chunks
+            out.truncate(first)
+            raise UploadError("Morceau incomplet", 400, first)
+    return status(upload_folder, upload_id)
+
+
+def take(upload_folder, upload_id, conn=None):
+    """
+    Move a complete upload into the blob store (`conn` as in
+    blobstore.put). Returns the blob path ("blobs/<sha256>.<ext>") and the
+    original file name.
+    """
+    part, meta = _meta(upload_folder, upload_id)
+    if os.path.getsize(part) != meta["size"]:
+        raise UploadError("Envoi incomplet", 409, os.path.getsize(part))
+    _, ext = os.path.splitext(meta["filename"])
+    blob = blobstore.put_file(upload_folder, part, ext or ".png", conn)
+    os.remove(_paths(upload_folder, upload_id)[1])
+    return blob, meta["filename"]
+
+
+def expire(upload_folder, max_age=EXPIRY):
+    """
+    Delete the uploads nothing was written to for `max_age` seconds. The
+    .part file changes with every chunk, the .json one only at creation:
+    an upload's age is that of its newest file.
+    """
+    folder = os.path.join(upload_folder, PARTIAL_DIR)
+    cutoff = time.time() - max_age
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return
+    uploads = {}
+    for name in names:
+        path = os.path.join(folder, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        entry = uploads.setdefault(os.path.splitext(name)[0], [0, []])
+        entry[0] = max(entry[0], mtime)
+        entry[1].append(path)
+    for newest, paths in uploads.values():
+        if newest < cutoff:
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
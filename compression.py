@@ -0,0 +1,71 @@
+"""
+Compression of the app's own responses (JSON, HTML pages, SVG).
+
+Brotli when the client accepts it and the brotli module is installed,
+gzip otherwise. Files sent with send_file (images, PDFs, ZIPs, static
+assets) pass through untouched: they are either compressed already or
+served by the front web server. A compressed response's ETag is made weak,
+as it no longer matches the bytes of the uncompressed one; the routes
+compare ETags with weak comparison, so 304s keep working either way.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+# Below this, compressing costs more than it saves
+MIN_SIZE = 512
+TYPES = {"application/json", "application/javascript", "application/xml", "image/svg+xml"}
+GZIP_LEVEL = 5
+# Fast settings: these responses are compressed on every request
+BROTLI_QUALITY = 4
+
+
+def _compressible(response):
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+        return False
+    if "Content-Encoding" in response.headers or "Content-Range" in response.headers:
+        return False
+    if "no-transform" in (response.headers.get("Cache-Control") or ""):
+        return False
+    mimetype = response.mimetype or ""
+    return mimetype.startswith("text/") or mimetype in TYPES
+
+
+def _encoding(accept_encoding):
+    if brotli is not None and accept_encoding["br"]:
+        return "br"
+    if accept_encoding["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(response):
+    """after_request hook: compress `response` if the client and the content allow."""
+    if not _compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = _encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+    if encoding == "br":
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress)
@@ -0,0 +1,75 @@
+"""
+CPID listings of the home page selectors, one per product type.
+
+The cpid_listing table (migrations._0009_cpid_listing) holds the CPIDs of
+the French rows, kept sorted case-insensitively by its primary key and
+updated by triggers on every insert, rename and delete — never rebuilt.
+A type's full listing is one index range scan, memoized per process for
+the type's current version; a typeahead lookup reads only the matching
+range. The version also gives the ETag of the /api/cpids responses.
+"""
+import hashlib
+import threading
+
+# Above this many CPIDs the home page ships none: the selector looks them up
+INLINE_LIMIT = 500
+MAX_LIMIT = 200
+
+
+def version(conn, product_type):
+    row = conn.execute("SELECT version FROM cpid_listing_version WHERE type=?", (product_type or "",)).fetchone()
+    return row[0] if row else 0
+
+
+def etag(*parts):
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:24]
+
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def listing(conn, product_type):
+    """(version, every CPID of the type in case-insensitive order)."""
+    product_type = product_type or ""
+    current = version(conn, product_type)
+    with _memo_lock:
+        entry = _memo.get(product_type)
+        if entry and entry[0] == current:
+            return entry
+    cpids = [row[0] for row in conn.execute(
+        "SELECT cpid FROM cpid_listing WHERE type=? ORDER BY sort_key, cpid", (product_type,))]
+    entry = (current, cpids)
+    with _memo_lock:
+        _memo[product_type] = entry
+    return entry
+
+
+def count(conn, product_type):
+    return conn.execute("SELECT count(*) FROM cpid_listing WHERE type=?", (product_type or "",)).fetchone()[0]
+
+
+def _upper_bound(prefix):
+    # Smallest string above every string starting with `prefix`
+    return prefix + "\U0010ffff"
+
+
+def lookup(conn, product_type, text, limit=50):
+    """
+    Typeahead: CPIDs of the type starting with `text` (case-insensitive),
+    in order, then — if that leaves room — the ones merely containing it.
+    """
+    product_type = product_type or ""
+    # SQLite's lower(), as in sort_key
+    key = conn.execute("SELECT lower(?)", ((text or "").strip(),)).fetchone()[0]
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    found = [row[0] for row in conn.execute("""
+        SELECT cpid FROM cpid_listing WHERE type=? AND sort_key >= ? AND sort_key < ?
+        ORDER BY sort_key, cpid LIMIT ?
+    """, (product_type, key, _upper_bound(key), limit))]
+    if key and len(found) < limit:
+        found += [row[0] for row in conn.execute("""
+            SELECT cpid FROM cpid_listing WHERE type=? AND instr(sort_key, ?) > 1
+            ORDER BY sort_key, cpid LIMIT ?
+        """, (product_type, key, limit - len(found)))]
+    return found
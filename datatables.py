@@ -0,0 +1,133 @@
+"""
+Server side of the DataTables "server-side processing" protocol, for the
+database editor: the browser only ever holds the page it displays.
+
+Request parameters (form or query string, as DataTables 1.10+ sends them):
+    draw, start, length, search[value],
+    order[i][column], order[i][dir],
+    columns[i][data], columns[i][searchable], columns[i][orderable],
+    columns[i][search][value]
+and two extensions:
+    fields  comma-separated columns to return (the visible ones; id is
+            always returned)
+    after   id of the last row of the previous page. When the table is
+            sorted on id alone, the next page is read with id < after
+            (keyset paging) instead of skipping `start` rows.
+
+Response: {draw, recordsTotal, recordsFiltered, data: [{column: value}], last_id}
+
+Column names are only taken from `columns` (the table schema), never from
+the request, so they can be put into the SQL as identifiers.
+"""
+
+DEFAULT_LENGTH = 25
+# "All" (length=-1) is capped too
+MAX_LENGTH = 500
+
+
+class RequestError(ValueError):
+    """Malformed DataTables request."""
+
+
+def _int(params, key, default):
+    try:
+        return int(params.get(key, default))
+    except (TypeError, ValueError):
+        raise RequestError(f"Paramètre invalide : {key}")
+
+
+def _like(value):
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _order_term(column, direction):
+    if column == "id":
+        return f"id {direction}"
+    # Values are TEXT: sort numbers as numbers ("900" before "2700") the way
+    # DataTables did client side; non-numeric text all casts to 0 and falls
+    # through to the plain text order
+    return f"CAST([{column}] AS REAL) {direction}, [{column}] {direction}"
+
+
+def query(conn, table, columns, params):
+    """Answer one DataTables request on `table`, restricted to `columns`."""
+    known = set(columns)
+    draw = _int(params, "draw", 0)
+    start = max(0, _int(params, "start", 0))
+    length = _int(params, "length", DEFAULT_LENGTH)
+    if length < 0 or length > MAX_LENGTH:
+        length = MAX_LENGTH
+
+    client_columns = []
+    i = 0
+    while f"columns[{i}][data]" in params:
+        client_columns.append(params[f"columns[{i}][data]"])
+        i += 1
+
+    def flag(idx, name):
+        return params.get(f"columns[{idx}][{name}]", "true") == "true"
+
+    # -------- filtering --------
+    where, args = [], []
+    searchable = [c for idx, c in enumerate(client_columns) if c in known and flag(idx, "searchable")]
+    # Like DataTables' smart search: every word has to match some column
+    for term in params.get("search[value]", "").split():
+        if searchable:
+            where.append("(" + " OR ".join(f"[{c}] LIKE ? ESCAPE '\\'" for c in searchable) + ")")
+            args.extend([_like(term)] * len(searchable))
+    for idx, column in enumerate(client_columns):
+        value = params.get(f"columns[{idx}][search][value]", "").strip()
+        if value and column in known:
+            where.append(f"[{column}] LIKE ? ESCAPE '\\'")
+            args.append(_like(value))
+
+    # -------- ordering --------
+    order = []
+    j = 0
+    while f"order[{j}][column]" in params:
+        idx = _int(params, f"order[{j}][column]", 0)
+        direction = "DESC" if params.get(f"order[{j}][dir]") == "desc" else "ASC"
+        if idx < len(client_columns) and client_columns[idx] in known and flag(idx, "orderable"):
+            order.append((client_columns[idx], direction))
+        j += 1
+    if not order:
+        order = [("id", "DESC")]
+    keyset = len(order) == 1 and order[0][0] == "id" and params.get("after")
+    if all(column != "id" for column, _ in order):
+        # Stable pages when the sort column has ties
+        order.append(("id", "DESC"))
+
+    # -------- projection --------
+    fields = params.get("fields")
+    if fields:
+        selected = ["id"] + [c for c in fields.split(",") if c in known and c != "id"]
+    else:
+        selected = list(columns)
+
+    total = conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+    where_sql = f" WHERE {' AND '.join(where)}" if where else ""
+    filtered = conn.execute(f"SELECT count(*) FROM {table}{where_sql}", args).fetchone()[0] \
+        if where else total
+
+    page_where, page_args = list(where), list(args)
+    if keyset:
+        page_where.append("id < ?" if order[0][1] == "DESC" else "id > ?")
+        page_args.append(_int(params, "after", 0))
+    sql = f"SELECT {', '.join(f'[{c}]' for c in selected)} FROM {table}"
+    if page_where:
+        sql += f" WHERE {' AND '.join(page_where)}"
+    sql += " ORDER BY " + ", ".join(_order_term(c, d) for c, d in order) + " LIMIT ?"
+    page_args.append(length)
+    if not keyset:
+        sql += " OFFSET ?"
+        page_args.append(start)
+
+    data = [dict(row) for row in conn.execute(sql, page_args)]
+    return {
+        "draw": draw,
+        "recordsTotal": total,
+        "recordsFiltered": filtered,
+        "data": data,
+        "last_id": data[-1]["id"] if data else None,
+    }
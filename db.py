@@ -0,0 +1,132 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g
+
+import instrumentation
+
+
+DB_NAME = os.environ.get("FICHES_DB", "FicheTechnique.db")
+
+# How long a connection waits on a locked database before giving up (ms).
+BUSY_TIMEOUT_MS = int(os.environ.get("FICHES_DB_BUSY_TIMEOUT", 5000))
+
+# Maximum number of idle connections kept around by the pool.
+POOL_SIZE = int(os.environ.get("FICHES_DB_POOL_SIZE", 8))
+
+# Applied to every new connection. WAL lets readers keep going while an
+# editor saves; synchronous=NORMAL is safe under WAL and avoids an fsync
+# on every commit.
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", BUSY_TIMEOUT_MS),
+    ("foreign_keys", "ON"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", -16000),        # ~16 MB page cache per connection
+    ("mmap_size", 64 * 1024 * 1024),
+)
+
+
+# -------------------- CONNECTIONS --------------------
+def connect(db_name=None):
+    """Open a new, fully configured connection (not pooled)."""
+    conn = sqlite3.connect(
+        db_name or DB_NAME,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        factory=instrumentation.connection_factory(),
+    )
+    instrumentation.instrument(conn)
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+class ConnectionPool:
+    """
+    Small LIFO pool of configured connections.
+    A connection is checked out for the duration of an app context and
+    handed back at teardown, so a request never pays for connect + PRAGMAs.
+    """
+
+    def __init__(self, db_name=None, size=POOL_SIZE):
+        self.db_name = db_name or DB_NAME
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.db_name)
+
+    def release(self, conn):
+        # Never hand a connection back in the middle of a transaction
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+pool = ConnectionPool()
+
+
+def get_db():
+    """Return the connection bound to the current app context."""
+    if "db" not in g:
+        g.db = pool.acquire()
+    return g.db
+
+
+def release_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        pool.release(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
+
+
+# -------------------- TRANSACTIONS --------------------
+@contextmanager
+def transaction(conn, retries=3):
+    """
+    Run a block as a write transaction.
+    BEGIN IMMEDIATE takes the write lock up front, so two editors saving at
+    once queue on busy_timeout instead of failing halfway through with
+    "database is locked". If the lock still cannot be taken, retry a few
+    times with a short backoff before giving up.
+    """
+    for attempt in range(retries):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or attempt == retries - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
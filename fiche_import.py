@@ -0,0 +1,277 @@
+"""
+Bulk import of fiche_technique rows from the XLSX export (or a CSV of it).
+
+The file is read in streaming mode (openpyxl read_only / csv reader) and
+rows are upserted on (cpid, langue) with executemany in batches, all inside
+one write transaction: an import either lands completely or not at all.
+Invalid rows do not abort it — they are skipped and reported with their
+line number.
+
+Headers may be the export's friendly names ("Référence", "Vue Éclatée 3"),
+the raw column names ("reference", "vue_eclatee_3") or either in any case.
+Components and drawings (vue_eclatee_N, dessin_technique_N,
+dessin_technique_nom_N) go to fiche_component / fiche_drawing; the ID and
+"Nb. Vues Éclatées" columns are ignored, both are derived. Only the child
+groups the file has columns for are replaced: a file without component
+columns leaves the existing components alone, likewise for drawings.
+In the same way a row of an existing (cpid, langue) only writes the columns
+the file has; the columns a new row cannot do without (reference,
+reference_menu) are required for inserts only.
+"""
+import csv
+import io
+import itertools
+import os
+
+import fiches
+import search
+from db import transaction
+
+BATCH = 500
+
+# Columns of the export that are not written back
+IGNORED_COLUMNS = {"id", "version", "vue_eclatee_count"}
+
+
+class ImportFileError(Exception):
+    """The file as a whole cannot be imported (format, headers)."""
+
+
+class _DryRun(Exception):
+    """Raised inside the transaction to roll a dry run back."""
+
+
+# -------------------- READING --------------------
+def _read_xlsx(stream):
+    import openpyxl
+    wb = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in wb.worksheets[0].iter_rows(values_only=True):
+            yield row
+    finally:
+        wb.close()
+
+
+def _read_csv(stream):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    sample = text.read(64 * 1024)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.reader(text, dialect)
+
+
+def read_rows(stream, filename):
+    """Yield the rows of an .xlsx or .csv file as sequences, header first."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in (".xlsx", ".xlsm"):
+        return _read_xlsx(stream)
+    if ext == ".csv":
+        return _read_csv(stream)
+    raise ImportFileError(f"Format non supporté : {ext or filename!r} (.xlsx ou .csv attendu)")
+
+
+# -------------------- HEADERS --------------------
+def header_map(columns, friendly_names):
+    """{normalised header: column} accepting friendly and raw names."""
+    mapping = {}
+    for column in columns:
+        for label in (column, friendly_names.get(column), column.replace('_', ' ').title()):
+            if label:
+                mapping[label.strip().lower()] = column
+    return mapping
+
+
+def map_headers(headers, mapping):
+    """Return ([column or None per header], [unknown headers])."""
+    columns, unknown = [], []
+    for header in headers:
+        key = str(header).strip().lower() if header is not None else ""
+        column = mapping.get(key)
+        if column is None and key:
+            unknown.append(str(header))
+        columns.append(column)
+    return columns, unknown
+
+
+# -------------------- VALIDATION --------------------
+def _clean(value, integer=False):
+    # Text columns keep the cell as written ("2.0" stays "2.0"); only
+    # INTEGER columns get a whole float back as an int
+    if value is None:
+        return None
+    if integer and isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def _validate(record, required):
+    missing = [c for c in required if not record.get(c)]
+    if missing:
+        return f"champ(s) obligatoire(s) manquant(s) : {', '.join(missing)}"
+    if record.get("langue") not in fiches.LANGUES:
+        return f"langue invalide : {record.get('langue')!r} (fr, en ou nl)"
+    return None
+
+
+def _missing(record, required):
+    missing = [c for c in required if not record.get(c)]
+    return f"champ(s) obligatoire(s) manquant(s) : {', '.join(missing)}" if missing else None
+
+
+# -------------------- IMPORT --------------------
+def import_rows(conn, rows, friendly_names, dry_run=False):
+    """
+    Upsert the rows (header first) into fiche_technique and its child tables.
+    Returns a report dict: inserted, updated, skipped, errors [{row, cpid,
+    langue, error}], ignored_headers. With dry_run the transaction is rolled
+    back after validation and writes, so the counts are exact.
+    """
+    rows = iter(rows)
+    try:
+        headers = next(rows)
+    except StopIteration:
+        raise ImportFileError("Fichier vide")
+
+    table_info = conn.execute("PRAGMA table_info(fiche_technique)").fetchall()
+    base_columns = [r[1] for r in table_info]
+    # NOT NULL without a default: needed to insert a row, not to update one
+    required = [r[1] for r in table_info if r[3] and r[4] is None and not r[5]]
+    integers = {r[1] for r in table_info if (r[2] or "").upper() == "INTEGER"}
+    mapping = header_map(fiches.wide_columns(conn), friendly_names)
+    columns, unknown = map_headers(headers, mapping)
+    if "cpid" not in columns or "langue" not in columns:
+        raise ImportFileError("Colonnes CPID et Langue obligatoires")
+
+    data_columns = [c for c in base_columns if c in columns and c not in IGNORED_COLUMNS]
+    # Child groups the file carries: only those are replaced, the others are left alone
+    groups = {
+        "components": any(c and fiches.COMPONENT_FIELD.match(c) for c in columns),
+        "images": any(c and fiches.DRAWING_IMAGE_FIELD.match(c) for c in columns),
+        "names": any(c and fiches.DRAWING_NAME_FIELD.match(c) for c in columns),
+    }
+    report = {"inserted": 0, "updated": 0, "skipped": 0, "errors": [], "ignored_headers": unknown}
+
+    def records():
+        seen = set()
+        for line, values in enumerate(rows, 2):
+            if values is None or all(v in (None, "") for v in values):
+                continue
+            record = {}
+            for column, value in zip(columns, values):
+                if column and column not in IGNORED_COLUMNS:
+                    record[column] = _clean(value, column in integers)
+            # Required columns the file has must be filled on every row; the
+            # others only on new rows (checked in _write_batch)
+            error = _validate(record, [c for c in required if c in data_columns])
+            key = (record.get("cpid"), record.get("langue"))
+            if not error and key in seen:
+                error = "doublon (cpid, langue) dans le fichier"
+            if error:
+                _skip(report, line, record, error)
+                continue
+            seen.add(key)
+            if key[1] == "nl" and record.get("type"):
+                record["type"] = fiches.TYPE_NAMES_NL.get(record["type"], record["type"])
+            yield line, record
+
+    updated = [c for c in data_columns if c not in ("cpid", "langue")]
+    sql = {
+        "insert": (f"INSERT INTO fiche_technique ({', '.join(f'[{c}]' for c in data_columns)}) "
+                   f"VALUES ({', '.join('?' * len(data_columns))})"),
+        "update": (f"UPDATE fiche_technique SET {', '.join(f'[{c}]=?' for c in updated)} "
+                   f"WHERE cpid=? AND langue=?") if updated else None,
+    }
+
+    try:
+        with transaction(conn):
+            pending = records()
+            while True:
+                batch = list(itertools.islice(pending, BATCH))
+                if not batch:
+                    break
+                _write_batch(conn, batch, data_columns, updated, sql, required, groups, report)
+            if dry_run:
+                raise _DryRun
+    except _DryRun:
+        pass
+    return report
+
+
+def _merge_drawings(old, new, images, names):
+    """The drawings of a row after an import that carries drawing images and/or names."""
+    empty = {"image": None, "nom": None}
+    merged = {}
+    for pos in set(old) | set(new):
+        o, n = old.get(pos, empty), new.get(pos, empty)
+        d = {"image": n["image"] if images else o["image"], "nom": n["nom"] if names else o["nom"]}
+        if d["image"] or d["nom"]:
+            merged[pos] = d
+    return merged
+
+
+def _skip(report, line, record, error):
+    report["errors"].append({"row": line, "cpid": record.get("cpid"),
+                             "langue": record.get("langue"), "error": error})
+    report["skipped"] += 1
+
+
+def _write_batch(conn, batch, data_columns, updated, sql, required, groups, report):
+    cpids = list({r["cpid"] for _, r in batch})
+    placeholders = ", ".join("?" * len(cpids))
+    existing = {
+        (row[0], row[1]) for row in conn.execute(
+            f"SELECT cpid, langue FROM fiche_technique WHERE cpid IN ({placeholders})", cpids)
+    }
+    # A row the file only updates needs its key, not the columns an insert requires
+    inserts, updates = [], []
+    for line, record in batch:
+        if (record["cpid"], record["langue"]) in existing:
+            updates.append(record)
+            continue
+        error = _missing(record, required)
+        if error:
+            _skip(report, line, record, error)
+        else:
+            inserts.append(record)
+    batch = inserts + updates
+    if not batch:
+        return
+    keys = [(r["cpid"], r["langue"]) for r in batch]
+    children = [fiches.split_children(r) for r in batch]
+    conn.executemany(sql["insert"], [[r.get(c) for c in data_columns] for r in inserts])
+    if sql["update"]:
+        conn.executemany(sql["update"], [[r.get(c) for c in updated] + [r["cpid"], r["langue"]] for r in updates])
+
+    ids = {
+        (row[0], row[1]): row[2] for row in conn.execute(
+            f"SELECT cpid, langue, id FROM fiche_technique WHERE cpid IN ({placeholders})", cpids)
+    }
+    fiche_ids = [ids[k] for k in keys]
+    id_list = ", ".join("?" * len(fiche_ids))
+    if groups["components"]:
+        conn.execute(f"DELETE FROM fiche_component WHERE fiche_id IN ({id_list})", fiche_ids)
+        conn.executemany(
+            "INSERT INTO fiche_component (fiche_id, position, label) VALUES (?, ?, ?)",
+            [(fid, pos, label) for fid, (components, _) in zip(fiche_ids, children)
+             for pos, label in sorted(components.items())])
+    if groups["images"] or groups["names"]:
+        old = {fid: {} for fid in fiche_ids}
+        if not (groups["images"] and groups["names"]):
+            # The half the file lacks is kept from the rows in the database
+            for fid, pos, image, nom in conn.execute(
+                    f"SELECT fiche_id, position, image, nom FROM fiche_drawing WHERE fiche_id IN ({id_list})",
+                    fiche_ids):
+                old[fid][pos] = {"image": image, "nom": nom}
+        conn.execute(f"DELETE FROM fiche_drawing WHERE fiche_id IN ({id_list})", fiche_ids)
+        conn.executemany(
+            "INSERT INTO fiche_drawing (fiche_id, position, image, nom) VALUES (?, ?, ?, ?)",
+            [(fid, pos, d["image"], d["nom"]) for fid, (_, drawings) in zip(fiche_ids, children)
+             for pos, d in sorted(_merge_drawings(old[fid], drawings, groups["images"], groups["names"]).items())])
+    search.reindex(conn, fiche_ids)
+
+    report["inserted"] += len(inserts)
+    report["updated"] += len(updates)
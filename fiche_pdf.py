@@ -0,0 +1,164 @@
+"""
+Server-side PDF rendering of the public fiche pages.
+
+The PDF is the /index page itself (same template, print stylesheet) laid
+out by WeasyPrint. Fonts come from the @font-face rules of stylesHaas.css
+(TECNIBO-DISPLAY, UniversalSans) and are embedded; the exploded-view SVG,
+with its source image and annotations, is drawn as vector graphics.
+Local /static URLs are read from disk, confined to the static folder.
+
+PDFs are cached on disk, one file per (cpid, lang, version) where the
+version covers the fiche revision, the exploded-view SVG and the template
+(see app.fiche_pdf_view). Rendering happens in a process pool: a request
+for a PDF that is not ready starts the job and returns at once, the
+browser polls.
+
+WeasyPrint is optional: without it available() is False and the page's
+"download PDF" button falls back to the browser's print dialog.
+"""
+import glob
+import hashlib
+import mimetypes
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+try:
+    import weasyprint
+    from weasyprint.text.fonts import FontConfiguration
+    from weasyprint.urls import URLFetcher, URLFetcherResponse
+except (ImportError, OSError):  # pragma: no cover - no WeasyPrint, or no Pango for it
+    weasyprint = None
+    URLFetcher = object
+
+from svg_store import write_atomic
+
+# Origin the page is laid out under; never fetched, mapped to the static folder
+ORIGIN = "http://fiche.pdf"
+
+PDF_CSS = """
+@page { size: A4; margin: 0; }
+.Telecharger { display: none !important; }
+"""
+
+
+def available():
+    return weasyprint is not None
+
+
+def cache_path(cache_dir, cpid, lang, version):
+    """Cache file of a fiche's PDF. All versions of (cpid, lang) share a prefix."""
+    return os.path.join(cache_dir, f"{_prefix(cpid, lang)}{version}.pdf")
+
+
+def _prefix(cpid, lang):
+    return f"{hashlib.sha1(cpid.encode('utf-8')).hexdigest()[:16]}-{lang}-"
+
+
+# -------------------- RENDERING (worker processes) --------------------
+class StaticURLFetcher(URLFetcher):
+    """Serves ORIGIN/<static prefix>/… from the static folder; other http(s) URLs as usual."""
+
+    def __init__(self, static_folder, static_prefixes, **kwargs):
+        super().__init__(allowed_protocols=("http", "https"), **kwargs)
+        self.static_folder = os.path.realpath(static_folder)
+        self.static_prefixes = list(static_prefixes)
+
+    def fetch(self, url, headers=None):
+        if not url.startswith(ORIGIN + "/"):
+            return super().fetch(url, headers)
+        path = unquote(urlsplit(url).path)
+        for prefix in self.static_prefixes:
+            if path.startswith(prefix + "/"):
+                local = os.path.realpath(os.path.join(self.static_folder, path[len(prefix) + 1:]))
+                if os.path.commonpath([local, self.static_folder]) != self.static_folder:
+                    break
+                with open(local, "rb") as f:
+                    data = f.read()
+                mime = mimetypes.guess_type(local)[0] or "application/octet-stream"
+                # Relative references (an SVG's source image) stay under ORIGIN
+                return URLFetcherResponse(url, data, {"Content-Type": mime})
+        raise ValueError(f"Not a static file: {url}")
+
+
+def render_pdf(html, static_folder, static_prefixes, target):
+    """Lay `html` out as a PDF written atomically to `target`; drop older versions."""
+    font_config = FontConfiguration()
+    document = weasyprint.HTML(string=html, base_url=ORIGIN + "/index",
+                               url_fetcher=StaticURLFetcher(static_folder, static_prefixes))
+    pdf = document.write_pdf(stylesheets=[weasyprint.CSS(string=PDF_CSS, font_config=font_config)],
+                             font_config=font_config, presentational_hints=True)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    write_atomic(target, pdf)
+
+    prefix = os.path.basename(target).rsplit("-", 1)[0] + "-"
+    for old in glob.glob(os.path.join(glob.escape(os.path.dirname(target)), glob.escape(prefix) + "*.pdf")):
+        if old != target:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+    return target
+
+
+# -------------------- JOBS --------------------
+def process_pool(workers):
+    # spawn: workers must not inherit the server's threads and sockets
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class Renderer:
+    """
+    Process pool running render_pdf, with one job per target file at a
+    time. A failed job is reported once by state(), then forgotten so the
+    next request retries.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = process_pool(self.workers)
+        return self._executor
+
+    def state(self, target):
+        """"ready", "pending" or None (not started); raises the error of a failed job."""
+        if os.path.exists(target):
+            return "ready"
+        with self._lock:
+            future = self._jobs.get(target)
+            if future is None:
+                return None
+            if not future.done():
+                return "pending"
+            del self._jobs[target]
+        future.result()
+        return "ready"
+
+    def submit(self, target, html, static_folder, static_prefixes):
+        with self._lock:
+            if target in self._jobs:
+                return
+            future = self._pool().submit(render_pdf, html, static_folder, list(static_prefixes), target)
+            self._jobs[target] = future
+        future.add_done_callback(lambda f: self._finished(target, f))
+
+    def _finished(self, target, future):
+        if future.exception() is None:
+            with self._lock:
+                if self._jobs.get(target) is future:
+                    del self._jobs[target]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+renderer = Renderer()
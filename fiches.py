@@ -0,0 +1,297 @@
+"""
+Read/write access to fiche_technique, one CPID = up to three language rows.
+
+A "trilingual record" is a dict {"fr": row, "en": row, "nl": row} where each
+row is a plain dict, or None when that language does not exist yet.
+
+Exploded-view components and technical drawings live in the child tables
+fiche_component and fiche_drawing, one row per position and language row.
+Loaded rows carry them as:
+    row["components"] = [{"position": 1, "label": "..."}, ...]
+    row["drawings"]   = [{"position": 1, "image": "uploads/...", "nom": "..."}, ...]
+    row["vue_eclatee_count"] = len(row["components"])
+The form and the XLSX export keep the flat vue_eclatee_N /
+dessin_technique_N / dessin_technique_nom_N names — split_children() and
+flatten_children() convert between the two shapes. compact_record() gives
+the flat shape without repeating what the languages share (get_fiche's
+compact format).
+"""
+import json
+import re
+
+import search
+
+LANGUES = ("fr", "en", "nl")
+
+# Product type as stored on the Dutch rows
+TYPE_NAMES_NL = {'Cloison': 'Systeemwand', 'Porte': 'Deur'}
+
+# Stay well below SQLite's host-parameter limit (999 on older builds)
+_CHUNK = 500
+
+COMPONENT_FIELD = re.compile(r"^vue_eclatee_(\d+)$")
+DRAWING_IMAGE_FIELD = re.compile(r"^dessin_technique_(\d+)$")
+DRAWING_NAME_FIELD = re.compile(r"^dessin_technique_nom_(\d+)$")
+
+# Children are attached in the same statement, so a fiche is still one round trip
+_CHILDREN = """,
+    (SELECT json_group_array(json_object('position', position, 'label', label))
+       FROM (SELECT position, label FROM fiche_component
+              WHERE fiche_id = f.id ORDER BY position)) AS _components,
+    (SELECT json_group_array(json_object('position', position, 'image', image, 'nom', nom))
+       FROM (SELECT position, image, nom FROM fiche_drawing
+              WHERE fiche_id = f.id ORDER BY position)) AS _drawings"""
+
+
+def _select(columns=None, children=True):
+    """SELECT of whole rows, or of `columns` only; children attached or not."""
+    projection = "f.*" if columns is None else ", ".join(f"f.[{c}]" for c in columns)
+    return f"SELECT {projection}{_CHILDREN if children else ''}\nFROM fiche_technique f\n"
+
+
+_SELECT_WITH_CHILDREN = _select()
+
+
+def _empty_record():
+    return {lang: None for lang in LANGUES}
+
+
+def row_to_fiche(row):
+    """Turn a row selected with _SELECT_WITH_CHILDREN into a fiche dict."""
+    fiche = dict(row)
+    if "_components" not in fiche:
+        # Selected without children
+        return fiche
+    fiche["components"] = sorted(json.loads(fiche.pop("_components") or "[]"),
+                                 key=lambda c: c["position"])
+    fiche["drawings"] = sorted(json.loads(fiche.pop("_drawings") or "[]"),
+                               key=lambda d: d["position"])
+    fiche["vue_eclatee_count"] = len(fiche["components"])
+    return fiche
+
+
+def load_fiches(conn, cpids, langues=LANGUES, columns=None, children=True):
+    """
+    Load the language rows (with their components and drawings) of many
+    CPIDs with one query per 500 CPIDs. `columns` (checked by the caller,
+    see projection()) limits the columns read; `children=False` skips the
+    components and drawings.
+    Returns {cpid: trilingual record}; CPIDs with no rows at all are omitted.
+    """
+    select = _select(None if columns is None else list(dict.fromkeys(["cpid", "langue", *columns])), children)
+    cpids = list(dict.fromkeys(c for c in cpids if c))
+    lang_filter = ", ".join(["?"] * len(langues))
+    records = {}
+    for start in range(0, len(cpids), _CHUNK):
+        chunk = cpids[start:start + _CHUNK]
+        placeholders = ", ".join(["?"] * len(chunk))
+        rows = conn.execute(
+            select
+            + f"WHERE f.cpid IN ({placeholders}) AND f.langue IN ({lang_filter})",
+            chunk + list(langues)
+        ).fetchall()
+        for row in rows:
+            records.setdefault(row["cpid"], _empty_record())[row["langue"]] = row_to_fiche(row)
+    return records
+
+
+def load_fiche(conn, cpid, columns=None, children=True):
+    """Load the fr/en/nl rows of one CPID in a single round trip."""
+    return load_fiches(conn, [cpid], columns=columns, children=children).get(cpid, _empty_record())
+
+
+def load_fiche_language(conn, cpid, langue):
+    """Load one language row of a CPID, or None."""
+    return load_fiches(conn, [cpid], langues=(langue,)).get(cpid, _empty_record()).get(langue)
+
+
+# -------------------- FLAT <-> NORMALIZED --------------------
+def split_children(data):
+    """
+    Pop the flat vue_eclatee_N / dessin_technique_N / dessin_technique_nom_N
+    keys out of a form dict (in place).
+    Returns (components, drawings): {position: label} and
+    {position: {"image": ..., "nom": ...}}, without empty entries.
+    """
+    components, drawings = {}, {}
+    for key in list(data.keys()):
+        m = COMPONENT_FIELD.match(key)
+        if m:
+            value = data.pop(key)
+            if value and value.strip():
+                components[int(m.group(1))] = value
+            continue
+        m = DRAWING_IMAGE_FIELD.match(key)
+        if m:
+            drawings.setdefault(int(m.group(1)), {"image": None, "nom": None})["image"] = data.pop(key) or None
+            continue
+        m = DRAWING_NAME_FIELD.match(key)
+        if m:
+            value = data.pop(key)
+            drawings.setdefault(int(m.group(1)), {"image": None, "nom": None})["nom"] = \
+                value if value and value.strip() else None
+    drawings = {pos: d for pos, d in drawings.items() if d["image"] or d["nom"]}
+    return components, drawings
+
+
+def localize_children(drawings, translations):
+    """
+    Build the components/drawings of an en or nl row: labels and drawing
+    names come from the translations, drawing images are shared with fr.
+    Entries left with neither image nor name are dropped, as in split_children.
+    """
+    translations = dict(translations)
+    components, names = split_children(translations)
+    localized = {pos: {"image": d["image"], "nom": None} for pos, d in drawings.items()}
+    for pos, d in names.items():
+        localized.setdefault(pos, {"image": None, "nom": None})["nom"] = d["nom"]
+    # A fr drawing with a name but no image leaves nothing to show here
+    localized = {pos: d for pos, d in localized.items() if d["image"] or d["nom"]}
+    return components, localized
+
+
+def flatten_children(fiche):
+    """Return a copy of a loaded fiche with the children as flat form keys."""
+    flat = {k: v for k, v in fiche.items() if k not in ("components", "drawings")}
+    for c in fiche.get("components", []):
+        flat[f"vue_eclatee_{c['position']}"] = c["label"]
+    for d in fiche.get("drawings", []):
+        flat[f"dessin_technique_{d['position']}"] = d["image"]
+        flat[f"dessin_technique_nom_{d['position']}"] = d["nom"]
+    return flat
+
+
+def _own_field(name, translatable):
+    # Kept per language: translated columns, component labels, drawing names
+    return name in translatable or COMPONENT_FIELD.match(name) or DRAWING_NAME_FIELD.match(name)
+
+
+def projection(conn, fields):
+    """
+    The columns to read and whether children are needed, for a subset of
+    flat field names. Raises ValueError for a name that is not a field.
+    """
+    base = {row[1] for row in conn.execute("PRAGMA table_info(fiche_technique)")}
+    unknown = [f for f in fields if f not in base and not (
+        COMPONENT_FIELD.match(f) or DRAWING_IMAGE_FIELD.match(f) or DRAWING_NAME_FIELD.match(f))]
+    if unknown:
+        raise ValueError(f"Champs inconnus : {', '.join(unknown)}")
+    return [f for f in fields if f in base], any(f not in base for f in fields)
+
+
+def compact_record(record, translatable, fields=None):
+    """
+    A trilingual record in the flat layout, without repetition:
+
+        {"shared": {...}, "fr": {...}, "en": {...}, "nl": {...}}
+
+    "shared" holds the fr values of the fields the languages have in common
+    (images, dimensions…); each language holds its `translatable` fields,
+    component labels and drawing names, plus any shared field whose value
+    differs for it. Nulls are left out: a language's value of a field is its
+    own entry, else the shared one, else null. A missing language is null.
+    `fields` keeps only the given flat fields.
+    """
+    flat = {}
+    for lang, row in record.items():
+        if row is not None:
+            row = flatten_children(row)
+            row.pop("vue_eclatee_count", None)
+            if fields is not None:
+                row = {k: v for k, v in row.items() if k in fields}
+        flat[lang] = row
+
+    shared = {k: v for k, v in (flat.get("fr") or {}).items()
+              if v is not None and not _own_field(k, translatable)}
+    compact = {"shared": shared}
+    for lang, row in flat.items():
+        if row is None:
+            compact[lang] = None
+            continue
+        compact[lang] = {k: v for k, v in row.items()
+                         if (v is not None if _own_field(k, translatable) else v != shared.get(k))}
+    return compact
+
+
+def write_children(conn, fiche_id, components, drawings):
+    """Replace the components and drawings of one language row."""
+    conn.execute("DELETE FROM fiche_component WHERE fiche_id=?", (fiche_id,))
+    conn.execute("DELETE FROM fiche_drawing WHERE fiche_id=?", (fiche_id,))
+    conn.executemany(
+        "INSERT INTO fiche_component (fiche_id, position, label) VALUES (?, ?, ?)",
+        [(fiche_id, pos, label) for pos, label in sorted(components.items())]
+    )
+    conn.executemany(
+        "INSERT INTO fiche_drawing (fiche_id, position, image, nom) VALUES (?, ?, ?, ?)",
+        [(fiche_id, pos, d["image"], d["nom"]) for pos, d in sorted(drawings.items())]
+    )
+    search.reindex(conn, [fiche_id])
+
+
+def changed_columns(existing, data):
+    """The items of `data` that differ from the loaded row `existing`."""
+    return {k: v for k, v in data.items() if existing.get(k) != v}
+
+
+def children_changed(existing, components, drawings):
+    """Whether split/localize_children() output differs from a loaded row's children."""
+    current = ({c["position"]: c["label"] for c in existing.get("components", [])},
+               {d["position"]: {"image": d["image"], "nom": d["nom"]} for d in existing.get("drawings", [])})
+    return current != (components, drawings)
+
+
+def write_changes(conn, existing, data, components, drawings):
+    """
+    Update a loaded language row to `data` and the given children, writing
+    only what differs: the changed columns in one UPDATE, the children
+    only if they changed. Returns whether anything was written.
+    """
+    changed = changed_columns(existing, data)
+    if changed:
+        conn.execute(f"UPDATE fiche_technique SET {', '.join(f'[{k}]=?' for k in changed)} WHERE id=?",
+                     list(changed.values()) + [existing["id"]])
+    rewrite = children_changed(existing, components, drawings)
+    if rewrite:
+        write_children(conn, existing["id"], components, drawings)
+    return bool(changed) or rewrite
+
+
+# -------------------- EXPORT (wide layout) --------------------
+def wide_columns(conn):
+    """
+    Column list of the flat export layout: the fiche_technique columns plus
+    vue_eclatee_1..N, vue_eclatee_count, dessin_technique_1..M and
+    dessin_technique_nom_1..M, where N and M follow the data (22 / 6 minimum).
+    """
+    base = [row[1] for row in conn.execute("PRAGMA table_info(fiche_technique)").fetchall()]
+    max_comp = conn.execute("SELECT MAX(position) FROM fiche_component").fetchone()[0] or 0
+    max_draw = conn.execute("SELECT MAX(position) FROM fiche_drawing").fetchone()[0] or 0
+    n, m = max(22, max_comp), max(6, max_draw)
+    return (base
+            + [f"vue_eclatee_{i}" for i in range(1, n + 1)] + ["vue_eclatee_count"]
+            + [f"dessin_technique_{i}" for i in range(1, m + 1)]
+            + [f"dessin_technique_nom_{i}" for i in range(1, m + 1)])
+
+
+def wide_select_sql(columns):
+    """SELECT producing `columns` (from wide_columns) — one seek per child cell."""
+    exprs = []
+    for col in columns:
+        m = COMPONENT_FIELD.match(col)
+        if m:
+            exprs.append(f"(SELECT label FROM fiche_component WHERE fiche_id=f.id AND position={int(m.group(1))})")
+            continue
+        m = DRAWING_NAME_FIELD.match(col)
+        if m:
+            exprs.append(f"(SELECT nom FROM fiche_drawing WHERE fiche_id=f.id AND position={int(m.group(1))})")
+            continue
+        m = DRAWING_IMAGE_FIELD.match(col)
+        if m:
+            exprs.append(f"(SELECT image FROM fiche_drawing WHERE fiche_id=f.id AND position={int(m.group(1))})")
+            continue
+        if col == "vue_eclatee_count":
+            exprs.append("(SELECT COUNT(*) FROM fiche_component WHERE fiche_id=f.id)")
+            continue
+        exprs.append(f"f.[{col}]")
+    select = ",\n    ".join(f"{e} AS [{c}]" for e, c in zip(exprs, columns))
+    return f"SELECT\n    {select}\nFROM fiche_technique f"
@@ -0,0 +1,93 @@
+"""
+Resized WebP derivatives of uploaded images, for the public fiche pages.
+
+Uploads are content-addressed blobs (see blobstore.py) and stay untouched.
+Their 320/640/1280 px WebP copies are built by the "derivatives" background
+job queued with the upload (app.save_file) and kept in
+static/uploads/derivatives/:
+
+    uploads/blobs/<sha256>.jpg
+    uploads/derivatives/blobs/<sha256>.jpg-640.webp
+
+The derivatives tree mirrors the upload folder, so the original of any
+derivative is its path with the "-<width>.webp" suffix dropped.
+
+The /derivative route builds one on demand if its job has not run yet (or
+for files uploaded before the jobs existed); a derivative older than its
+original is rebuilt. URLs carry the original's mtime (?v=...) so browsers
+may cache them forever.
+Pillow is optional: without it, app.image_srcset() returns "" and pages fall
+back to the originals.
+"""
+import os
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - the pages then serve originals only
+    Image = None
+
+import instrumentation
+from svg_store import write_atomic
+
+DERIVATIVE_DIR = "derivatives"
+WIDTHS = (320, 640, 1280)
+RASTER_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+WEBP_QUALITY = 80
+
+
+def supports(path):
+    """True if `path` (relative to static/, e.g. "uploads/x.jpg") can get derivatives."""
+    return (Image is not None and bool(path)
+            and os.path.splitext(path)[1].lower() in RASTER_EXTENSIONS)
+
+
+def derivative_name(filename, width):
+    """Cache path of `filename` (relative to the upload folder) at `width`, relative to DERIVATIVE_DIR."""
+    return f"{filename}-{width}.webp"
+
+
+def source_name(derivative):
+    """Inverse of derivative_name(): the original's filename, or None."""
+    stem, _, tail = derivative.replace(os.sep, '/').rpartition('-')
+    if not stem or not tail.endswith('.webp') or not tail[:-len('.webp')].isdigit():
+        return None
+    return stem
+
+
+def derivative_path(upload_folder, filename, width):
+    """
+    Return the path of the `width` derivative of uploads/<filename>, building
+    it first if it is missing or older than the original. None when the
+    original does not exist or cannot be read.
+    """
+    source = os.path.join(upload_folder, filename)
+    try:
+        source_mtime = os.stat(source).st_mtime_ns
+    except OSError:
+        return None
+    target = os.path.join(upload_folder, DERIVATIVE_DIR, derivative_name(filename, width))
+    try:
+        if os.stat(target).st_mtime_ns >= source_mtime:
+            return target
+    except OSError:
+        pass
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    write_atomic(target, render(source, width))
+    return target
+
+
+@instrumentation.timed("image.render")
+def render(source, width):
+    """WebP bytes of `source` scaled down to `width` (never up)."""
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+        out = BytesIO()
+        img.save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+        return out.getvalue()
@@ -0,0 +1,276 @@
+"""
+Optional instrumentation: where the time of a request goes.
+
+Off unless FICHES_METRICS=1 at startup. When on:
+- each request is timed along with its SQL (statement count, including
+  statements run by triggers, through the connection's trace callback;
+  time spent in execute and fetch, through the cursor class) and the
+  named spans of the slow parts: SVG parsing and writing, XLSX, blob and
+  upload file I/O (@timed / span());
+- the breakdown goes back in a Server-Timing header, shown by the
+  browser's network panel;
+- statements slower than FICHES_SLOW_SQL_MS (default 100) are logged;
+- totals since startup are served at /metrics in the Prometheus text
+  format — per process: each worker of a multi-process server has its own;
+- with FICHES_PROFILE_DIR set, ?profile=1 on any request dumps a cProfile
+  of it there (<time>-<endpoint>.prof, for pstats or snakeviz).
+
+When off, @timed returns the function itself, span() a shared no-op
+context and db.connect() plain connections: nothing is measured.
+"""
+import contextlib
+import cProfile
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from flask import request
+
+ENABLED = os.environ.get("FICHES_METRICS", "") not in ("", "0")
+PROFILE_DIR = os.environ.get("FICHES_PROFILE_DIR") or None
+SLOW_SQL = float(os.environ.get("FICHES_SLOW_SQL_MS", 100)) / 1000
+
+# Upper bounds (seconds) of the request duration histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger(__name__)
+
+# Timings of the request running on this thread: {name: [seconds, count]}
+_local = threading.local()
+
+
+# -------------------- METRICS --------------------
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Process-wide totals, rendered for /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}      # (endpoint, method, status) -> count
+        self.durations = {}     # endpoint -> [bucket counts..., +Inf count, sum]
+        self.spans = {}         # name -> [seconds, count]
+
+    def add_span(self, name, seconds, count):
+        with self._lock:
+            entry = self.spans.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += count
+
+    def observe_request(self, endpoint, method, status, seconds):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            entry = self.durations.setdefault(endpoint, [0] * (len(BUCKETS) + 1) + [0.0])
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry[i] += 1
+            entry[len(BUCKETS)] += 1
+            entry[-1] += seconds
+
+    def render(self):
+        with self._lock:
+            lines = ["# HELP fiches_http_requests_total Requests handled.",
+                     "# TYPE fiches_http_requests_total counter"]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'fiches_http_requests_total{{endpoint="{_label(endpoint)}",'
+                             f'method="{method}",status="{status}"}} {count}')
+            lines += ["# HELP fiches_http_request_duration_seconds Request duration.",
+                      "# TYPE fiches_http_request_duration_seconds histogram"]
+            for endpoint, entry in sorted(self.durations.items()):
+                name = _label(endpoint)
+                for bound, count in zip(BUCKETS + ("+Inf",), entry):
+                    lines.append(f'fiches_http_request_duration_seconds_bucket{{endpoint="{name}",le="{bound}"}} {count}')
+                lines.append(f'fiches_http_request_duration_seconds_sum{{endpoint="{name}"}} {entry[-1]:.6f}')
+                lines.append(f'fiches_http_request_duration_seconds_count{{endpoint="{name}"}} {entry[len(BUCKETS)]}')
+            lines += ["# HELP fiches_span_seconds_total Time spent in SQL and in timed operations.",
+                      "# TYPE fiches_span_seconds_total counter"]
+            lines += [f'fiches_span_seconds_total{{span="{_label(n)}"}} {e[0]:.6f}' for n, e in sorted(self.spans.items())]
+            lines += ["# HELP fiches_span_calls_total SQL statements run and timed operations.",
+                      "# TYPE fiches_span_calls_total counter"]
+            lines += [f'fiches_span_calls_total{{span="{_label(n)}"}} {e[1]}' for n, e in sorted(self.spans.items())]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# -------------------- SPANS --------------------
+def _record(name, seconds, count=1):
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += count
+    metrics.add_span(name, seconds, count)
+
+
+@contextlib.contextmanager
+def _span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+_NULL = contextlib.nullcontext()
+
+
+def span(name):
+    """Time a block under `name` (a no-op when instrumentation is off)."""
+    return _span(name) if ENABLED else _NULL
+
+
+def timed(name):
+    """Decorator form of span(); leaves the function untouched when off."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def timed_fn(*args, **kwargs):
+            with _span(name):
+                return fn(*args, **kwargs)
+        return timed_fn
+    return decorate
+
+
+# -------------------- SQL --------------------
+class _Timer:
+    __slots__ = ("start",)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        # Statements are counted by the trace callback: time only here
+        _record("sql", time.perf_counter() - self.start, 0)
+
+
+class Cursor(sqlite3.Cursor):
+    """Adds the time spent in SQLite (execute and every fetch) to the "sql" span."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            _record("sql", elapsed, 0)
+            if elapsed > SLOW_SQL:
+                log.warning("Slow SQL (%.0f ms): %s", elapsed * 1000, " ".join(sql.split())[:500])
+
+    def executemany(self, sql, seq_of_parameters):
+        with _Timer():
+            return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        with _Timer():
+            return super().executescript(sql_script)
+
+    def fetchone(self):
+        with _Timer():
+            return super().fetchone()
+
+    def fetchmany(self, size=None):
+        with _Timer():
+            return super().fetchmany(self.arraysize if size is None else size)
+
+    def fetchall(self):
+        with _Timer():
+            return super().fetchall()
+
+    def __next__(self):
+        with _Timer():
+            return super().__next__()
+
+
+class Connection(sqlite3.Connection):
+    """Connection whose statements go through Cursor (sqlite3.connect(factory=...))."""
+
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def _trace(statement):
+    _record("sql", 0.0)
+
+
+def connection_factory():
+    """The factory for sqlite3.connect(): timed connections when on."""
+    return Connection if ENABLED else sqlite3.Connection
+
+
+def instrument(conn):
+    """Count the statements run on a new connection (trigger bodies included)."""
+    if ENABLED:
+        conn.set_trace_callback(_trace)
+
+
+# -------------------- REQUESTS --------------------
+def server_timing(total, timings):
+    parts = [f"app;dur={total * 1000:.1f}"]
+    for name, (seconds, count) in sorted(timings.items()):
+        parts.append(f'{name};dur={seconds * 1000:.1f};desc="{count}"')
+    return ", ".join(parts)
+
+
+def init_app(app):
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def _start():
+        _local.timings = {}
+        _local.start = time.perf_counter()
+        _local.profile = None
+        if PROFILE_DIR and request.args.get("profile") == "1":
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another request of this process is being profiled
+                return
+            _local.profile = profile
+
+    @app.after_request
+    def _finish(response):
+        start = getattr(_local, "start", None)
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        profile = _local.profile
+        if profile is not None:
+            profile.disable()
+            _local.profile = None
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile.dump_stats(os.path.join(
+                PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'none'}-{os.getpid()}.prof"))
+        response.headers["Server-Timing"] = server_timing(total, _local.timings)
+        metrics.observe_request(request.endpoint or "none", request.method, response.status_code, total)
+        return response
+
+    @app.teardown_request
+    def _clear(exc=None):
+        _local.timings = None
+        _local.start = None
+        profile = getattr(_local, "profile", None)
+        if profile is not None:
+            # after_request did not run (unhandled error)
+            profile.disable()
+        _local.profile = None
@@ -0,0 +1,176 @@
+"""
+Background jobs: the file work of the edit forms (building exploded-view
+SVGs, WebP derivatives), moved off the request thread.
+
+A job is a row of the `job` table (migrations._0008_jobs), so any process
+can enqueue one and any process can run it: each app process has a few
+worker threads (started on first use) that claim queued jobs, and
+`flask run-jobs` runs them in the foreground. Jobs sharing a key run one
+after the other, in the order they were queued — two uploads for the same
+CPID never finish out of order. A job left "running" by a process that
+died is claimed again after LEASE seconds, up to MAX_ATTEMPTS times.
+
+Handlers are registered per kind with @handler("kind"); they get the
+JSON payload and return a JSON-able result. An exception fails the job,
+its message is kept in `error` for the status endpoint.
+"""
+import json
+import os
+import threading
+import time
+
+import db
+from db import transaction
+
+LEASE = 300
+MAX_ATTEMPTS = 3
+# Seconds between queue checks when idle (jobs queued by other processes)
+POLL_INTERVAL = 1.0
+# Finished jobs are kept this long for the status endpoints
+KEEP = 7 * 24 * 3600
+
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(conn, kind, payload, key=None):
+    """Queue a job (in its own transaction, so workers see it at once). Returns its id."""
+    with transaction(conn):
+        job_id = conn.execute(
+            "INSERT INTO job (kind, key, payload, created) VALUES (?, ?, ?, ?)",
+            (kind, key, json.dumps(payload), time.time())).lastrowid
+    runner.notify()
+    return job_id
+
+
+def _to_dict(row):
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "created": row["created"],
+        "started": row["started"],
+        "finished": row["finished"],
+    }
+
+
+def get(conn, job_ids):
+    """Status of the given jobs, by id; unknown (or pruned) ids are left out."""
+    job_ids = list(job_ids)
+    if not job_ids:
+        return {}
+    rows = conn.execute(f"SELECT * FROM job WHERE id IN ({', '.join('?' * len(job_ids))})", job_ids)
+    return {row["id"]: _to_dict(row) for row in rows}
+
+
+def claim(conn):
+    """Take the next runnable job: (id, kind, payload) or None."""
+    # Read first: an idle queue must not take the write lock every tick
+    if conn.execute("SELECT 1 FROM job WHERE status IN ('queued', 'running') LIMIT 1").fetchone() is None:
+        return None
+    now = time.time()
+    with transaction(conn):
+        row = conn.execute("""
+            SELECT id, kind, payload FROM job j
+            WHERE (status = 'queued' OR (status = 'running' AND started < ?))
+              AND attempts < ?
+              AND NOT EXISTS (SELECT 1 FROM job p
+                              WHERE p.key = j.key AND p.id < j.id AND p.status IN ('queued', 'running'))
+            ORDER BY id LIMIT 1
+        """, (now - LEASE, MAX_ATTEMPTS)).fetchone()
+        if row is None:
+            # Out of attempts: give up on them for good
+            conn.execute("""
+                UPDATE job SET status = 'failed', error = 'Abandonné après plusieurs tentatives',
+                               finished = ?
+                WHERE status = 'running' AND started < ? AND attempts >= ?
+            """, (now, now - LEASE, MAX_ATTEMPTS))
+            return None
+        conn.execute("UPDATE job SET status = 'running', started = ?, attempts = attempts + 1 WHERE id = ?",
+                     (now, row["id"]))
+    return row["id"], row["kind"], json.loads(row["payload"])
+
+
+def run(conn, job):
+    """Run a claimed job and record its outcome."""
+    job_id, kind, payload = job
+    try:
+        fn = HANDLERS.get(kind)
+        if fn is None:
+            raise LookupError(f"Type de tâche inconnu : {kind}")
+        result, error, status = fn(payload), None, "done"
+    except Exception as e:
+        result, error, status = None, f"{type(e).__name__}: {e}", "failed"
+    with transaction(conn):
+        conn.execute("UPDATE job SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                     (status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+    return status
+
+
+def prune(conn, keep=KEEP):
+    with transaction(conn):
+        return conn.execute("DELETE FROM job WHERE status IN ('done', 'failed') AND finished < ?",
+                            (time.time() - keep,)).rowcount
+
+
+def run_pending(conn):
+    """Run queued jobs until there are none left. Returns how many ran."""
+    count = 0
+    while True:
+        job = claim(conn)
+        if job is None:
+            return count
+        run(conn, job)
+        count += 1
+
+
+class Runner:
+    """Worker threads of this process. Restarted after a fork (pid change)."""
+
+    def __init__(self, threads=2):
+        self.threads = threads
+        self.db_name = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() or self.threads <= 0:
+                return
+            self._pid = os.getpid()
+            for i in range(self.threads):
+                threading.Thread(target=self._loop, name=f"jobs-{i}", daemon=True).start()
+
+    def notify(self):
+        self.start()
+        self._wake.set()
+
+    def _loop(self):
+        conn = db.connect(self.db_name)
+        last_prune = 0
+        while True:
+            try:
+                job = claim(conn)
+                if job is not None:
+                    run(conn, job)
+                    continue
+                if time.time() - last_prune > 3600:
+                    last_prune = time.time()
+                    prune(conn)
+            except Exception:
+                # Database busy or gone for a moment: try again on the next tick
+                pass
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+
+runner = Runner()
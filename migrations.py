@@ -0,0 +1,538 @@
+"""
+Versioned schema migrations for FicheTechnique.db.
+
+The schema version lives in PRAGMA user_version. Each migration runs in its
+own write transaction together with the version bump, so a crash mid-way
+leaves the database at the previous version, never in between.
+To change the schema, append a new function to MIGRATIONS — never edit one
+that has already shipped.
+"""
+from db import transaction
+
+
+class MigrationError(ValueError):
+    """The data does not allow a migration; the database stays at its version."""
+
+
+# -------------------- 1: BASELINE --------------------
+def _0001_baseline(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fiche_technique (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cpid TEXT NOT NULL,
+        reference TEXT NOT NULL,
+        reference_menu TEXT NOT NULL,
+        variant TEXT,
+        langue TEXT DEFAULT 'fr',
+        type TEXT,
+        description TEXT,
+        variant_image TEXT,
+        variant_name TEXT,
+        photo_produit TEXT,
+        hauteur TEXT,
+        largeur TEXT,
+        epaisseur TEXT,
+        epaisseur_battent TEXT,
+        tolerance_hauteur TEXT,
+        verre TEXT,
+        battant TEXT,
+        panneau TEXT,
+        poids_porte_cloison  TEXT,
+        resistance_feu TEXT,
+        nbn_s_01_400 TEXT,
+        nbn_en_iso_717_1 TEXT,
+        vue_eclatee_image TEXT,
+        vue_eclatee_1 TEXT,
+        vue_eclatee_2 TEXT,
+        vue_eclatee_3 TEXT,
+        vue_eclatee_4 TEXT,
+        vue_eclatee_5 TEXT,
+        vue_eclatee_6 TEXT,
+        vue_eclatee_7 TEXT,
+        vue_eclatee_8 TEXT,
+        vue_eclatee_9 TEXT,
+        vue_eclatee_10 TEXT,
+        vue_eclatee_11 TEXT,
+        vue_eclatee_12 TEXT,
+        vue_eclatee_13 TEXT,
+        vue_eclatee_14 TEXT,
+        vue_eclatee_15 TEXT,
+        vue_eclatee_16 TEXT,
+        vue_eclatee_17 TEXT,
+        vue_eclatee_18 TEXT,
+        vue_eclatee_19 TEXT,
+        vue_eclatee_20 TEXT,
+        vue_eclatee_21 TEXT,
+        vue_eclatee_22 TEXT,
+        vue_eclatee_count INTEGER DEFAULT 0,
+        dessin_technique_1 TEXT,
+        dessin_technique_2 TEXT,
+        dessin_technique_3 TEXT,
+        dessin_technique_4 TEXT,
+        dessin_technique_5 TEXT,
+        dessin_technique_6 TEXT,
+        dessin_technique_nom_1 TEXT,
+        dessin_technique_nom_2 TEXT,
+        dessin_technique_nom_3 TEXT,
+        dessin_technique_nom_4 TEXT,
+        dessin_technique_nom_5 TEXT,
+        dessin_technique_nom_6 TEXT
+    )
+    """)
+
+
+# -------------------- 2: DUTCH TYPE NAMES (was SQL.py) --------------------
+def _0002_dutch_type_names(conn):
+    conn.execute("""
+    UPDATE fiche_technique
+    SET type = CASE
+        WHEN langue = 'nl' AND type = 'Cloison' THEN 'Systeemwand'
+        WHEN langue = 'nl' AND type = 'Porte'   THEN 'Deur'
+        ELSE type
+    END
+    """)
+
+
+# -------------------- 3: CPID / LANGUE INDEXES --------------------
+def _0003_cpid_langue_indexes(conn):
+    # Older databases may hold several rows for the same (cpid, langue).
+    # Which one to keep is the operator's call: stop and list them.
+    duplicates = conn.execute("""
+    SELECT cpid, langue, group_concat(id, ', ') FROM fiche_technique
+    GROUP BY cpid, langue HAVING COUNT(*) > 1 ORDER BY cpid, langue
+    """).fetchall()
+    if duplicates:
+        raise MigrationError(
+            "Fiches en double (cpid, langue), à fusionner ou supprimer avant la migration :\n"
+            + "\n".join(f"  {cpid} / {langue} : ids {ids}" for cpid, langue, ids in duplicates))
+    conn.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_fiche_cpid_langue
+        ON fiche_technique (cpid, langue)
+    """)
+    # Covers home()'s DISTINCT cpid per type without touching the table
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS ix_fiche_type_langue_cpid
+        ON fiche_technique (type, langue, cpid)
+    """)
+
+
+# -------------------- 4: COMPONENT / DRAWING CHILD TABLES --------------------
+_NARROW_COLUMNS = """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cpid TEXT NOT NULL,
+        reference TEXT NOT NULL,
+        reference_menu TEXT NOT NULL,
+        variant TEXT,
+        langue TEXT DEFAULT 'fr',
+        type TEXT,
+        description TEXT,
+        variant_image TEXT,
+        variant_name TEXT,
+        photo_produit TEXT,
+        hauteur TEXT,
+        largeur TEXT,
+        epaisseur TEXT,
+        epaisseur_battent TEXT,
+        tolerance_hauteur TEXT,
+        verre TEXT,
+        battant TEXT,
+        panneau TEXT,
+        poids_porte_cloison TEXT,
+        resistance_feu TEXT,
+        nbn_s_01_400 TEXT,
+        nbn_en_iso_717_1 TEXT,
+        vue_eclatee_image TEXT
+"""
+
+
+def _0004_component_drawing_tables(conn):
+    # Rebuild fiche_technique without vue_eclatee_1..22, vue_eclatee_count
+    # and dessin_technique(_nom)_1..6. The wide table is renamed first so the
+    # child tables below reference the new table, and dropping the old one
+    # cannot cascade into them.
+    conn.execute("ALTER TABLE fiche_technique RENAME TO _fiche_technique_wide")
+    conn.execute("DROP INDEX IF EXISTS ux_fiche_cpid_langue")
+    conn.execute("DROP INDEX IF EXISTS ix_fiche_type_langue_cpid")
+    conn.execute(f"CREATE TABLE fiche_technique ({_NARROW_COLUMNS})")
+    columns = [line.strip().split()[0] for line in _NARROW_COLUMNS.strip().split(",\n")]
+    col_list = ", ".join(columns)
+    conn.execute(f"INSERT INTO fiche_technique ({col_list}) SELECT {col_list} FROM _fiche_technique_wide")
+    conn.execute("""
+    UPDATE sqlite_sequence SET seq = COALESCE(
+        (SELECT seq FROM sqlite_sequence WHERE name = '_fiche_technique_wide'), seq)
+    WHERE name = 'fiche_technique'
+    """)
+    conn.execute("CREATE UNIQUE INDEX ux_fiche_cpid_langue ON fiche_technique (cpid, langue)")
+    conn.execute("CREATE INDEX ix_fiche_type_langue_cpid ON fiche_technique (type, langue, cpid)")
+
+    conn.execute("""
+    CREATE TABLE fiche_component (
+        fiche_id INTEGER NOT NULL REFERENCES fiche_technique(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        label TEXT NOT NULL,
+        PRIMARY KEY (fiche_id, position)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE TABLE fiche_drawing (
+        fiche_id INTEGER NOT NULL REFERENCES fiche_technique(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        image TEXT,
+        nom TEXT,
+        PRIMARY KEY (fiche_id, position)
+    ) WITHOUT ROWID
+    """)
+
+    for i in range(1, 23):
+        conn.execute(f"""
+        INSERT INTO fiche_component (fiche_id, position, label)
+        SELECT id, {i}, vue_eclatee_{i} FROM _fiche_technique_wide
+        WHERE TRIM(COALESCE(vue_eclatee_{i}, '')) <> ''
+        """)
+    for i in range(1, 7):
+        conn.execute(f"""
+        INSERT INTO fiche_drawing (fiche_id, position, image, nom)
+        SELECT id, {i}, NULLIF(dessin_technique_{i}, ''), NULLIF(TRIM(dessin_technique_nom_{i}), '')
+        FROM _fiche_technique_wide
+        WHERE COALESCE(dessin_technique_{i}, '') <> ''
+           OR TRIM(COALESCE(dessin_technique_nom_{i}, '')) <> ''
+        """)
+
+    conn.execute("DROP TABLE _fiche_technique_wide")
+
+
+# -------------------- 5: BLOB REFERENCE COUNTS --------------------
+# Columns that may hold "uploads/blobs/<sha256>.<ext>" (see blobstore.py)
+_BLOB_COLUMNS = (
+    ("fiche_technique", "photo_produit"),
+    ("fiche_technique", "variant_image"),
+    ("fiche_drawing", "image"),
+)
+_BLOB_PREFIX = "uploads/blobs/"
+
+
+def _blob_inc(ref):
+    return f"""
+        INSERT INTO blob (name, refcount)
+        SELECT substr({ref}, 9), 1 WHERE substr({ref}, 1, {len(_BLOB_PREFIX)}) = '{_BLOB_PREFIX}'
+        ON CONFLICT (name) DO UPDATE SET refcount = refcount + 1;"""
+
+
+def _blob_dec(ref):
+    return f"""
+        UPDATE blob SET refcount = refcount - 1
+        WHERE name = substr({ref}, 9) AND substr({ref}, 1, {len(_BLOB_PREFIX)}) = '{_BLOB_PREFIX}';"""
+
+
+def _0005_blob_refcounts(conn):
+    conn.execute("""
+    CREATE TABLE blob (
+        name TEXT PRIMARY KEY,              -- "blobs/<sha256>.<ext>", relative to uploads/
+        refcount INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """)
+    for table in sorted({t for t, _ in _BLOB_COLUMNS}):
+        columns = [c for t, c in _BLOB_COLUMNS if t == table]
+        conn.execute(f"""
+        CREATE TRIGGER trg_{table}_blob_insert AFTER INSERT ON {table}
+        BEGIN{"".join(_blob_inc(f"NEW.{c}") for c in columns)}
+        END""")
+        conn.execute(f"""
+        CREATE TRIGGER trg_{table}_blob_delete AFTER DELETE ON {table}
+        BEGIN{"".join(_blob_dec(f"OLD.{c}") for c in columns)}
+        END""")
+        for c in columns:
+            conn.execute(f"""
+            CREATE TRIGGER trg_{table}_blob_update_{c} AFTER UPDATE OF {c} ON {table}
+            WHEN OLD.{c} IS NOT NEW.{c}
+            BEGIN{_blob_dec(f"OLD.{c}")}{_blob_inc(f"NEW.{c}")}
+            END""")
+
+    for table, column in _BLOB_COLUMNS:
+        conn.execute(f"""
+        INSERT INTO blob (name, refcount)
+        SELECT substr({column}, 9), COUNT(*) FROM {table}
+        WHERE substr({column}, 1, {len(_BLOB_PREFIX)}) = '{_BLOB_PREFIX}'
+        GROUP BY {column}
+        ON CONFLICT (name) DO UPDATE SET refcount = refcount + excluded.refcount
+        """)
+
+
+# -------------------- 6: FULL-TEXT SEARCH --------------------
+# One row per fiche_technique row (rowid = id), every language in the same
+# index. Columns are grouped so search.py can weight them with bm25().
+_SEARCH_COLUMNS = {
+    "reference": ("reference", "reference_menu", "variant", "variant_name", "type"),
+    "description": ("description",),
+    "technical": ("hauteur", "largeur", "epaisseur", "epaisseur_battent", "tolerance_hauteur",
+                  "verre", "battant", "panneau", "poids_porte_cloison", "resistance_feu",
+                  "nbn_s_01_400", "nbn_en_iso_717_1"),
+}
+
+
+def _0006_fiche_search(conn):
+    # The view is the single definition of an index row: the triggers below
+    # and search.reindex() both insert from it
+    groups = ",\n        ".join(
+        " || ' ' || ".join(f"coalesce(f.{c}, '')" for c in columns) + f" AS {name}"
+        for name, columns in _SEARCH_COLUMNS.items())
+    conn.execute(f"""
+    CREATE VIEW fiche_search_source AS
+    SELECT f.id, f.cpid, f.langue,
+        {groups},
+        (SELECT group_concat(label, ' ') FROM fiche_component WHERE fiche_id = f.id) AS components
+    FROM fiche_technique f
+    """)
+    conn.execute(f"""
+    CREATE VIRTUAL TABLE fiche_search USING fts5(
+        cpid, langue UNINDEXED, {", ".join(_SEARCH_COLUMNS)}, components,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """)
+    # Components are re-indexed by their writers (search.reindex), once per
+    # fiche: a trigger per component row would re-index the fiche ~20 times
+    # on every save, since children are always replaced as a whole
+    indexed = ["cpid", "langue"] + [c for columns in _SEARCH_COLUMNS.values() for c in columns]
+    refresh = """
+        DELETE FROM fiche_search WHERE rowid = NEW.id;
+        INSERT INTO fiche_search (rowid, cpid, langue, reference, description, technical, components)
+        SELECT * FROM fiche_search_source WHERE id = NEW.id;"""
+    conn.execute(f"""
+    CREATE TRIGGER trg_fiche_search_insert AFTER INSERT ON fiche_technique
+    BEGIN{refresh}
+    END""")
+    conn.execute(f"""
+    CREATE TRIGGER trg_fiche_search_update AFTER UPDATE OF {", ".join(indexed)} ON fiche_technique
+    BEGIN{refresh}
+    END""")
+    conn.execute("""
+    CREATE TRIGGER trg_fiche_search_delete AFTER DELETE ON fiche_technique
+    BEGIN
+        DELETE FROM fiche_search WHERE rowid = OLD.id;
+    END""")
+
+    conn.execute("""
+    INSERT INTO fiche_search (rowid, cpid, langue, reference, description, technical, components)
+    SELECT * FROM fiche_search_source
+    """)
+    conn.execute("INSERT INTO fiche_search (fiche_search) VALUES ('optimize')")
+
+
+# -------------------- 7: FICHE REVISIONS (page cache) --------------------
+_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def _revision_bump(select):
+    """Upsert bumping the revision of the CPID(s) produced by `select` (… FROM … WHERE …)."""
+    return f"""
+        INSERT INTO fiche_revision (cpid, revision, modified)
+        SELECT {select}
+        ON CONFLICT (cpid) DO UPDATE SET revision = revision + 1, modified = excluded.modified;"""
+
+
+def _revision_bump_cpid(ref):
+    return _revision_bump(f"{ref}, 1, {_NOW} WHERE {ref} IS NOT NULL")
+
+
+def _0007_fiche_revisions(conn):
+    # One revision per CPID, bumped by any write to its rows or their
+    # children: page_cache.py compares it with the revision a page was
+    # rendered at. Rows of deleted CPIDs stay, so their pages stay stale.
+    conn.execute("""
+    CREATE TABLE fiche_revision (
+        cpid TEXT PRIMARY KEY,
+        revision INTEGER NOT NULL,
+        modified INTEGER NOT NULL       -- unix time of the last write
+    ) WITHOUT ROWID
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER trg_fiche_revision_insert AFTER INSERT ON fiche_technique
+    BEGIN{_revision_bump_cpid("NEW.cpid")}
+    END""")
+    conn.execute(f"""
+    CREATE TRIGGER trg_fiche_revision_update AFTER UPDATE ON fiche_technique
+    BEGIN{_revision_bump_cpid("NEW.cpid")}
+    END""")
+    conn.execute(f"""
+    CREATE TRIGGER trg_fiche_revision_rename AFTER UPDATE OF cpid ON fiche_technique
+    WHEN OLD.cpid IS NOT NEW.cpid
+    BEGIN{_revision_bump_cpid("OLD.cpid")}
+    END""")
+    conn.execute(f"""
+    CREATE TRIGGER trg_fiche_revision_delete AFTER DELETE ON fiche_technique
+    BEGIN{_revision_bump_cpid("OLD.cpid")}
+    END""")
+    for table in ("fiche_component", "fiche_drawing"):
+        # Children deleted by the parent's cascade find no parent: the
+        # parent's own delete trigger has bumped the CPID already
+        for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            conn.execute(f"""
+            CREATE TRIGGER trg_{table}_revision_{event.lower()} AFTER {event} ON {table}
+            BEGIN{_revision_bump(f"cpid, 1, {_NOW} FROM fiche_technique WHERE id = {ref}.fiche_id")}
+            END""")
+
+    conn.execute(f"""
+    INSERT INTO fiche_revision (cpid, revision, modified)
+    SELECT DISTINCT cpid, 1, {_NOW} FROM fiche_technique WHERE cpid IS NOT NULL
+    """)
+
+
+# -------------------- 8: BACKGROUND JOBS --------------------
+def _0008_jobs(conn):
+    # Queue of jobs.py. Jobs with the same `key` (e.g. one SVG file) run
+    # one after the other, in id order; finished jobs are pruned after a while
+    conn.execute("""
+    CREATE TABLE job (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        key TEXT,
+        payload TEXT NOT NULL,          -- JSON
+        status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed
+        result TEXT,                    -- JSON
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        started REAL,
+        finished REAL
+    )
+    """)
+    conn.execute("CREATE INDEX idx_job_status ON job(status, id)")
+    conn.execute("CREATE INDEX idx_job_key ON job(key, id) WHERE key IS NOT NULL")
+
+
+# -------------------- 9: CPID LISTING (home page selectors) --------------------
+def _listing_add(ref):
+    return f"""
+        INSERT OR IGNORE INTO cpid_listing (type, sort_key, cpid)
+        SELECT ifnull({ref}.type, ''), lower(trim({ref}.cpid)), trim({ref}.cpid)
+        WHERE {ref}.langue = 'fr' AND {ref}.cpid IS NOT NULL;{_listing_bump(ref)}"""
+
+
+def _listing_remove(ref):
+    return f"""
+        DELETE FROM cpid_listing
+        WHERE {ref}.langue = 'fr' AND type = ifnull({ref}.type, '') AND sort_key = lower(trim({ref}.cpid))
+          AND cpid = trim({ref}.cpid);{_listing_bump(ref)}"""
+
+
+def _listing_bump(ref):
+    return f"""
+        INSERT INTO cpid_listing_version (type, version) SELECT ifnull({ref}.type, ''), 1 WHERE {ref}.langue = 'fr'
+        ON CONFLICT (type) DO UPDATE SET version = version + 1;"""
+
+
+def _0009_cpid_listing(conn):
+    # The French rows' CPIDs per type, kept in case-insensitive order by the
+    # primary key: the home page reads a type's listing, or a prefix of it,
+    # as an index range (cpid_listing.py). Each change bumps the type's version.
+    conn.execute("""
+    CREATE TABLE cpid_listing (
+        type TEXT NOT NULL,             -- '' for none
+        sort_key TEXT NOT NULL,         -- lower(trim(cpid))
+        cpid TEXT NOT NULL,             -- trim(cpid), as shown
+        PRIMARY KEY (type, sort_key, cpid)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE TABLE cpid_listing_version (
+        type TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER trg_cpid_listing_insert AFTER INSERT ON fiche_technique
+    BEGIN{_listing_add("NEW")}
+    END""")
+    conn.execute(f"""
+    CREATE TRIGGER trg_cpid_listing_update AFTER UPDATE OF cpid, type, langue ON fiche_technique
+    WHEN OLD.cpid IS NOT NEW.cpid OR OLD.type IS NOT NEW.type OR OLD.langue IS NOT NEW.langue
+    BEGIN{_listing_remove("OLD")}{_listing_add("NEW")}
+    END""")
+    conn.execute(f"""
+    CREATE TRIGGER trg_cpid_listing_delete AFTER DELETE ON fiche_technique
+    BEGIN{_listing_remove("OLD")}
+    END""")
+
+    conn.execute("""
+    INSERT OR IGNORE INTO cpid_listing (type, sort_key, cpid)
+    SELECT ifnull(type, ''), lower(trim(cpid)), trim(cpid) FROM fiche_technique WHERE langue = 'fr' AND cpid IS NOT NULL
+    """)
+    conn.execute("""
+    INSERT INTO cpid_listing_version (type, version)
+    SELECT DISTINCT ifnull(type, ''), 1 FROM fiche_technique WHERE langue = 'fr'
+    """)
+
+
+# -------------------- 10: ROW VERSIONS (database editor) --------------------
+def _0010_row_versions(conn):
+    # Optimistic concurrency for the database editor (row_edits.py): every
+    # write to a row bumps its version, whoever the writer. Writers leave
+    # the column alone; the trigger's own update does not fire it again.
+    conn.execute("ALTER TABLE fiche_technique ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    conn.execute("""
+    CREATE TRIGGER trg_fiche_version AFTER UPDATE ON fiche_technique
+    WHEN OLD.version IS NEW.version
+    BEGIN
+        UPDATE fiche_technique SET version = OLD.version + 1 WHERE id = NEW.id;
+    END""")
+
+
+# -------------------- 11: ONE REVISION PER ROW WRITE --------------------
+def _0011_revision_once_per_write(conn):
+    # trg_fiche_version's own UPDATE fired trg_fiche_revision_update a
+    # second time: every write moved the revision by two. That UPDATE is the
+    # only one changing the version, so skip it.
+    conn.execute("DROP TRIGGER trg_fiche_revision_update")
+    conn.execute(f"""
+    CREATE TRIGGER trg_fiche_revision_update AFTER UPDATE ON fiche_technique
+    WHEN OLD.version IS NEW.version
+    BEGIN{_revision_bump_cpid("NEW.cpid")}
+    END""")
+
+
+# -------------------- 12: BLOB STORE TIMES --------------------
+def _0012_blob_stored(conn):
+    # When existing content was last stored again (blobstore.put): restarts
+    # gc()'s grace period without touching the file, whose mtime versions
+    # its derivatives and URLs
+    conn.execute("ALTER TABLE blob ADD COLUMN stored INTEGER")
+
+
+MIGRATIONS = [
+    _0001_baseline,
+    _0002_dutch_type_names,
+    _0003_cpid_langue_indexes,
+    _0004_component_drawing_tables,
+    _0005_blob_refcounts,
+    _0006_fiche_search,
+    _0007_fiche_revisions,
+    _0008_jobs,
+    _0009_cpid_listing,
+    _0010_row_versions,
+    _0011_revision_once_per_write,
+    _0012_blob_stored,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=SCHEMA_VERSION):
+    """Apply every pending migration up to `target`. Returns the applied versions."""
+    applied = []
+    while True:
+        with transaction(conn):
+            # Re-read inside the write lock: another worker may have migrated
+            version = get_version(conn)
+            if version >= target:
+                break
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version={version + 1}")
+        applied.append(version + 1)
+    if applied:
+        conn.execute("ANALYZE")
+    return applied
@@ -0,0 +1,87 @@
+"""
+Rendered-HTML cache for the public fiche pages (/index?cpid=…&lang=…).
+
+A page is cached under (cpid, lang, script root, template digest) together
+with the revision of its CPID it was rendered at. Revisions live in the
+fiche_revision table and are bumped by triggers on fiche_technique,
+fiche_component and fiche_drawing (migrations._0007_fiche_revisions), so
+add_fiche, update_fiche, delete_fiche, the DB editor endpoints, the importer
+— in any worker process — invalidate exactly the CPIDs they write to.
+Serving a cached page costs one primary-key lookup.
+
+The same (key, revision) gives the ETag, and the time of the last write the
+Last-Modified header, so browsers and proxies revalidate with a 304 that
+needs no rendering at all.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def revision(conn, cpid):
+    """(revision, unix time of the last write) of `cpid`, or None if never written."""
+    row = conn.execute("SELECT revision, modified FROM fiche_revision WHERE cpid=?", (cpid,)).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def etag(key, rev):
+    """Strong ETag value (unquoted) for the page `key` at revision `rev`."""
+    return hashlib.sha1(repr((key, rev)).encode('utf-8')).hexdigest()[:24]
+
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def template_digest(path):
+    """Digest of a template file's source, re-read only when the file changes."""
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _digests_lock:
+        entry = _digests.get(path)
+        if entry and entry[0] == stamp:
+            return entry[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:12]
+    with _digests_lock:
+        _digests[path] = (stamp, digest)
+    return digest
+
+
+class PageCache:
+    """
+    In-process LRU of rendered pages. An entry is only returned for the
+    revision it was stored with; a stale one is a miss and gets overwritten
+    by the re-rendered page.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, rev):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == rev:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, rev, html):
+        with self._lock:
+            self._entries[key] = (rev, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fiche_pages = PageCache()
@@ -0,0 +1,247 @@
+"""
+Partial updates of fiche_technique rows, for the database editor.
+
+A change set ({column: value}) is checked against the table's columns —
+read once per schema, not per request — and written as one UPDATE per
+row; a batch of edits runs in one transaction, with one executemany per
+set of edited columns.
+
+batch() runs a mixed list of inserts, updates and deletes the same way:
+one transaction, executemany per kind, a result per operation.
+
+Each row carries a version (migrations._0010_row_versions), bumped by a
+trigger on every write, whatever the writer. An edit may give the version
+it was made against: if the row has changed since, the edit is refused
+(ConflictError) instead of overwriting the other change.
+"""
+import sqlite3
+import threading
+
+from db import transaction
+
+TABLE = "fiche_technique"
+# Maintained by the database, never written through the editor
+SYSTEM_COLUMNS = {"id", "version"}
+
+
+class RowError(ValueError):
+    """Invalid edit; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ConflictError(RowError):
+    """The rows in `current` changed since the versions the edits were made against."""
+
+    def __init__(self, current):
+        super().__init__("Ligne modifiée entre-temps", 409)
+        self.current = current
+
+
+class BatchError(RowError):
+    """
+    A batch was refused, nothing written. `errors` maps the index of each
+    failed operation (from 0, as in the request's list) to its RowError.
+    """
+
+    def __init__(self, errors):
+        first = errors[min(errors)]
+        super().__init__(f"Opération {min(errors)} : {first}", first.status)
+        self.errors = errors
+
+
+_columns = {}
+_columns_lock = threading.Lock()
+
+
+def editable_columns(conn):
+    """Writable columns of the table, cached until the schema changes."""
+    schema = conn.execute("PRAGMA schema_version").fetchone()[0]
+    with _columns_lock:
+        entry = _columns.get(schema)
+    if entry is None:
+        entry = frozenset(row[1] for row in conn.execute(f"PRAGMA table_info({TABLE})")) - SYSTEM_COLUMNS
+        with _columns_lock:
+            _columns.clear()
+            _columns[schema] = entry
+    return entry
+
+
+def changes_of(conn, data):
+    """The change set of a request body: every column but the system ones."""
+    if not isinstance(data, dict):
+        raise RowError("Corps JSON attendu")
+    changes = {k: v for k, v in data.items() if k not in SYSTEM_COLUMNS}
+    unknown = set(changes) - editable_columns(conn)
+    if unknown:
+        raise RowError(f"Colonnes inconnues : {', '.join(sorted(unknown))}")
+    return changes
+
+
+def _rows(conn, row_ids):
+    placeholders = ", ".join("?" * len(row_ids))
+    return {row["id"]: dict(row) for row in conn.execute(
+        f"SELECT * FROM {TABLE} WHERE id IN ({placeholders})", list(row_ids))}
+
+
+def _versions(conn, row_ids):
+    placeholders = ", ".join("?" * len(row_ids))
+    return dict(conn.execute(f"SELECT id, version FROM {TABLE} WHERE id IN ({placeholders})", list(row_ids)))
+
+
+def _write_updates(conn, edits):
+    """(row_id, changes) pairs: one executemany per set of edited columns."""
+    groups = {}
+    for row_id, changes in edits:
+        if changes:
+            columns = tuple(sorted(changes))
+            groups.setdefault(columns, []).append([changes[c] for c in columns] + [row_id])
+    for columns, params in groups.items():
+        assignments = ", ".join(f"[{c}] = ?" for c in columns)
+        conn.executemany(f"UPDATE {TABLE} SET {assignments} WHERE id = ?", params)
+
+
+def _write_inserts(conn, inserts, results):
+    """
+    (index, row) pairs: one executemany per set of columns, each new id
+    stored in results[index]["id"]. The table is AUTOINCREMENT and the write
+    lock is held, so the rows of an executemany get the ids that follow the
+    table's sequence, in order (executemany leaves lastrowid unset).
+    """
+    groups = {}
+    for i, row in inserts:
+        groups.setdefault(tuple(sorted(row)), []).append((i, row))
+    for columns, rows in groups.items():
+        conn.executemany(
+            f"INSERT INTO {TABLE} ({', '.join(f'[{c}]' for c in columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [[row[c] for c in columns] for _, row in rows])
+        last = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (TABLE,)).fetchone()[0]
+        for n, (i, _) in enumerate(rows):
+            results[i]["id"] = last - len(rows) + 1 + n
+
+
+def update_rows(conn, edits):
+    """
+    Apply `edits` — (row_id, changes, expected_version or None) — all or
+    none. Returns {row_id: new version}. Raises RowError (404) for a
+    missing row and ConflictError for rows whose version moved on.
+    """
+    edits = list(edits)
+    if not edits:
+        return {}
+    row_ids = [row_id for row_id, _, _ in edits]
+    if len(set(row_ids)) != len(row_ids):
+        raise RowError("Ligne présente plusieurs fois")
+
+    with transaction(conn):
+        # The write lock is held from here: versions cannot move under us
+        versions = _versions(conn, row_ids)
+        missing = [row_id for row_id in row_ids if row_id not in versions]
+        if missing:
+            raise RowError(f"Ligne introuvable : {missing[0]}", 404)
+        stale = [row_id for row_id, _, expected in edits
+                 if expected is not None and expected != versions[row_id]]
+        if stale:
+            raise ConflictError(_rows(conn, stale))
+        try:
+            _write_updates(conn, [(row_id, changes) for row_id, changes, _ in edits])
+        except sqlite3.IntegrityError as e:
+            raise RowError(str(e), 409)
+        return _versions(conn, row_ids)
+
+
+def update_row(conn, row_id, changes, expected_version=None):
+    """Apply one change set in a single UPDATE. Returns the row's new version."""
+    return update_rows(conn, [(row_id, changes, expected_version)])[row_id]
+
+
+def _version_of(op):
+    expected = op.get("version")
+    if expected is not None and (not isinstance(expected, int) or isinstance(expected, bool)):
+        raise RowError("Version invalide")
+    return expected
+
+
+def _parse(conn, op):
+    """(kind, row_id, changes, expected version) of one batch operation."""
+    if not isinstance(op, dict):
+        raise RowError("Opération invalide")
+    kind = op.get("op")
+    if kind == "insert":
+        changes = changes_of(conn, op.get("row"))
+        if not changes:
+            raise RowError("Ligne vide")
+        return kind, None, changes, None
+    if kind not in ("update", "delete"):
+        raise RowError(f"Opération inconnue : {kind}")
+    row_id = op.get("id")
+    if not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise RowError("Identifiant de ligne manquant")
+    changes = changes_of(conn, op.get("changes")) if kind == "update" else None
+    return kind, row_id, changes, _version_of(op)
+
+
+def batch(conn, ops):
+    """
+    Run a list of operations in one transaction, all or none:
+
+        {"op": "insert", "row": {column: value, ...}}
+        {"op": "update", "id": n, "changes": {column: value, ...}, "version": v}
+        {"op": "delete", "id": n, "version": v}
+
+    ("version" optional, as in update_rows). Deletes run first, then
+    updates, then inserts, so a batch can replace rows under the same
+    CPID. Returns one result per operation, in order: {"id": new id} for an
+    insert, {"version": new version} for an update, {} for a delete.
+    Raises BatchError, with the failed operations, if any cannot be done;
+    a write refused by the database (e.g. a duplicate (cpid, langue)) fails
+    the batch as a whole with RowError (409): executemany does not tell which
+    row it was.
+    """
+    errors = {}
+    parsed = []
+    for i, op in enumerate(ops):
+        try:
+            parsed.append(_parse(conn, op))
+        except RowError as e:
+            errors[i] = e
+            parsed.append(None)
+    if errors:
+        raise BatchError(errors)
+    results = [{} for _ in parsed]
+    targets = [(i, p) for i, p in enumerate(parsed) if p[0] != "insert"]
+
+    with transaction(conn):
+        versions = _versions(conn, [p[1] for _, p in targets]) if targets else {}
+        seen = set()
+        for i, (kind, row_id, _, expected) in targets:
+            if row_id in seen:
+                errors[i] = RowError("Ligne présente plusieurs fois")
+            elif row_id not in versions:
+                errors[i] = RowError(f"Ligne introuvable : {row_id}", 404)
+            elif expected is not None and expected != versions[row_id]:
+                errors[i] = ConflictError(_rows(conn, [row_id]))
+            seen.add(row_id)
+        if errors:
+            raise BatchError(errors)
+
+        conn.executemany(f"DELETE FROM {TABLE} WHERE id = ?",
+                         [(p[1],) for _, p in targets if p[0] == "delete"])
+        updates = [p for _, p in targets if p[0] == "update"]
+        try:
+            _write_updates(conn, [(row_id, changes) for _, row_id, changes, _ in updates])
+        except sqlite3.IntegrityError as e:
+            # executemany does not tell which row: the batch as a whole fails
+            raise RowError(str(e), 409)
+        try:
+            _write_inserts(conn, [(i, p[2]) for i, p in enumerate(parsed) if p[0] == "insert"], results)
+        except sqlite3.IntegrityError as e:
+            raise RowError(str(e), 409)
+        if updates:
+            versions = _versions(conn, [row_id for _, row_id, _, _ in updates])
+            for i, (kind, row_id, _, _) in targets:
+                if kind == "update":
+                    results[i]["version"] = versions[row_id]
+    return results
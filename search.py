@@ -0,0 +1,125 @@
+"""
+Full-text search over the fiches, all three languages at once.
+
+The FTS5 index fiche_search (migrations._0006_fiche_search) holds one row
+per fiche_technique row. Triggers on fiche_technique keep it in sync with
+every writer; code replacing a fiche's components calls reindex() after.
+Queries here are free text: every word must match, the last one as a
+prefix ("clois" finds "cloison"), accents are ignored, and results are one
+per CPID, best bm25 rank first.
+"""
+import re
+
+# bm25() weights, in fiche_search column order:
+# cpid, langue (unindexed), reference, description, technical, components
+WEIGHTS = (10.0, 0.0, 5.0, 1.0, 2.0, 1.0)
+_BM25 = f"bm25({', '.join(map(str, WEIGHTS))})"
+MAX_LIMIT = 100
+_CHUNK = 500
+
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+_NUMBER = re.compile(r"^\d+$")
+_UNIT = re.compile(r"^[^\W\d_]{1,3}$", re.UNICODE)
+
+
+def reindex(conn, fiche_ids):
+    """Rebuild the index rows of `fiche_ids` (after their components changed)."""
+    fiche_ids = list(fiche_ids)
+    for i in range(0, len(fiche_ids), _CHUNK):
+        chunk = fiche_ids[i:i + _CHUNK]
+        placeholders = ", ".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM fiche_search WHERE rowid IN ({placeholders})", chunk)
+        conn.execute(f"""
+            INSERT INTO fiche_search (rowid, cpid, langue, reference, description, technical, components)
+            SELECT * FROM fiche_search_source WHERE id IN ({placeholders})
+        """, chunk)
+
+
+def _term(word, prefix):
+    # There is no 1-letter prefix index: a lone letter is a whole word
+    return f'"{word}"*' if prefix and len(word) > 1 else f'"{word}"'
+
+
+def match_expression(text):
+    """
+    FTS5 MATCH expression for free text, or None if it has no words.
+    Every word must match; the last one may be incomplete (a prefix), as
+    it is while typing. Punctuation is dropped, so the input can never be
+    FTS5 syntax. A number next to a short word ("44 dB", "EI 60") also
+    matches the two written together ("44dB", "EI60"), the way the data
+    usually has them.
+    """
+    words = [w.lower() for w in _WORD.findall(text or "")]
+    parts = []
+    i = 0
+    while i < len(words):
+        word = words[i]
+        following = words[i + 1] if i + 1 < len(words) else None
+        if following and ((_NUMBER.match(word) and _UNIT.match(following))
+                          or (_UNIT.match(word) and _NUMBER.match(following))):
+            last = i + 2 == len(words)
+            parts.append(f"({_term(word + following, last)} OR "
+                         f"({_term(word, False)} AND {_term(following, last)}))")
+            i += 2
+            continue
+        parts.append(_term(word, i + 1 == len(words)))
+        i += 1
+    return " AND ".join(parts) or None
+
+
+def search(conn, text, langue="fr", limit=20):
+    """
+    Best matching fiches for `text`, one per CPID. Each result is shown in
+    `langue` when the CPID has it, else in the language that matched:
+    {cpid, langue, reference, reference_menu, type, variant, matched_langue, score}.
+    Raises ValueError if `limit` is not a number; it is clamped to 1..MAX_LIMIT.
+    """
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    # FTS5 ranks inside the index (ORDER BY rank LIMIT keeps only the best
+    # rows, whatever the number of matches). A CPID has at most three rows
+    # (fr, en, nl): 3 * limit rows always hold `limit` distinct CPIDs, each
+    # first seen at its best position
+    matches = conn.execute("""
+        SELECT rowid, cpid, langue, rank FROM fiche_search
+        WHERE fiche_search MATCH ? AND rank MATCH ?
+        ORDER BY rank LIMIT ?
+    """, (expression, _BM25, limit * 3)).fetchall()
+    hits = {}
+    for fiche_id, cpid, matched_langue, score in matches:
+        if cpid not in hits:
+            hits[cpid] = (cpid, fiche_id, matched_langue, score)
+    hits = list(hits.values())[:limit]
+    if not hits:
+        return []
+
+    cpids = [h[0] for h in hits]
+    ids = [h[1] for h in hits]
+    rows = {}
+    for row in conn.execute(f"""
+        SELECT id, cpid, langue, reference, reference_menu, type, variant
+        FROM fiche_technique
+        WHERE id IN ({", ".join("?" * len(ids))})
+           OR (langue = ? AND cpid IN ({", ".join("?" * len(cpids))}))
+    """, ids + [langue] + cpids):
+        rows[row["id"]] = row
+    localized = {row["cpid"]: row for row in rows.values() if row["langue"] == langue}
+
+    results = []
+    for cpid, fiche_id, matched_langue, score in hits:
+        row = localized.get(cpid) or rows.get(fiche_id)
+        if row is None:
+            continue
+        results.append({
+            "cpid": cpid,
+            "langue": row["langue"],
+            "reference": row["reference"],
+            "reference_menu": row["reference_menu"],
+            "type": row["type"],
+            "variant": row["variant"],
+            "matched_langue": matched_langue,
+            "score": round(score, 4),
+        })
+    return results
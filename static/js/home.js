@@ -30,6 +30,8 @@ const getBasePath = () => {
 window.addEventListener('DOMContentLoaded', function () {
     const base = getBasePath();
 
+    _watchPendingJobs(base);
+
     // ── Éditer button ──
     const btnEdit = document.getElementById('btnEditImage');
     if (btnEdit) {
@@ -99,12 +101,15 @@ window.addEventListener('DOMContentLoaded', function () {
             });
             _resetEditorState();
 
-            fetch(`${base}/get_fiche/${ref}`)
+            fetch(`${base}/get_fiche/${encodeURIComponent(ref)}?format=compact`)
                 .then(r => r.json())
                 .then(data => {
                     if (loadingOverlay) loadingOverlay.classList.remove('active');
                     if (data.error) { alert('Erreur: ' + data.error); return; }
-                    const fr = data.fr || {}, en = data.en || {}, nl = data.nl || {};
+                    // Compact format: nulls are left out, so empty every field first
+                    _clearFields();
+                    const fr = _compactLanguage(data, 'fr'), en = _compactLanguage(data, 'en'), nl = _compactLanguage(data, 'nl');
+                    _ensureComponentRows(Math.max(0, ...[fr, en, nl].map(_maxComponentPosition)));
                     for (const [k, v] of Object.entries(fr)) {
                         if (k === 'id' || k === 'langue' || k === 'type') continue;
                         const input = document.querySelector(`[name="${k}"]`);
@@ -147,6 +152,7 @@ window.addEventListener('DOMContentLoaded', function () {
     const urlParams = new URLSearchParams(window.location.search);
     const cpidFromUrl = urlParams.get('cpid');
     if (cpidFromUrl && updateRefSelect) {
+        _ensureOption(updateRefSelect, cpidFromUrl);
         updateRefSelect.value = cpidFromUrl;
         const selectedValueEl = document.getElementById('selectedValue');
         if (selectedValueEl) selectedValueEl.textContent = cpidFromUrl;
@@ -166,6 +172,59 @@ window.addEventListener('DOMContentLoaded', function () {
     });
 });
 
+// ============================================
+// Components / drawings (fiche_component, fiche_drawing)
+//
+// get_fiche?format=compact gives them with the flat
+// vue_eclatee_N / dessin_technique_N / dessin_technique_nom_N names
+// the form uses, and every value the languages share only once.
+// ============================================
+function _compactLanguage(data, lang) {
+    // The language's own values over the shared ones
+    return Object.assign({}, data.shared, data[lang] || {});
+}
+
+function _maxComponentPosition(row) {
+    return Math.max(0, ...Object.keys(row)
+        .map(k => /^vue_eclatee_(\d+)$/.exec(k))
+        .filter(m => m)
+        .map(m => parseInt(m[1], 10)));
+}
+
+function _componentCount() {
+    return document.querySelectorAll('#componentRows input[name^="vue_eclatee_"]').length;
+}
+
+// Add component inputs (and their hidden EN/NL fields) until there are n
+function _ensureComponentRows(n) {
+    while (_componentCount() < n) addComponentRow();
+}
+
+function addComponentRow() {
+    const container = document.getElementById('componentRows');
+    const form = document.getElementById('mainForm');
+    if (!container || !form) return;
+    const pos = _componentCount() + 1;
+    const row = document.createElement('div');
+    row.className = 'row mb-2';
+    row.innerHTML = `
+        <div class="col">
+          <div class="input-group">
+            <span class="input-group-text">${pos}</span>
+            <input type="text" class="form-control" name="vue_eclatee_${pos}" placeholder="Composant ${pos}">
+            <button type="button" class="btn btn-outline-primary o_field_translate" data-field="vue_eclatee_${pos}">🌐 Traduire</button>
+          </div>
+        </div>
+        <div class="col"></div>`;
+    container.appendChild(row);
+    ['en', 'nl'].forEach(lang => {
+        const hidden = document.createElement('input');
+        hidden.type = 'hidden';
+        hidden.name = hidden.id = `vue_eclatee_${pos}_${lang}`;
+        form.appendChild(hidden);
+    });
+}
+
 // ============================================
 // Reset all editor state
 // ============================================
@@ -191,7 +250,15 @@ function _setImagePreview(previewId, imagePath) {
     const img = document.getElementById(previewId);
     if (!img) return;
     if (imagePath) {
-        img.src = '/static/' + imagePath + '?t=' + Date.now();
+        const url = '/static/' + imagePath + '?t=' + Date.now();
+        if (imagePath.toLowerCase().endsWith('.svg')) {
+            // An SVG inside <img> cannot load its sidecar source image — inline it first
+            _inlineSvgSourceImage(url)
+                .then(svgUrl => _showObjectUrl(img, svgUrl))
+                .catch(() => { img.src = url; });
+        } else {
+            img.src = url;
+        }
         img.classList.remove('d-none', 'deleted');
         img.style.border = ''; img.style.opacity = '1';
     } else {
@@ -201,6 +268,72 @@ function _setImagePreview(previewId, imagePath) {
     }
 }
 
+// ============================================
+// Sidecar source images
+//
+// Exploded-view SVGs reference their source image as a separate file
+// (uploads/blobs/<sha256>.<ext>) instead of embedding it as base64.
+// Older SVGs may still embed it — both helpers accept either form.
+// ============================================
+
+function _blobToDataUrl(blob) {
+    return new Promise((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onload  = e => resolve(e.target.result);
+        reader.onerror = () => reject(new Error("Impossible de lire l'image source"));
+        reader.readAsDataURL(blob);
+    });
+}
+
+// Resolve the source-image href of an SVG document to a dataURL (or null)
+function _sourceImageDataUrl(svgDoc, svgUrl) {
+    const imgEl = svgDoc.getElementById('source-image');
+    if (!imgEl) return Promise.resolve(null);
+    const href = imgEl.getAttribute('href') ||
+                 imgEl.getAttributeNS('http://www.w3.org/1999/xlink', 'href');
+    if (!href) return Promise.resolve(null);
+    if (href.startsWith('data:')) return Promise.resolve(href);
+    return fetch(new URL(href, new URL(svgUrl, window.location.href)))
+        .then(r => {
+            if (!r.ok) throw new Error("Image source introuvable");
+            return r.blob();
+        })
+        .then(_blobToDataUrl);
+}
+
+// Object URL of an SVG with its source image inlined, for use in <img>
+// (see _showObjectUrl, which revokes it)
+function _inlineSvgSourceImage(svgUrl) {
+    return fetch(svgUrl)
+        .then(r => r.text())
+        .then(svgText => {
+            const svgDoc = new DOMParser().parseFromString(svgText, 'image/svg+xml');
+            return _sourceImageDataUrl(svgDoc, svgUrl).then(dataUrl => {
+                const imgEl = svgDoc.getElementById('source-image');
+                if (dataUrl && imgEl) {
+                    imgEl.setAttributeNS('http://www.w3.org/1999/xlink', 'xlink:href', dataUrl);
+                    imgEl.removeAttribute('href');
+                }
+                const text = new XMLSerializer().serializeToString(svgDoc);
+                return URL.createObjectURL(new Blob([text], { type: 'image/svg+xml' }));
+            });
+        });
+}
+
+// Show an object URL in <img> and revoke it once loaded (or failed): the
+// decoded image stays on screen. A URL still loading when the next one is
+// shown is revoked then.
+function _showObjectUrl(img, objectUrl) {
+    if (img._objectUrl) URL.revokeObjectURL(img._objectUrl);
+    img._objectUrl = objectUrl;
+    img.onload = img.onerror = () => {
+        img.onload = img.onerror = null;
+        URL.revokeObjectURL(objectUrl);
+        img._objectUrl = null;
+    };
+    img.src = objectUrl;
+}
+
 // ============================================
 // Get current CPID — FIXED
 //
@@ -281,33 +414,32 @@ function _openEditorFromSVG(svgPath, base) {
                 ? Math.max(...editorAnnotations.map(a => a.id)) + 1 : 1;
             editorDirty = false;
 
-            // Step 2: fetch SVG content to extract the embedded source image
-            return fetch(`/static/uploads/${editorFilename}?t=${Date.now()}`)
+            // Step 2: fetch SVG content to extract the source image
+            // (sidecar file or, for older SVGs, an embedded data URI)
+            const svgUrl = `/static/uploads/${editorFilename}?t=${Date.now()}`;
+            return fetch(svgUrl)
                 .then(r => r.text())
                 .then(svgText => {
-                    if (loadingOverlay) loadingOverlay.classList.remove('active');
-
                     const parser = new DOMParser();
                     const svgDoc = parser.parseFromString(svgText, 'image/svg+xml');
-                    const imgEl  = svgDoc.getElementById('source-image');
-                    let imgHref  = null;
-                    if (imgEl) {
-                        imgHref = imgEl.getAttribute('href') ||
-                                  imgEl.getAttributeNS('http://www.w3.org/1999/xlink', 'href');
-                    }
-
-                    // Store the raw image dataURL so _flushAnnotationsToServer can
-                    // build a new SVG for a different CPID if needed at submit time.
-                    if (imgHref && imgHref.startsWith('data:')) {
-                        pendingImageDataUrl = imgHref;
-                    }
-
-                    // Open the editor — image is the extracted dataURL or the raw SVG
-                    const imageSrc = imgHref || (() => {
-                        const blob = new Blob([svgText], { type: 'image/svg+xml' });
-                        return URL.createObjectURL(blob);
-                    })();
-                    openEditorModal(imageSrc, existingAnnotations, null);
+                    return _sourceImageDataUrl(svgDoc, svgUrl).then(dataUrl => {
+                        if (loadingOverlay) loadingOverlay.classList.remove('active');
+
+                        // Store the raw image dataURL so _flushAnnotationsToServer can
+                        // build a new SVG for a different CPID if needed at submit time.
+                        if (dataUrl) {
+                            pendingImageDataUrl = dataUrl;
+                        }
+
+                        // Open the editor — image is the source dataURL or the raw SVG
+                        // (an object URL, revoked once the editor image has loaded)
+                        if (dataUrl) {
+                            openEditorModal(dataUrl, existingAnnotations, null);
+                        } else {
+                            const objectUrl = URL.createObjectURL(new Blob([svgText], { type: 'image/svg+xml' }));
+                            openEditorModal(objectUrl, existingAnnotations, () => URL.revokeObjectURL(objectUrl));
+                        }
+                    });
                 });
         })
         .catch(err => {
@@ -316,6 +448,132 @@ function _openEditorFromSVG(svgPath, base) {
         });
 }
 
+// ============================================
+// CPID selector
+//
+// With data-remote set on the list, only the CPIDs matching the search box
+// are fetched (/api/cpids?q=…) and shown; the hidden <select> gets an
+// <option> for the one picked.
+// ============================================
+function _ensureOption(select, value) {
+    if (value && !Array.from(select.options).some(o => o.value === value)) {
+        select.add(new Option(value, value));
+    }
+}
+
+let _lookupSeq = 0;
+function _lookupCpids(base, list, text) {
+    const seq = ++_lookupSeq;
+    const params = new URLSearchParams({ type: list.dataset.type, q: text.trim(), limit: 50 });
+    fetch(`${base}/api/cpids?${params}`)
+        .then(r => r.json())
+        .then(data => {
+            if (seq !== _lookupSeq) return;  // an answer to an older keystroke
+            const placeholder = list.querySelector('.dropdown-item-custom[data-value=""]');
+            list.querySelectorAll('.dropdown-item-custom:not([data-value=""])').forEach(i => i.remove());
+            (data.cpids || []).forEach(cpid => {
+                const item = placeholder.cloneNode(true);
+                item.classList.remove('selected');
+                item.dataset.value = cpid;
+                item.querySelector('span').textContent = cpid;
+                list.appendChild(item);
+            });
+        })
+        .catch(() => {});
+}
+
+// ============================================
+// Background jobs (SVG creation, image derivatives)
+//
+// Resolves with the jobs once none is queued or running any more.
+// ============================================
+function _waitForJobs(base, ids, attempt = 0) {
+    if (!ids.length) return Promise.resolve([]);
+    return fetch(`${base}/api/jobs?ids=${ids.join(',')}`)
+        .then(r => r.json())
+        .then(data => {
+            const jobs = data.jobs || [];
+            const busy = jobs.some(j => j.status === 'queued' || j.status === 'running');
+            if (!busy || attempt >= 120) return jobs;
+            return new Promise(resolve => setTimeout(resolve, 1000))
+                .then(() => _waitForJobs(base, ids, attempt + 1));
+        });
+}
+
+// Jobs queued by the last add/update: report when the images are ready
+function _watchPendingJobs(base) {
+    const box = document.getElementById('pendingJobs');
+    if (!box) return;
+    const ids = box.dataset.jobs.split(',').filter(Boolean);
+    const alertBox = box.querySelector('.alert');
+    _waitForJobs(base, ids)
+        .then(jobs => {
+            const failed = jobs.filter(j => j.status === 'failed');
+            if (failed.length) {
+                alertBox.className = 'alert alert-danger';
+                alertBox.textContent = 'Erreur lors du traitement des images : ' +
+                    failed.map(j => j.error).join(' ; ');
+            } else {
+                alertBox.className = 'alert alert-success';
+                alertBox.textContent = 'Images traitées.';
+                setTimeout(() => box.remove(), 3000);
+            }
+        })
+        .catch(() => box.remove());
+}
+
+// ============================================
+// Exploded-view image upload
+//
+// The image goes up in chunks (/api/uploads, resumable: a failed chunk is
+// retried from what the server has), then the SVG is created from it.
+// ============================================
+function _uploadInChunks(base, file) {
+    const send = (upload, retries) => {
+        if (upload.received >= upload.size) return Promise.resolve(upload);
+        const end = Math.min(upload.received + upload.chunk_size, upload.size);
+        return fetch(`${base}/api/uploads/${upload.id}`, {
+            method: 'PUT',
+            headers: { 'Content-Range': `bytes ${upload.received}-${end - 1}/${upload.size}` },
+            body: file.slice(upload.received, end)
+        })
+            .then(r => r.json().then(data => {
+                if (!r.ok && r.status !== 409) throw new Error(data.error || r.statusText);
+                // 409: the server has a different offset — carry on from there
+                return r.ok ? data : Object.assign({}, upload, { received: data.received });
+            }))
+            .then(next => [next, 3], err => {
+                if (retries <= 0) throw err;
+                return new Promise(resolve => setTimeout(resolve, 1000))
+                    .then(() => fetch(`${base}/api/uploads/${upload.id}`))
+                    .then(r => r.json().then(current => {
+                        if (!r.ok) throw new Error(current.error || r.statusText);
+                        return [current, retries - 1];
+                    }));
+            })
+            .then(([next, left]) => send(next, left));
+    };
+    return fetch(`${base}/api/uploads`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    })
+        .then(r => r.json().then(data => {
+            if (!r.ok) throw new Error(data.error || r.statusText);
+            return send(data, 3);
+        }));
+}
+
+function _createExplodedView(base, file, cpid) {
+    return _uploadInChunks(base, file).then(upload => {
+        const formData = new FormData();
+        formData.append("upload_id", upload.id);
+        formData.append("annotations", JSON.stringify(editorAnnotations));
+        formData.append("cpid", cpid);
+        return fetch(`${base}/create_exploded_view_with_annotations`, { method: 'POST', body: formData });
+    });
+}
+
 // ============================================
 // Flush annotations to server just before form submit.
 //
@@ -354,24 +612,28 @@ function _flushAnnotationsToServer(base, submitAction, callback) {
 
     // ── Case A: brand-new image file (user picked a file, never uploaded) ──
     if (pendingImageFile) {
-        const formData = new FormData();
-        formData.append("vue_eclatee_image", pendingImageFile);
-        formData.append("annotations", JSON.stringify(editorAnnotations));
-        formData.append("cpid", cpid);
-
-        fetch(`${base}/create_exploded_view_with_annotations`, { method: 'POST', body: formData })
+        _createExplodedView(base, pendingImageFile, cpid)
             .then(r => r.json())
             .then(data => {
-                if (loadingOverlay) loadingOverlay.classList.remove('active');
                 if (data.success && data.filename) {
-                    editorFilename      = data.filename;
-                    editorDirty         = false;
-                    pendingImageFile    = null;
-                    pendingImageDataUrl = null;
-                    const inp = document.getElementById('vue_eclatee_already_saved');
-                    if (inp) inp.value = editorFilename;
-                    callback();
+                    // The SVG is written by a background job: submit once it exists
+                    return _waitForJobs(base, data.job ? [data.job] : []).then(done => {
+                        if (loadingOverlay) loadingOverlay.classList.remove('active');
+                        const failed = done.find(j => j.status === 'failed');
+                        if (failed) {
+                            alert('Erreur lors de la création du SVG: ' + failed.error);
+                            return;
+                        }
+                        editorFilename      = data.filename;
+                        editorDirty         = false;
+                        pendingImageFile    = null;
+                        pendingImageDataUrl = null;
+                        const inp = document.getElementById('vue_eclatee_already_saved');
+                        if (inp) inp.value = editorFilename;
+                        callback();
+                    });
                 } else {
+                    if (loadingOverlay) loadingOverlay.classList.remove('active');
                     alert('Erreur lors de la création du SVG: ' + (data.error || 'Unknown'));
                 }
             })
@@ -437,24 +699,28 @@ function _flushAnnotationsToServer(base, submitAction, callback) {
             { type: mime }
         );
 
-        const formData = new FormData();
-        formData.append("vue_eclatee_image", imageFile);
-        formData.append("annotations", JSON.stringify(editorAnnotations));
-        formData.append("cpid", cpid);
-
-        fetch(`${base}/create_exploded_view_with_annotations`, { method: 'POST', body: formData })
+        _createExplodedView(base, imageFile, cpid)
             .then(r => r.json())
             .then(data => {
-                if (loadingOverlay) loadingOverlay.classList.remove('active');
                 if (data.success && data.filename) {
-                    editorFilename      = data.filename;
-                    editorDirty         = false;
-                    pendingImageFile    = null;
-                    pendingImageDataUrl = null;
-                    const inp = document.getElementById('vue_eclatee_already_saved');
-                    if (inp) inp.value = editorFilename;
-                    callback();
+                    // The SVG is written by a background job: submit once it exists
+                    return _waitForJobs(base, data.job ? [data.job] : []).then(done => {
+                        if (loadingOverlay) loadingOverlay.classList.remove('active');
+                        const failed = done.find(j => j.status === 'failed');
+                        if (failed) {
+                            alert('Erreur lors de la création du SVG: ' + failed.error);
+                            return;
+                        }
+                        editorFilename      = data.filename;
+                        editorDirty         = false;
+                        pendingImageFile    = null;
+                        pendingImageDataUrl = null;
+                        const inp = document.getElementById('vue_eclatee_already_saved');
+                        if (inp) inp.value = editorFilename;
+                        callback();
+                    });
                 } else {
+                    if (loadingOverlay) loadingOverlay.classList.remove('active');
                     alert('Erreur lors de la création du SVG: ' + (data.error || 'Unknown'));
                 }
             })
@@ -468,10 +734,14 @@ function _flushAnnotationsToServer(base, submitAction, callback) {
 // ============================================
 // Form helpers
 // ============================================
-function clearForm() {
+function _clearFields() {
     document.querySelectorAll('input[type="text"], input[type="hidden"][name$="_nl"], input[type="hidden"][name$="_en"], textarea').forEach(input => {
         if (input.id !== 'updateRef' && input.name !== 'type') input.value = '';
     });
+}
+
+function clearForm() {
+    _clearFields();
     document.querySelectorAll('.preview').forEach(img => {
         img.src = ''; img.classList.add('d-none'); img.classList.remove('deleted');
         img.style.border = ''; img.style.opacity = '1';
@@ -792,20 +1062,21 @@ document.addEventListener('DOMContentLoaded', function () {
     const inputNL      = document.getElementById('trans_nl');
     let currentField=null, currentInput=null, currentInputEN=null, currentInputNL=null;
 
-    document.querySelectorAll('.o_field_translate').forEach(btn => {
-        btn.addEventListener('click', function (e) {
-            e.preventDefault(); e.stopPropagation();
-            currentField   = this.dataset.field;
-            currentInput   = document.querySelector(`[name="${currentField}"]`) || document.getElementById(currentField);
-            currentInputEN = document.getElementById(currentField + '_en');
-            currentInputNL = document.getElementById(currentField + '_nl');
-            if (!currentInput) return;
-            modalTitle.textContent = `Modifier : ${currentField}`;
-            inputFR.value = currentInput.value || '';
-            inputEN.value = currentInputEN ? (currentInputEN.value || '') : '';
-            inputNL.value = currentInputNL ? (currentInputNL.value || '') : '';
-            modalOverlay.classList.add('active');
-        });
+    // Delegated, so component rows added later get a working button too
+    document.addEventListener('click', function (e) {
+        const btn = e.target.closest('.o_field_translate');
+        if (!btn) return;
+        e.preventDefault(); e.stopPropagation();
+        currentField   = btn.dataset.field;
+        currentInput   = document.querySelector(`[name="${currentField}"]`) || document.getElementById(currentField);
+        currentInputEN = document.getElementById(currentField + '_en');
+        currentInputNL = document.getElementById(currentField + '_nl');
+        if (!currentInput) return;
+        modalTitle.textContent = `Modifier : ${currentField}`;
+        inputFR.value = currentInput.value || '';
+        inputEN.value = currentInputEN ? (currentInputEN.value || '') : '';
+        inputNL.value = currentInputNL ? (currentInputNL.value || '') : '';
+        modalOverlay.classList.add('active');
     });
 
     if (saveBtn) saveBtn.addEventListener('click', function () {
@@ -854,6 +1125,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 item.classList.add('selected');
                 if (selectedValue) selectedValue.textContent = item.querySelector('span').textContent;
                 if (hiddenSelect) {
+                    _ensureOption(hiddenSelect, item.dataset.value);
                     hiddenSelect.value = item.dataset.value;
                     if (item.dataset.value) { hiddenSelect.dispatchEvent(new Event('change')); }
                     else { clearForm(); }
@@ -865,7 +1137,18 @@ document.addEventListener('DOMContentLoaded', function () {
             }
         });
     }
-    if (searchInput) {
+    if (searchInput && dropdownList && dropdownList.dataset.remote) {
+        // Too many CPIDs to ship with the page: look them up as the user types
+        let lookupTimer = null;
+        const lookup = () => _lookupCpids(base, dropdownList, searchInput.value);
+        searchInput.addEventListener('input', () => {
+            clearTimeout(lookupTimer);
+            lookupTimer = setTimeout(lookup, 150);
+        });
+        if (dropdownHeader) dropdownHeader.addEventListener('click', () => {
+            if (dropdownMenu.classList.contains('active')) lookup();
+        });
+    } else if (searchInput) {
         searchInput.addEventListener('input', (e) => {
             const term = e.target.value.toLowerCase();
             document.querySelectorAll('.dropdown-item-custom').forEach(item => {
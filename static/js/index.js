@@ -10,10 +10,49 @@ const getBasePath = () => {
 // ============================================
 // PDF DOWNLOAD
 // ============================================
+// The server renders the PDF (/pdf); while a render is in progress it
+// answers 202 and we poll. Without a server renderer (501) or on any
+// error, fall back to the browser's print dialog.
+const fetchPdf = (url, attempt) => {
+    return fetch(url).then(res => {
+        if (res.status === 202) {
+            if (attempt >= 60) throw new Error('PDF not ready');
+            const wait = (parseInt(res.headers.get('Retry-After'), 10) || 1) * 1000;
+            return new Promise(resolve => setTimeout(resolve, wait))
+                .then(() => fetchPdf(url, attempt + 1));
+        }
+        if (!res.ok) throw new Error(`PDF ${res.status}`);
+        return res.blob();
+    });
+};
+
 const downloadBtn = document.getElementById("downloadBtn");
 if (downloadBtn) {
     downloadBtn.addEventListener("click", function() {
-        window.print();
+        const params = new URLSearchParams(window.location.search);
+        const cpid = params.get('cpid');
+        const lang = params.get('lang') || 'fr';
+        if (!cpid) {
+            window.print();
+            return;
+        }
+
+        const btn = this;
+        btn.disabled = true;
+        const url = `${getBasePath()}/pdf?cpid=${encodeURIComponent(cpid)}&lang=${encodeURIComponent(lang)}`;
+        fetchPdf(url, 0)
+            .then(blob => {
+                const href = window.URL.createObjectURL(blob);
+                const a = document.createElement('a');
+                a.href = href;
+                a.download = `${cpid}_${lang}.pdf`;
+                document.body.appendChild(a);
+                a.click();
+                document.body.removeChild(a);
+                window.URL.revokeObjectURL(href);
+            })
+            .catch(() => window.print())
+            .finally(() => { btn.disabled = false; });
     });
 }
 
@@ -0,0 +1,506 @@
+"""
+Storage of the exploded-view ("vue éclatée") SVG files.
+
+Each CPID owns one SVG in the upload folder: <cpid>.svg. It holds the source
+image (<image id="source-image">) and the annotation layer
+(<g id="annotations">) written by the editor.
+
+Two storage modes for the source image:
+  - "sidecar"  (default): the raw image is stored once under
+               blobs/<sha256>.<ext>, named after its content, and the SVG only
+               references it (href="blobs/<sha256>.<ext>"). The SVG stays a
+               few KB, so annotation reads/writes never touch the image.
+  - "embedded": the image is base64-encoded into the SVG as a data: URI
+               (the original layout — one self-contained file).
+"""
+import base64
+import glob
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from xml.sax.saxutils import quoteattr, unescape
+
+import blobstore
+import instrumentation
+
+STORAGE_SIDECAR = "sidecar"
+STORAGE_EMBEDDED = "embedded"
+
+# Pointers <svg name>@<svg stamp> -> blob decoded from an embedded SVG
+DERIVED_DIR = "derived"
+
+MIME_BY_EXT = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+               '.gif': 'image/gif', '.webp': 'image/webp'}
+EXT_BY_MIME = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/gif': '.gif', 'image/webp': '.webp'}
+
+_CHUNK = 1024 * 1024
+
+
+def build_svg(href, layer='<g id="annotations"></g>'):
+    """The SVG wrapper around a source image, with its annotation layer markup."""
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"
+     width="700" height="900" viewBox="0 0 700 900">
+  <!-- Source image — never modified -->
+  <image id="source-image" x="0" y="0" width="700" height="900"
+         xlink:href="{href}"
+         preserveAspectRatio="none"/>
+  <!-- Annotations layer — updated by editor -->
+  {layer}
+</svg>'''
+
+
+def mime_for_ext(ext):
+    # Historical behaviour: anything that is not a PNG was declared as JPEG
+    return 'image/png' if ext.lower() == '.png' else MIME_BY_EXT.get(ext.lower(), 'image/jpeg')
+
+
+# -------------------- CREATE --------------------
+@instrumentation.timed("svg.write")
+def create_svg_from_blob(upload_folder, name, blob, mode=STORAGE_SIDECAR, annotations=()):
+    """
+    Write <name>.svg around an image already in the blob store
+    ("blobs/<sha256>.<ext>"), with its annotation layer already filled in.
+    The background job does it: the upload was stored by the request.
+    Returns the SVG filename.
+    """
+    # Rendered first: bad annotations must fail before anything is stored
+    layer = annotations_markup(annotations)
+    svg_filename = name + '.svg'
+    svg_path = os.path.join(upload_folder, svg_filename)
+    if mode == STORAGE_EMBEDDED:
+        with open(os.path.join(upload_folder, blob), 'rb') as f:
+            write_embedded_svg(svg_path, f, mime_for_ext(os.path.splitext(blob)[1]), layer)
+    else:
+        write_atomic(svg_path, build_svg(blob, layer).encode('utf-8'))
+    return svg_filename
+
+
+def copy_svg(upload_folder, svg_path, name):
+    """
+    Write <name>.svg in the sidecar layout with the source image and the
+    annotations of `svg_path`, which is only read (its annotation layer and
+    the head of its source image). Both SVGs then reference the same blob;
+    an embedded source is decoded into the blob store as source_image_file()
+    does. Returns the SVG filename, or None if `svg_path` has no source image.
+    """
+    source = source_image_file(upload_folder, svg_path)
+    if source is None:
+        return None
+    folder = os.path.realpath(upload_folder)
+    blob = os.path.relpath(os.path.realpath(source[0]), folder).replace(os.sep, '/')
+    return create_svg_from_blob(upload_folder, name, blob, annotations=annotation_cache.get(svg_path))
+
+
+def write_embedded_svg(svg_path, source, mime, layer):
+    """
+    Write an SVG with `source` (a binary stream) base64-encoded into it,
+    chunk by chunk: memory use does not depend on the image size.
+    """
+    head, tail = build_svg('\0', layer).split('\0')
+    with atomic_file(svg_path) as out:
+        out.write(f"{head}data:{mime};base64,".encode('utf-8'))
+        pending = b''
+        while True:
+            chunk = source.read(_CHUNK)
+            if not chunk:
+                break
+            pending += chunk
+            # Only whole 3-byte groups: no padding in the middle of the data
+            cut = len(pending) - len(pending) % 3
+            out.write(base64.b64encode(pending[:cut]))
+            pending = pending[cut:]
+        out.write(base64.b64encode(pending))
+        out.write(tail.encode('utf-8'))
+
+
+@contextmanager
+def atomic_file(path):
+    """Binary file written via temp file + rename so readers never see half of it."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_atomic(path, data):
+    """Write a file via temp file + rename so readers never see half of it."""
+    with atomic_file(path) as f:
+        f.write(data)
+
+
+# -------------------- ANNOTATIONS --------------------
+# Opening tag of the layer, as written by build_svg and by the ElementTree
+# rewrite older versions used (possibly self-closed when empty)
+_LAYER_OPEN = re.compile(rb'<(?:\w+:)?g\s+id="annotations"[^>]*?(/?)>')
+_G_TAG = re.compile(rb'<(/?)(?:\w+:)?g\b[^>]*?(/?)>')
+_SVG_CLOSE = b'</svg>'
+
+
+def annotations_markup(annotations):
+    """
+    Render the <g id="annotations"> layer. Each annotation is a <g> carrying
+    data-id / data-x / data-y / data-side (read back by get_svg_annotations)
+    around a leader line, a target dot and the numbered circle.
+    """
+    parts = ['<g id="annotations">']
+    for ann in annotations:
+        x = float(ann['x'])
+        y = float(ann['y'])
+        side = str(ann['side'])
+        ann_id = int(ann['id'])
+        line_x = 50 if side == 'left' else 650
+        parts.append(
+            f'<g data-id="{ann_id}" data-x="{x}" data-y="{y}" data-side={quoteattr(side)}>'
+            f'<line x1="{line_x}" y1="{y}" x2="{x}" y2="{y}" stroke="black" stroke-width="2" />'
+            f'<circle cx="{x}" cy="{y}" r="3" fill="black" />'
+            f'<circle cx="{line_x}" cy="{y}" r="20" fill="black" />'
+            f'<text x="{line_x}" y="{y}" text-anchor="middle" dominant-baseline="central" '
+            f'fill="white" font-size="14" font-weight="bold" font-family="Arial, sans-serif">{ann_id}</text>'
+            f'</g>'
+        )
+    parts.append('</g>')
+    return ''.join(parts)
+
+
+def _find_layer(path, size):
+    """
+    Locate the annotation layer in the last _CHUNK bytes of the file — it
+    follows the (possibly huge) source image, so the image itself is never
+    read. Returns the (start, end) byte offsets of the layer, or the offset
+    of </svg> twice when the file has none yet.
+    """
+    offset = max(0, size - _CHUNK)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        tail = f.read()
+
+    matches = list(_LAYER_OPEN.finditer(tail))
+    if not matches:
+        close = tail.rfind(_SVG_CLOSE)
+        if close == -1:
+            raise ValueError("Not an SVG file")
+        return offset + close, offset + close
+
+    m = matches[-1]
+    if m.group(1):  # <g id="annotations"/>
+        return offset + m.start(), offset + m.end()
+    depth = 1
+    for tag in _G_TAG.finditer(tail, m.end()):
+        if tag.group(2):
+            continue
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return offset + m.start(), offset + tag.end()
+    raise ValueError("Unterminated annotations layer")
+
+
+@instrumentation.timed("svg.write")
+def write_annotations(svg_path, annotations):
+    """
+    Replace the annotation layer of an SVG without parsing it: the bytes
+    before and after the layer are streamed into a temp file around the new
+    markup, which is then renamed over the original. Concurrent saves
+    therefore never leave a half-written file — the last one wins.
+    """
+    size = os.path.getsize(svg_path)
+    start, end = _find_layer(svg_path, size)
+    markup = annotations_markup(annotations).encode('utf-8')
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(svg_path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out, open(svg_path, 'rb') as src:
+            remaining = start
+            while remaining:
+                chunk = src.read(min(_CHUNK, remaining))
+                if not chunk:
+                    raise ValueError("SVG changed while saving")
+                out.write(chunk)
+                remaining -= len(chunk)
+            out.write(markup)
+            src.seek(end)
+            out.write(src.read())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, svg_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+_ANNOTATION_TAG = re.compile(rb'<(?:\w+:)?g\s[^>]*?data-id="[^>]*>')
+_ATTR = re.compile(rb'([\w:-]+)="([^"]*)"')
+
+
+@instrumentation.timed("svg.parse")
+def read_annotations(svg_path):
+    """
+    Return the annotations of an SVG as [{"id", "x", "y", "side"}, ...],
+    reading only the annotation layer at the end of the file.
+    """
+    size = os.path.getsize(svg_path)
+    start, end = _find_layer(svg_path, size)
+    with open(svg_path, 'rb') as f:
+        f.seek(start)
+        layer = f.read(end - start)
+    annotations = []
+    for tag in _ANNOTATION_TAG.finditer(layer):
+        attrs = {k.decode(): unescape(v.decode('utf-8'), {'&quot;': '"'}) for k, v in _ATTR.findall(tag.group(0))}
+        if all(attrs.get(k) for k in ('data-id', 'data-x', 'data-y', 'data-side')):
+            annotations.append({
+                'id': int(attrs['data-id']),
+                'x': float(attrs['data-x']),
+                'y': float(attrs['data-y']),
+                'side': attrs['data-side']
+            })
+    return annotations
+
+
+class AnnotationCache:
+    """
+    Annotations per SVG, keyed by path and validated against the file's
+    (inode, mtime_ns, size) — every atomic write creates a new inode — so a
+    changed file is simply a miss, whoever changed it.
+    In-process LRU of `maxsize` entries; when `disk_dir` is set, entries are
+    also kept as JSON files there so a fresh worker starts warm.
+    save_annotations / create_exploded_view_with_annotations call put() with
+    what they just wrote, so the next editor open is a hit.
+    """
+
+    def __init__(self, maxsize=512, disk_dir=None):
+        self.maxsize = maxsize
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def _stamp(svg_path):
+        st = os.stat(svg_path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _disk_path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self.disk_dir, name)
+
+    def get(self, svg_path):
+        key = os.path.realpath(svg_path)
+        stamp = self._stamp(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+
+        annotations = self._load_disk(key, stamp)
+        if annotations is None:
+            annotations = read_annotations(key)
+            self._store(key, stamp, annotations, to_disk=True)
+        else:
+            self._store(key, stamp, annotations, to_disk=False)
+        with self._lock:
+            self.misses += 1
+        return list(annotations)
+
+    def put(self, svg_path, annotations):
+        key = os.path.realpath(svg_path)
+        annotations = [{'id': int(a['id']), 'x': float(a['x']), 'y': float(a['y']), 'side': str(a['side'])}
+                       for a in annotations]
+        self._store(key, self._stamp(key), annotations, to_disk=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, key, stamp, annotations, to_disk):
+        with self._lock:
+            self._entries[key] = (stamp, annotations)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        if to_disk and self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            payload = {'stamp': list(stamp), 'annotations': annotations}
+            write_atomic(self._disk_path(key), json.dumps(payload).encode('utf-8'))
+
+    def _load_disk(self, key, stamp):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if tuple(payload.get('stamp') or ()) != stamp:
+            return None
+        return payload.get('annotations')
+
+
+annotation_cache = AnnotationCache()
+
+
+# -------------------- SOURCE IMAGE --------------------
+def find_source_href(svg_path):
+    """
+    Return the href of the source image, or None. Sidecar SVGs are tiny, so
+    reading them whole is fine; embedded ones are only touched up to the
+    start of the data URI.
+    """
+    with open(svg_path, 'rb') as f:
+        head = f.read(64 * 1024)
+    m = re.search(rb'id="source-image"[^>]*?\s(?:xlink:)?href="([^"]*)', head, re.S)
+    if not m:
+        return None
+    href = m.group(1)
+    if href.startswith(b'data:'):
+        return 'data:'
+    return href.decode('utf-8')
+
+
+def sidecar_path(upload_folder, svg_path):
+    """Absolute path of the source blob of a sidecar SVG, or None if embedded/missing."""
+    href = find_source_href(svg_path)
+    if not href or href.startswith('data:'):
+        return None
+    path = os.path.realpath(os.path.join(os.path.dirname(svg_path), href))
+    # Never follow an href outside the upload folder
+    if not path.startswith(os.path.realpath(upload_folder) + os.sep):
+        return None
+    return path if os.path.exists(path) else None
+
+
+class _Base64Reader:
+    """File-like read() over a base64 byte range of a file, decoded on the fly."""
+
+    def __init__(self, f, start, end):
+        self._f = f
+        self._remaining = end - start
+        self._pending = b''
+        f.seek(start)
+
+    def read(self, size=_CHUNK):
+        want = max(size, 3) // 3 * 4  # encoded bytes for `size` decoded ones
+        while len(self._pending) < want and self._remaining:
+            chunk = self._f.read(min(self._remaining, want))
+            if not chunk:
+                self._remaining = 0
+                break
+            self._remaining -= len(chunk)
+            self._pending += b''.join(chunk.split())
+        # Decode whole quanta only, except for the very end of the payload
+        usable = len(self._pending) if not self._remaining else len(self._pending) // 4 * 4
+        data, self._pending = self._pending[:usable], self._pending[usable:]
+        return base64.b64decode(data) if data else b''
+
+
+def _data_uri_span(svg_path):
+    """(mime, start, end) of the base64 payload of an embedded SVG, or None."""
+    with open(svg_path, 'rb') as f:
+        head = f.read(64 * 1024)
+        m = re.search(rb'id="source-image"[^>]*?\s(?:xlink:)?href="data:([^;,"]*);base64,', head, re.S)
+        if not m:
+            return None
+        start = pos = m.end()
+        f.seek(start)
+        while True:
+            chunk = f.read(_CHUNK)
+            if not chunk:
+                return None
+            quote = chunk.find(b'"')
+            if quote != -1:
+                return m.group(1).decode('ascii'), start, pos + quote
+            pos += len(chunk)
+
+
+def source_image_file(upload_folder, svg_path):
+    """
+    Return (path, mime, etag) of a file holding the source image of an SVG,
+    or None. Sidecar SVGs point at their blob directly. Embedded ones are
+    decoded once into the blob store, and a pointer in derived/ named after
+    the SVG's (inode, mtime, size) remembers the result until the SVG
+    changes. The etag is the image's sha256 either way, so an annotation
+    save does not invalidate what browsers already hold.
+    """
+    blob = sidecar_path(upload_folder, svg_path)
+    if blob is None:
+        blob = _derived_blob(upload_folder, svg_path)
+        if blob is None:
+            return None
+    name = os.path.basename(blob)
+    digest, ext = os.path.splitext(name)
+    mime = MIME_BY_EXT.get(ext.lower()) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    return blob, mime, digest
+
+
+def _derived_blob(upload_folder, svg_path):
+    st = os.stat(svg_path)
+    base = os.path.splitext(os.path.basename(svg_path))[0]
+    derived_dir = os.path.join(upload_folder, DERIVED_DIR)
+    pointer = os.path.join(derived_dir, f"{base}@{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}")
+    try:
+        with open(pointer, encoding='utf-8') as f:
+            blob = os.path.join(upload_folder, f.read().strip())
+        if os.path.exists(blob):
+            return blob
+    except FileNotFoundError:
+        pass
+
+    span = _data_uri_span(svg_path)
+    if span is None:
+        return None
+    mime, start, end = span
+    with open(svg_path, 'rb') as f:
+        rel = blobstore.put(upload_folder, _Base64Reader(f, start, end), EXT_BY_MIME.get(mime, '.png'))
+
+    os.makedirs(derived_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(glob.escape(derived_dir), glob.escape(base) + '@*')):
+        os.remove(stale)
+    write_atomic(pointer, rel.encode('utf-8'))
+    return os.path.join(upload_folder, rel)
+
+
+# -------------------- MIGRATION: EMBEDDED -> SIDECAR --------------------
+def _copy_bytes(src, out, count):
+    while count:
+        chunk = src.read(min(_CHUNK, count))
+        if not chunk:
+            raise ValueError("SVG changed while saving")
+        out.write(chunk)
+        count -= len(chunk)
+
+
+@instrumentation.timed("svg.write")
+def extract_embedded_image(upload_folder, svg_path):
+    """
+    Move the base64 image of an embedded SVG into the blob store and point
+    the SVG at it. Returns the blob path, or None if the SVG was not embedded.
+    The image is decoded and the SVG rewritten chunk by chunk.
+    """
+    span = _data_uri_span(svg_path)
+    if span is None:
+        return None
+    mime, start, end = span
+    href_start = start - len(f"data:{mime};base64,")
+    with open(svg_path, 'rb') as src:
+        blob = blobstore.put(upload_folder, _Base64Reader(src, start, end), EXT_BY_MIME.get(mime, '.png'))
+        src.seek(0)
+        with atomic_file(svg_path) as out:
+            _copy_bytes(src, out, href_start)
+            out.write(blob.encode('utf-8'))
+            src.seek(end)
+            shutil.copyfileobj(src, out, _CHUNK)
+    return blob
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The app opens FICHES_DB when imported: never the working copy's database
+os.environ["FICHES_DB"] = os.path.join(tempfile.mkdtemp(), "fiches.db")
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A migrated FicheTechnique database."""
+    conn = db.connect(str(tmp_path / "fiches.db"))
+    migrations.migrate(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def app_client():
+    """(test client, connection) on the app's database, shared by the whole run."""
+    import app
+    app.jobs.runner.threads = 0
+    conn = db.connect(db.DB_NAME)
+    yield app.app.test_client(), conn
+    conn.close()
+
+
+def add_fiche(conn, cpid, langue="fr", **columns):
+    """Insert one fiche_technique row; returns its id."""
+    columns = dict({"reference": cpid, "reference_menu": "M"}, **columns)
+    with db.transaction(conn):
+        return conn.execute(
+            f"INSERT INTO fiche_technique (cpid, langue, {', '.join(columns)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(columns))})", [cpid, langue, *columns.values()]).lastrowid
@@ -0,0 +1,40 @@
+import io
+import os
+import time
+
+import blobstore
+
+OLD = time.time() - 7200
+
+
+def _put(folder, data, conn=None):
+    blob = blobstore.put(folder, io.BytesIO(data), ".png", conn)
+    return blob, os.path.join(folder, blob)
+
+
+def test_identical_content_is_stored_once_and_left_untouched(tmp_path, database):
+    folder = str(tmp_path)
+    blob, path = _put(folder, b"image")
+    os.utime(path, (OLD, OLD))
+    assert _put(folder, b"image", database)[0] == blob
+    assert os.stat(path).st_mtime == OLD
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+
+
+def test_gc_grace_period(tmp_path, database):
+    folder = str(tmp_path)
+    kept, kept_path = _put(folder, b"stored again")
+    gone, gone_path = _put(folder, b"unreferenced")
+    used, used_path = _put(folder, b"referenced")
+    for path in (kept_path, gone_path, used_path):
+        os.utime(path, (OLD, OLD))
+    _put(folder, b"stored again", database)
+    with blobstore.transaction(database):
+        database.execute("INSERT INTO fiche_technique (cpid, reference, reference_menu, photo_produit) "
+                         "VALUES ('CP1', 'R', 'M', ?)", (blobstore.DB_PREFIX + used,))
+    fresh, _ = _put(folder, b"just uploaded")
+
+    deleted, _ = blobstore.gc(database, folder)
+    assert deleted == [gone]
+    assert all(os.path.exists(os.path.join(folder, b)) for b in (kept, used, fresh))
+    assert blobstore.refcount(database, used) == 1
@@ -0,0 +1,21 @@
+import io
+import os
+import time
+
+import chunked_upload
+
+
+def test_expire_keeps_uploads_receiving_chunks(tmp_path):
+    folder = str(tmp_path)
+    active = chunked_upload.create(folder, "a.png", 8, 1024)["id"]
+    stale = chunked_upload.create(folder, "b.png", 8, 1024)["id"]
+    old = time.time() - chunked_upload.EXPIRY - 60
+    for upload_id in (active, stale):
+        for path in chunked_upload._paths(folder, upload_id):
+            os.utime(path, (old, old))
+
+    chunked_upload.write_chunk(folder, active, "bytes 0-3/8", io.BytesIO(b"abcd"))
+    chunked_upload.expire(folder)
+
+    assert chunked_upload.status(folder, active)["received"] == 4
+    assert not any(os.path.exists(p) for p in chunked_upload._paths(folder, stale))
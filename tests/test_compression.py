@@ -0,0 +1,62 @@
+import gzip
+
+import pytest
+from flask import Flask, jsonify, send_file
+
+import compression
+
+BIG = {"rows": [{"cpid": f"CP{i}", "description": "cloison vitrée"} for i in range(100)]}
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = Flask(__name__)
+    asset = tmp_path / "asset.js"
+    asset.write_text("x" * 5000)
+
+    @app.route("/big")
+    def big():
+        response = jsonify(BIG)
+        response.set_etag("abc")
+        return response
+
+    @app.route("/small")
+    def small():
+        return jsonify({"ok": True})
+
+    @app.route("/file")
+    def file():
+        return send_file(str(asset))
+
+    compression.init_app(app)
+    return app.test_client()
+
+
+def _plain(client):
+    return client.get("/big", headers={"Accept-Encoding": "identity"}).data
+
+
+def test_gzip_when_only_gzip_is_accepted(client):
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == _plain(client)
+    assert response.headers["ETag"] == 'W/"abc"'
+
+
+@pytest.mark.skipif(compression.brotli is None, reason="brotli not installed")
+def test_brotli_preferred_when_accepted(client):
+    response = client.get("/big", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert compression.brotli.decompress(response.data) == _plain(client)
+
+
+def test_gzip_without_the_brotli_module(client, monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert client.get("/big", headers={"Accept-Encoding": "br, gzip"}).headers["Content-Encoding"] == "gzip"
+
+
+def test_left_alone(client):
+    assert "Content-Encoding" not in client.get("/big", headers={"Accept-Encoding": "identity"}).headers
+    assert "Content-Encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    assert "Content-Encoding" not in client.get("/file", headers={"Accept-Encoding": "gzip"}).headers
@@ -0,0 +1,67 @@
+import pytest
+
+import cpid_listing
+import db
+from conftest import add_fiche
+
+
+def _listing(conn, product_type):
+    return cpid_listing.listing(conn, product_type)[1]
+
+
+def test_listing_holds_french_cpids_in_case_insensitive_order(database):
+    for cpid in ("b2", "A1", " a3 ", "C"):
+        add_fiche(database, cpid, type="Porte")
+    add_fiche(database, "ZZ", langue="en", type="Porte")
+    add_fiche(database, "AUTRE", type="Chassis")
+    assert _listing(database, "Porte") == ["A1", "a3", "b2", "C"]
+    assert _listing(database, "Chassis") == ["AUTRE"]
+    assert cpid_listing.count(database, "Porte") == 4
+
+
+def test_triggers_follow_renames_type_changes_and_deletes(database):
+    fiche_id = add_fiche(database, "X1", type="Cloison-t")
+    add_fiche(database, "X2", type="Cloison-t")
+    version = cpid_listing.version(database, "Cloison-t")
+    with db.transaction(database):
+        database.execute("UPDATE fiche_technique SET cpid = 'X0' WHERE id = ?", (fiche_id,))
+    assert _listing(database, "Cloison-t") == ["X0", "X2"]
+    assert cpid_listing.version(database, "Cloison-t") > version
+
+    with db.transaction(database):
+        database.execute("UPDATE fiche_technique SET type = 'Porte-t' WHERE id = ?", (fiche_id,))
+    assert _listing(database, "Cloison-t") == ["X2"]
+    assert _listing(database, "Porte-t") == ["X0"]
+
+    version = cpid_listing.version(database, "Cloison-t")
+    with db.transaction(database):
+        database.execute("UPDATE fiche_technique SET description = 'x' WHERE cpid = 'X2'")
+    assert cpid_listing.version(database, "Cloison-t") == version
+
+    with db.transaction(database):
+        database.execute("DELETE FROM fiche_technique WHERE cpid = 'X2'")
+    assert _listing(database, "Cloison-t") == []
+
+
+def test_lookup_prefix_first_then_substring(database):
+    for cpid in ("P_DIVA", "DIVA_2", "p_div", "AUTRE"):
+        add_fiche(database, cpid, type="Lookup")
+    assert cpid_listing.lookup(database, "Lookup", "p_d") == ["p_div", "P_DIVA"]
+    assert cpid_listing.lookup(database, "Lookup", "diva") == ["DIVA_2", "P_DIVA"]
+    assert cpid_listing.lookup(database, "Lookup", "div", limit=1) == ["DIVA_2"]
+    with pytest.raises(ValueError):
+        cpid_listing.lookup(database, "Lookup", "div", limit="abc")
+
+
+def test_api_cpids_etag_changes_with_the_listing(app_client):
+    client, conn = app_client
+    add_fiche(conn, "API1", type="Api-type")
+    first = client.get("/api/cpids?type=Api-type")
+    assert first.get_json()["cpids"] == ["API1"]
+    etag = first.headers["ETag"]
+    assert client.get("/api/cpids?type=Api-type", headers={"If-None-Match": etag}).status_code == 304
+
+    add_fiche(conn, "API0", type="Api-type")
+    second = client.get("/api/cpids?type=Api-type", headers={"If-None-Match": etag})
+    assert second.status_code == 200 and second.get_json()["cpids"] == ["API0", "API1"]
+    assert client.get("/api/cpids?type=Api-type&q=a&limit=abc").status_code == 400
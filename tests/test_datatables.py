@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+import datatables
+
+COLUMNS = ["id", "cpid", "hauteur"]
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, cpid TEXT, hauteur TEXT)")
+    conn.executemany("INSERT INTO t (id, cpid, hauteur) VALUES (?, ?, ?)",
+                     [(1, "CP_A", "900"), (2, "CP%B", "2700"), (3, "XA", "1200"), (4, "CPAB", None)])
+    return conn
+
+
+def _params(**extra):
+    params = {"draw": "3", "columns[0][data]": "id", "columns[1][data]": "cpid", "columns[2][data]": "hauteur"}
+    params.update(extra)
+    return params
+
+
+def _ids(result):
+    return [row["id"] for row in result["data"]]
+
+
+def test_paging(conn):
+    result = datatables.query(conn, "t", COLUMNS, _params(start="1", length="2"))
+    assert result["draw"] == 3
+    assert result["recordsTotal"] == result["recordsFiltered"] == 4
+    assert _ids(result) == [3, 2]          # default order: id DESC
+    assert result["last_id"] == 2
+
+
+def test_length_is_capped(conn):
+    result = datatables.query(conn, "t", COLUMNS, _params(length="-1"))
+    assert len(result["data"]) == 4
+
+
+def test_order_by_client_column_sorts_numbers_as_numbers(conn):
+    params = _params(**{"order[0][column]": "2", "order[0][dir]": "asc"})
+    assert _ids(datatables.query(conn, "t", COLUMNS, params)) == [4, 1, 3, 2]
+    params["order[0][dir]"] = "desc"
+    assert _ids(datatables.query(conn, "t", COLUMNS, params)) == [2, 3, 1, 4]
+
+
+def test_order_ignores_unknown_and_unorderable_columns(conn):
+    params = _params(**{"order[0][column]": "7", "order[1][column]": "1",
+                        "columns[1][orderable]": "false", "columns[3][data]": "nope"})
+    assert _ids(datatables.query(conn, "t", COLUMNS, params)) == [4, 3, 2, 1]
+
+
+def test_global_search_escapes_like_wildcards(conn):
+    result = datatables.query(conn, "t", COLUMNS, _params(**{"search[value]": "%"}))
+    assert _ids(result) == [2]
+    assert result["recordsFiltered"] == 1 and result["recordsTotal"] == 4
+    assert _ids(datatables.query(conn, "t", COLUMNS, _params(**{"search[value]": "P_"}))) == [1]
+
+
+def test_every_search_word_must_match(conn):
+    params = _params(**{"search[value]": "cp 27"})
+    assert _ids(datatables.query(conn, "t", COLUMNS, params)) == [2]
+
+
+def test_column_search_and_unsearchable_columns(conn):
+    params = _params(**{"columns[1][search][value]": "A"})
+    assert _ids(datatables.query(conn, "t", COLUMNS, params)) == [4, 3, 1]
+    params = _params(**{"search[value]": "900", "columns[2][searchable]": "false"})
+    assert _ids(datatables.query(conn, "t", COLUMNS, params)) == []
+
+
+def test_keyset_paging_after_last_id(conn):
+    result = datatables.query(conn, "t", COLUMNS, _params(length="2", after="3", start="40"))
+    assert _ids(result) == [2, 1]
+
+
+def test_fields_projection_always_returns_id(conn):
+    result = datatables.query(conn, "t", COLUMNS, _params(fields="hauteur,secret"))
+    assert set(result["data"][0]) == {"id", "hauteur"}
+
+
+def test_invalid_number_is_a_request_error(conn):
+    with pytest.raises(datatables.RequestError):
+        datatables.query(conn, "t", COLUMNS, _params(start="abc"))
@@ -0,0 +1,66 @@
+import db
+import fiche_import
+import fiches
+import migrations
+
+
+def _database(tmp_path):
+    conn = db.connect(str(tmp_path / "fiches.db"))
+    migrations.migrate(conn)
+    with db.transaction(conn):
+        cur = conn.execute(
+            "INSERT INTO fiche_technique (cpid, reference, reference_menu, langue, description) "
+            "VALUES ('CP1', 'R', 'M', 'fr', 'avant')")
+        fiches.write_children(conn, cur.lastrowid, {1: "Montant", 2: "Traverse"},
+                              {1: {"image": "uploads/blobs/a.png", "nom": "Coupe A"}})
+    return conn
+
+
+def _fr(conn):
+    return fiches.load_fiche(conn, "CP1")["fr"]
+
+
+def test_partial_columns_keep_children(tmp_path):
+    conn = _database(tmp_path)
+    rows = [["CPID", "Langue", "Référence", "Réf. Menu", "Description"],
+            ["CP1", "fr", "R", "M", "après"]]
+    report = fiche_import.import_rows(conn, rows, {"reference": "Référence", "reference_menu": "Réf. Menu"})
+    assert report["updated"] == 1 and not report["errors"]
+    fr = _fr(conn)
+    assert fr["description"] == "après"
+    assert [c["label"] for c in fr["components"]] == ["Montant", "Traverse"]
+    assert fr["drawings"] == [{"position": 1, "image": "uploads/blobs/a.png", "nom": "Coupe A"}]
+
+
+def test_imported_group_is_replaced_others_kept(tmp_path):
+    conn = _database(tmp_path)
+    rows = [["cpid", "langue", "reference", "reference_menu", "vue_eclatee_1", "dessin_technique_nom_1"],
+            ["CP1", "fr", "R", "M", "Cadre", "Coupe B"]]
+    fiche_import.import_rows(conn, rows, {})
+    fr = _fr(conn)
+    assert [(c["position"], c["label"]) for c in fr["components"]] == [(1, "Cadre")]
+    # Names come from the file, images (no column for them) are kept
+    assert fr["drawings"] == [{"position": 1, "image": "uploads/blobs/a.png", "nom": "Coupe B"}]
+
+
+def test_updates_need_only_the_key(tmp_path):
+    conn = _database(tmp_path)
+    rows = [["CPID", "Langue", "Hauteur"],
+            ["CP1", "fr", "2.0"],
+            ["CP2", "fr", "900"]]
+    report = fiche_import.import_rows(conn, rows, {})
+    assert (report["updated"], report["inserted"], report["skipped"]) == (1, 0, 1)
+    assert report["errors"][0]["row"] == 3 and "reference" in report["errors"][0]["error"]
+    fr = _fr(conn)
+    assert (fr["reference"], fr["description"], fr["hauteur"]) == ("R", "avant", "2.0")
+
+
+def test_cells_keep_their_text(tmp_path):
+    conn = _database(tmp_path)
+    rows = [["cpid", "langue", "reference", "reference_menu", "hauteur", "largeur"],
+            ["CP1", "fr", "R", "M", 2.0, 2.5],
+            ["CP3", "fr", "R", "M", 2700, None]]
+    report = fiche_import.import_rows(conn, rows, {})
+    assert (report["updated"], report["inserted"]) == (1, 1)
+    assert (_fr(conn)["hauteur"], _fr(conn)["largeur"]) == ("2.0", "2.5")
+    assert fiches.load_fiche(conn, "CP3")["fr"]["hauteur"] == "2700"
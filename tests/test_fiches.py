@@ -0,0 +1,55 @@
+import pytest
+
+import db
+import fiches
+from conftest import add_fiche
+
+
+def test_localize_children_drops_empty_drawings():
+    drawings = {1: {"image": None, "nom": "Coupe"}, 2: {"image": "uploads/blobs/a.png", "nom": None}}
+    components, localized = fiches.localize_children(drawings, {"vue_eclatee_1": "Frame"})
+    assert components == {1: "Frame"}
+    assert localized == {2: {"image": "uploads/blobs/a.png", "nom": None}}
+
+
+TRANSLATABLE = {"description"}
+
+
+def test_compact_record_keeps_shared_values_once():
+    record = {
+        "fr": {"id": 1, "cpid": "CP1", "hauteur": "2700", "description": "cloison", "photo_produit": None,
+               "components": [{"position": 1, "label": "Montant"}], "drawings": []},
+        "en": {"id": 2, "cpid": "CP1", "hauteur": "2700", "description": None, "photo_produit": None,
+               "components": [], "drawings": []},
+        "nl": None,
+    }
+    compact = fiches.compact_record(record, TRANSLATABLE)
+    assert compact["shared"] == {"id": 1, "cpid": "CP1", "hauteur": "2700"}
+    assert compact["fr"] == {"description": "cloison", "vue_eclatee_1": "Montant"}
+    assert compact["en"] == {"id": 2}
+    assert compact["nl"] is None
+    assert fiches.compact_record(record, TRANSLATABLE, {"hauteur"}) == \
+        {"shared": {"hauteur": "2700"}, "fr": {}, "en": {}, "nl": None}
+
+
+def test_projection(database):
+    assert fiches.projection(database, ["hauteur", "vue_eclatee_3"]) == (["hauteur"], True)
+    assert fiches.projection(database, ["hauteur"]) == (["hauteur"], False)
+    with pytest.raises(ValueError):
+        fiches.projection(database, ["hauteur; DROP"])
+
+
+def test_get_fiche_compact_and_fields(app_client):
+    client, conn = app_client
+    fiche_id = add_fiche(conn, "GET1", hauteur="2700", description="cloison")
+    add_fiche(conn, "GET1", langue="en", description="partition")
+    with db.transaction(conn):
+        fiches.write_children(conn, fiche_id, {1: "Montant"}, {})
+
+    body = client.get("/get_fiche/GET1?format=compact&fields=reference_menu,hauteur,description,vue_eclatee_1")
+    body = body.get_json()
+    assert body["shared"] == {"reference_menu": "M"}
+    assert body["fr"] == {"hauteur": "2700", "description": "cloison", "vue_eclatee_1": "Montant"}
+    assert body["en"] == {"description": "partition"} and body["nl"] is None
+    assert client.get("/get_fiche/GET1?fields=nope").status_code == 400
+    assert client.get("/get_fiche/NOPE1?format=compact").status_code == 404
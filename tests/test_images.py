@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+import blobstore
+import images
+
+
+@pytest.mark.parametrize("filename", ["blobs/abc.jpg", "old__upload.png", "CP1__photo-2.jpg"])
+def test_source_name_inverts_derivative_name(filename):
+    assert images.source_name(images.derivative_name(filename, 640)) == filename
+
+
+def test_source_name_rejects_other_files():
+    assert images.source_name("notes.txt") is None
+    assert images.source_name("photo-large.webp") is None
+
+
+def test_gc_keeps_derivatives_of_names_with_double_underscores(tmp_path):
+    pytest.importorskip("PIL")
+    from PIL import Image
+
+    folder = str(tmp_path)
+    Image.new("RGB", (400, 200)).save(os.path.join(folder, "old__upload.png"))
+    kept = images.derivative_path(folder, "old__upload.png", 320)
+    with open(os.path.join(folder, "old__upload.png"), "rb") as stream:
+        blob = blobstore.put(folder, stream, ".png")
+    orphan = images.derivative_path(folder, blob, 320)
+    os.remove(os.path.join(folder, blob))
+
+    blobstore._drop_orphan_derivatives(folder)
+    assert os.path.exists(kept)
+    assert not os.path.exists(orphan)
@@ -0,0 +1,31 @@
+import pytest
+
+import db
+import migrations
+
+
+def test_duplicate_fiches_stop_the_migration(tmp_path):
+    conn = db.connect(str(tmp_path / "fiches.db"))
+    migrations.migrate(conn, target=2)
+    with db.transaction(conn):
+        for description in ("une", "deux"):
+            conn.execute("INSERT INTO fiche_technique (cpid, reference, reference_menu, langue, description) "
+                         "VALUES ('CP1', 'R', 'M', 'fr', ?)", (description,))
+    with pytest.raises(migrations.MigrationError, match=r"CP1 / fr : ids 1, 2"):
+        migrations.migrate(conn)
+    assert migrations.get_version(conn) == 2
+    assert conn.execute("SELECT COUNT(*) FROM fiche_technique").fetchone()[0] == 2
+
+
+def test_one_revision_and_version_per_write(tmp_path):
+    conn = db.connect(str(tmp_path / "fiches.db"))
+    migrations.migrate(conn)
+    with db.transaction(conn):
+        conn.execute("INSERT INTO fiche_technique (cpid, reference, reference_menu, langue) "
+                     "VALUES ('CP1', 'R', 'M', 'fr')")
+    revision = "SELECT revision FROM fiche_revision WHERE cpid = 'CP1'"
+    assert conn.execute(revision).fetchone()[0] == 1
+    with db.transaction(conn):
+        conn.execute("UPDATE fiche_technique SET verre = 'x' WHERE cpid = 'CP1'")
+    assert conn.execute(revision).fetchone()[0] == 2
+    assert conn.execute("SELECT version FROM fiche_technique WHERE cpid = 'CP1'").fetchone()[0] == 2
@@ -0,0 +1,75 @@
+import db
+import fiches
+import page_cache
+from conftest import add_fiche
+
+
+def _revision(conn, cpid):
+    return page_cache.revision(conn, cpid)[0]
+
+
+def test_revision_follows_every_write_to_the_cpid(database):
+    fiche_id = add_fiche(database, "CP1")
+    add_fiche(database, "CP2")
+    assert _revision(database, "CP1") == 1
+    with db.transaction(database):
+        database.execute("UPDATE fiche_technique SET verre = 'x' WHERE id = ?", (fiche_id,))
+    assert _revision(database, "CP1") == 2
+    with db.transaction(database):
+        fiches.write_children(database, fiche_id, {1: "Montant"}, {})
+    assert _revision(database, "CP1") == 3
+    with db.transaction(database):
+        database.execute("UPDATE fiche_component SET label = 'Traverse' WHERE fiche_id = ?", (fiche_id,))
+    assert _revision(database, "CP1") == 4
+    assert _revision(database, "CP2") == 1
+
+
+def test_rename_and_delete_bump_the_old_cpid(database):
+    fiche_id = add_fiche(database, "CP1")
+    with db.transaction(database):
+        database.execute("UPDATE fiche_technique SET cpid = 'CP9' WHERE id = ?", (fiche_id,))
+    assert _revision(database, "CP1") == 2
+    assert _revision(database, "CP9") == 1
+    with db.transaction(database):
+        database.execute("DELETE FROM fiche_technique WHERE id = ?", (fiche_id,))
+    assert _revision(database, "CP9") == 2
+    assert page_cache.revision(database, "nope") is None
+
+
+def test_page_cache_serves_only_the_stored_revision():
+    cache = page_cache.PageCache(maxsize=2)
+    cache.put("a", 1, "<a1>")
+    assert cache.get("a", 1) == "<a1>"
+    assert cache.get("a", 2) is None
+    cache.put("b", 1, "<b>")
+    cache.get("a", 1)
+    cache.put("c", 1, "<c>")        # evicts b, the least recently used
+    assert cache.get("b", 1) is None and cache.get("a", 1) == "<a1>"
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_template_digest_follows_the_file(tmp_path):
+    template = tmp_path / "page.html"
+    template.write_text("one")
+    first = page_cache.template_digest(str(template))
+    assert page_cache.template_digest(str(template)) == first
+    template.write_text("two!")
+    assert page_cache.template_digest(str(template)) != first
+
+
+def test_fiche_page_etag_and_304_until_the_fiche_changes(app_client):
+    client, conn = app_client
+    fiche_id = add_fiche(conn, "PAGE1", description="avant")
+    page = client.get("/index?cpid=PAGE1&lang=fr")
+    assert page.status_code == 200 and "avant" in page.get_data(as_text=True)
+    etag = page.headers["ETag"]
+    assert page.headers["Last-Modified"]
+
+    again = client.get("/index?cpid=PAGE1&lang=fr", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.headers["ETag"] == etag
+
+    with db.transaction(conn):
+        conn.execute("UPDATE fiche_technique SET description = 'après' WHERE id = ?", (fiche_id,))
+    changed = client.get("/index?cpid=PAGE1&lang=fr", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    assert "après" in changed.get_data(as_text=True)
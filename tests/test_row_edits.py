@@ -0,0 +1,145 @@
+import pytest
+
+import db
+import row_edits
+from conftest import add_fiche
+
+
+def _row(conn, row_id):
+    return dict(conn.execute("SELECT * FROM fiche_technique WHERE id = ?", (row_id,)).fetchone())
+
+
+def test_update_row_writes_the_changes_and_bumps_the_version(database):
+    row_id = add_fiche(database, "CP1", verre="a", battant="b")
+    version = row_edits.update_row(database, row_id, {"verre": "x"})
+    row = _row(database, row_id)
+    assert version == row["version"] == 2
+    assert (row["verre"], row["battant"]) == ("x", "b")
+
+
+def test_stale_version_is_a_conflict_and_writes_nothing(database):
+    row_id = add_fiche(database, "CP1", verre="a")
+    row_edits.update_row(database, row_id, {"verre": "b"}, expected_version=1)
+    with pytest.raises(row_edits.ConflictError) as e:
+        row_edits.update_row(database, row_id, {"verre": "c"}, expected_version=1)
+    assert e.value.status == 409
+    assert e.value.current[row_id]["verre"] == "b"
+    assert _row(database, row_id)["version"] == 2
+
+
+def test_update_rows_is_all_or_none(database):
+    first = add_fiche(database, "CP1", verre="a")
+    second = add_fiche(database, "CP2", verre="a")
+    with pytest.raises(row_edits.ConflictError):
+        row_edits.update_rows(database, [(first, {"verre": "x"}, 1), (second, {"verre": "y"}, 7)])
+    assert _row(database, first)["verre"] == "a"
+    versions = row_edits.update_rows(database, [(first, {"verre": "x"}, 1), (second, {"battant": "y"}, None)])
+    assert versions == {first: 2, second: 2}
+
+
+def test_invalid_edits(database):
+    row_id = add_fiche(database, "CP1")
+    add_fiche(database, "CP2")
+    with pytest.raises(row_edits.RowError, match="inconnues"):
+        row_edits.changes_of(database, {"verre": "x", "nope": 1})
+    assert row_edits.changes_of(database, {"id": 5, "version": 1, "verre": "x"}) == {"verre": "x"}
+    with pytest.raises(row_edits.RowError) as e:
+        row_edits.update_row(database, 999, {"verre": "x"})
+    assert e.value.status == 404
+    with pytest.raises(row_edits.RowError) as e:
+        row_edits.update_row(database, row_id, {"cpid": "CP2"})
+    assert e.value.status == 409
+    with pytest.raises(row_edits.RowError):
+        row_edits.update_rows(database, [(row_id, {"verre": "x"}, None), (row_id, {"verre": "y"}, None)])
+
+
+def test_editable_columns_follow_the_schema(database):
+    assert "verre" in row_edits.editable_columns(database)
+    assert not {"id", "version"} & row_edits.editable_columns(database)
+    with db.transaction(database):
+        database.execute("ALTER TABLE fiche_technique ADD COLUMN couleur TEXT")
+    assert "couleur" in row_edits.editable_columns(database)
+
+
+def test_patch_endpoints(app_client):
+    client, conn = app_client
+    row_id = add_fiche(conn, "EDIT1", verre="a")
+    response = client.patch(f"/api/db/row/{row_id}", json={"verre": "b", "version": 1})
+    assert response.status_code == 200 and response.get_json()["version"] == 2
+
+    stale = client.patch(f"/api/db/row/{row_id}", json={"verre": "c", "version": 1})
+    assert stale.status_code == 409
+    assert stale.get_json()["current"][0]["verre"] == "b"
+
+    assert client.patch(f"/api/db/row/{row_id}", json={"verre": "c", "version": True}).status_code == 400
+    assert client.patch("/api/db/rows", json=[{"id": True, "verre": "c"}]).status_code == 400
+    bulk = client.patch("/api/db/rows", json=[{"id": row_id, "verre": "d", "version": 2}])
+    assert bulk.get_json()["versions"] == {str(row_id): 3}
+
+
+def _count(conn):
+    return conn.execute("SELECT count(*) FROM fiche_technique").fetchone()[0]
+
+
+def test_batch_mixed_operations(database):
+    gone = add_fiche(database, "OLD")
+    kept = add_fiche(database, "CP1", verre="a")
+    results = row_edits.batch(database, [
+        {"op": "insert", "row": {"cpid": "N1", "reference": "R", "reference_menu": "M"}},
+        {"op": "delete", "id": gone, "version": 1},
+        {"op": "insert", "row": {"cpid": "N2", "reference": "R", "reference_menu": "M", "verre": "v"}},
+        {"op": "update", "id": kept, "changes": {"verre": "b"}, "version": 1},
+        {"op": "insert", "row": {"cpid": "N3", "reference": "R", "reference_menu": "M"}},
+        # Replaces the deleted row's (cpid, langue): deletes run first
+        {"op": "insert", "row": {"cpid": "OLD", "reference": "R2", "reference_menu": "M"}},
+    ])
+    assert results[1] == {} and results[3] == {"version": 2}
+    for i, cpid in ((0, "N1"), (2, "N2"), (4, "N3"), (5, "OLD")):
+        assert _row(database, results[i]["id"])["cpid"] == cpid
+    assert _row(database, results[2]["id"])["verre"] == "v"
+    assert _row(database, kept)["verre"] == "b"
+    assert database.execute("SELECT count(*) FROM fiche_technique WHERE id = ?", (gone,)).fetchone()[0] == 0
+
+
+def test_batch_errors_are_indexed_from_zero_and_nothing_is_written(database):
+    row_id = add_fiche(database, "CP1")
+    ops = [{"op": "update", "id": row_id, "changes": {"verre": "x"}},
+           {"op": "delete", "id": 999},
+           {"op": "nope"}]
+    with pytest.raises(row_edits.BatchError) as e:
+        row_edits.batch(database, ops)
+    assert sorted(e.value.errors) == [2]
+    assert str(e.value).startswith("Opération 2 :")
+
+    with pytest.raises(row_edits.BatchError) as e:
+        row_edits.batch(database, ops[:2])
+    assert sorted(e.value.errors) == [1] and e.value.status == 404
+    assert _row(database, row_id)["verre"] is None
+
+
+def test_batch_rolls_back_when_the_database_refuses_a_row(database):
+    row_id = add_fiche(database, "CP1")
+    before = _count(database)
+    with pytest.raises(row_edits.RowError) as e:
+        row_edits.batch(database, [
+            {"op": "update", "id": row_id, "changes": {"verre": "x"}},
+            {"op": "insert", "row": {"cpid": "N1", "reference": "R", "reference_menu": "M"}},
+            {"op": "insert", "row": {"cpid": "CP1", "reference": "R", "reference_menu": "M"}},
+        ])
+    assert e.value.status == 409
+    assert _count(database) == before
+    assert _row(database, row_id)["verre"] is None
+    # The ids handed out after a rollback still follow the sequence
+    result = row_edits.batch(database, [{"op": "insert", "row": {"cpid": "N1", "reference": "R", "reference_menu": "M"}}])
+    assert _row(database, result[0]["id"])["cpid"] == "N1"
+
+
+def test_batch_endpoint_error_payload(app_client):
+    client, conn = app_client
+    row_id = add_fiche(conn, "BATCH1")
+    response = client.post("/api/db/batch", json=[{"op": "update", "id": row_id, "changes": {"verre": "x"}},
+                                                  {"op": "delete", "id": True}])
+    assert response.status_code == 400
+    body = response.get_json()
+    assert [err["index"] for err in body["errors"]] == [1]
+    assert body["error"].startswith("Opération 1 :")
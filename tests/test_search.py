@@ -0,0 +1,96 @@
+import pytest
+
+import db
+import search
+from conftest import add_fiche as _add
+
+
+def _cpids(conn, text, **kwargs):
+    return [r["cpid"] for r in search.search(conn, text, **kwargs)]
+
+
+def test_match_expression_quotes_every_word():
+    assert search.match_expression('clo"ison NEAR(a b) -x *') == '"clo" AND "ison" AND "near" AND "a" AND "b" AND "x"'
+    assert search.match_expression("cloi") == '"cloi"*'
+    assert search.match_expression(" ;; ") is None
+
+
+def test_match_expression_joins_numbers_and_units():
+    assert search.match_expression("44 dB") == '("44db"* OR ("44" AND "db"*))'
+
+
+def test_syntax_in_the_query_is_searched_as_text(database):
+    _add(database, "CP1", description="porte coupe-feu")
+    assert _cpids(database, 'coupe" OR "x') == []
+    assert _cpids(database, "coupe-feu") == ["CP1"]
+
+
+def test_prefix_and_accents(database):
+    _add(database, "CP1", description="Cloison vitrée")
+    assert _cpids(database, "clois") == ["CP1"]
+    assert _cpids(database, "vitree") == ["CP1"]
+    assert _cpids(database, "EI 60") == []
+
+
+def test_number_and_unit_match_written_together(database):
+    _add(database, "CP1", nbn_en_iso_717_1="44dB")
+    _add(database, "CP2", resistance_feu="EI 60")
+    assert _cpids(database, "44 dB") == ["CP1"]
+    assert _cpids(database, "EI60") == []
+    assert _cpids(database, "EI 60") == ["CP2"]
+
+
+def test_ranked_by_weighted_columns(database):
+    for i in range(5):
+        _add(database, f"AUTRE{i}", description="porte")
+    _add(database, "CP1", description="acoustique")
+    _add(database, "CP2", reference="Acoustique")
+    _add(database, "CP3", verre="acoustique")
+    results = search.search(database, "acoustique")
+    assert [r["cpid"] for r in results] == ["CP2", "CP3", "CP1"]
+    assert results[0]["score"] < results[1]["score"] < results[2]["score"]
+
+
+def test_one_result_per_cpid_in_the_requested_language(database):
+    _add(database, "CP1", description="cloison")
+    _add(database, "CP1", langue="en", description="partition")
+    _add(database, "CP2", langue="en", description="partition")
+    results = search.search(database, "partition", langue="fr")
+    assert [(r["cpid"], r["langue"], r["matched_langue"]) for r in results] == \
+        [("CP1", "fr", "en"), ("CP2", "en", "en")]
+
+
+def test_limit(database):
+    for i in range(5):
+        _add(database, f"CP{i}", description="cloison")
+    assert len(search.search(database, "cloison", limit=2)) == 2
+    assert len(search.search(database, "cloison", limit=0)) == 1
+
+
+def test_index_follows_updates_and_deletes(database):
+    _add(database, "CP1", description="cloison")
+    with db.transaction(database):
+        database.execute("UPDATE fiche_technique SET description = 'porte' WHERE cpid = 'CP1'")
+    assert _cpids(database, "cloison") == []
+    assert _cpids(database, "porte") == ["CP1"]
+    with db.transaction(database):
+        database.execute("DELETE FROM fiche_technique WHERE cpid = 'CP1'")
+    assert _cpids(database, "porte") == []
+
+
+def test_broad_queries_stay_ranked(database):
+    # More matches than any cap on the rows ranked; the best one is the oldest
+    _add(database, "BEST", reference="cloison")
+    with db.transaction(database):
+        database.executemany(
+            "INSERT INTO fiche_technique (cpid, langue, reference, reference_menu, description) "
+            "VALUES (?, 'fr', 'R', 'M', ?)",
+            [(f"CP{i:04}", "cloison" if i < 2500 else "porte") for i in range(3000)])
+    results = search.search(database, "cloison", limit=3)
+    assert results[0]["cpid"] == "BEST"
+    assert all(r["score"] is not None for r in results)
+
+
+def test_limit_must_be_a_number(database):
+    with pytest.raises(ValueError):
+        search.search(database, "", limit="abc")
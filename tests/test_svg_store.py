@@ -0,0 +1,44 @@
+import os
+
+import svg_store
+
+ANNOTATIONS = [{"id": 1, "x": 120.0, "y": 300.0, "side": "left"}]
+
+
+def _embedded_svg(tmp_path, image):
+    path = str(tmp_path / "CP1.svg")
+    svg_store.write_embedded_svg(path, open(image, "rb"), "image/png",
+                                 svg_store.annotations_markup(ANNOTATIONS))
+    return path
+
+
+def _image(tmp_path):
+    path = tmp_path / "source.png"
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 1))
+    return str(path)
+
+
+def test_copy_svg_leaves_the_source_untouched(tmp_path):
+    image = _image(tmp_path)
+    src = _embedded_svg(tmp_path, image)
+    before = open(src, "rb").read()
+
+    name = svg_store.copy_svg(str(tmp_path), src, "CP2")
+    assert name == "CP2.svg"
+    assert open(src, "rb").read() == before
+    copy = str(tmp_path / name)
+    blob = svg_store.sidecar_path(str(tmp_path), copy)
+    assert open(blob, "rb").read() == open(image, "rb").read()
+    assert svg_store.read_annotations(copy) == ANNOTATIONS
+
+
+def test_extract_embedded_image(tmp_path):
+    image = _image(tmp_path)
+    src = _embedded_svg(tmp_path, image)
+
+    blob = svg_store.extract_embedded_image(str(tmp_path), src)
+    assert blob.startswith("blobs/") and blob.endswith(".png")
+    assert open(tmp_path / blob, "rb").read() == open(image, "rb").read()
+    assert svg_store.find_source_href(src) == blob
+    assert svg_store.read_annotations(src) == ANNOTATIONS
+    assert svg_store.extract_embedded_image(str(tmp_path), src) is None
@@ -0,0 +1,19 @@
+import fiches
+from conftest import add_fiche
+
+
+def _flashes(client):
+    with client.session_transaction() as session:
+        return [message for _, message in session.get("_flashes", [])]
+
+
+def test_update_fiche_ignores_another_cpids_saved_svg(app_client):
+    client, conn = app_client
+    for langue in ("fr", "en"):
+        add_fiche(conn, "VUE1", langue, type="Cloison")
+    add_fiche(conn, "VUE1", "nl", type=fiches.TYPE_NAMES_NL["Cloison"])
+    versions = conn.execute("SELECT version FROM fiche_technique WHERE cpid = 'VUE1'").fetchall()
+    client.post("/update_fiche", data={"updateRef": "VUE1", "type": "Cloison",
+                                        "vue_eclatee_already_saved": "OTHER.svg"})
+    assert _flashes(client) == ["CPID 'VUE1' : aucune modification"]
+    assert conn.execute("SELECT version FROM fiche_technique WHERE cpid = 'VUE1'").fetchall() == versions